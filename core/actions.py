@@ -5,6 +5,7 @@ import os
 from datetime import datetime
 from core.websites import WEBSITES
 from core.apps import APPS
+from core.matcher import PhraseMatcher
 from memory.context import (
         set_context,
         get_current_context,
@@ -15,6 +16,21 @@ from memory.state import set_last_open_app, get_last_open_app
 from core.verifier import verify_system_action, _log_event
 
 
+# Catalog names compiled once; a lookup is one pass over the text, the longest whole-word name wins
+_website_matcher = PhraseMatcher((name, name) for name in WEBSITES)
+_app_matcher = PhraseMatcher((name, name) for name in APPS)
+
+
+def find_website(text: str):
+    match = _website_matcher.longest(text)
+    return match[1] if match else None
+
+
+def find_app(text: str):
+    match = _app_matcher.longest(text)
+    return match[1] if match else None
+
+
 # ---------- BASIC RESPONSES ----------
 
 def greet():
@@ -36,37 +52,35 @@ def exit_app():
 # ---------- WEBSITE ACTION ----------
 
 def open_website(text: str):
-    text = text.lower()
-    for name, url in WEBSITES.items():
-        if name in text:
-            if not verify_system_action(f"open website {name}", risk='low'):
-                return "Cancelled."
-            webbrowser.open(url)
-            set_context("open_website", name)
-            set_last_open_app(f"website:{name}")
-            _log_event('open_website', 'ok', {'name': name})
-            return f"Opening {name}."
-    return "Website not found."
+    name = find_website(text)
+    if name is None:
+        return "Website not found."
+    if not verify_system_action(f"open website {name}", risk='low'):
+        return "Cancelled."
+    webbrowser.open(WEBSITES[name])
+    set_context("open_website", name)
+    set_last_open_app(f"website:{name}")
+    _log_event('open_website', 'ok', {'name': name})
+    return f"Opening {name}."
 
 
 # ---------- SYSTEM APP ACTION ----------
 
 def open_app(text: str):
-    text = text.lower()
-    for name, info in APPS.items():
-        if name in text:
-            try:
-                if not verify_system_action(f"open app {name}", risk='low'):
-                    return "Cancelled."
-                subprocess.Popen(info["command"], shell=True)
-                set_context("open_app", name)
-                set_last_open_app(f"app:{name}")
-                _log_event('open_app', 'ok', {'name': name})
-                return f"Opening {name}."
-            except Exception:
-                _log_event('open_app', 'error', {'name': name})
-                return f"Failed to open {name}."
-    return "Application not found."
+    name = find_app(text)
+    if name is None:
+        return "Application not found."
+    try:
+        if not verify_system_action(f"open app {name}", risk='low'):
+            return "Cancelled."
+        subprocess.Popen(APPS[name]["command"], shell=True)
+        set_context("open_app", name)
+        set_last_open_app(f"app:{name}")
+        _log_event('open_app', 'ok', {'name': name})
+        return f"Opening {name}."
+    except Exception:
+        _log_event('open_app', 'error', {'name': name})
+        return f"Failed to open {name}."
 
 
 # ---------- CLOSE LAST APP (CONTEXT BASED) ----------
@@ -100,28 +114,26 @@ def close_last_app():
 
 
 def close_app_by_name(text: str):
-    text = text.lower()
-
-    for name, info in APPS.items():
-        if name in text:
-            process = info.get("process")
-            if not process:
-                return "I cannot close this app."
+    name = find_app(text)
+    if name is None:
+        return "I couldn't find the application to close."
 
-            if not verify_system_action(f"close app {name}", risk='low'):
-                return "Cancelled."
+    process = APPS[name].get("process")
+    if not process:
+        return "I cannot close this app."
 
-            result = os.system(f"taskkill /im {process} /f >nul 2>&1")
+    if not verify_system_action(f"close app {name}", risk='low'):
+        return "Cancelled."
 
-            if result != 0:
-                _log_event('close_app', 'not_running', {'name': name})
-                return f"{name} is not running."
+    result = os.system(f"taskkill /im {process} /f >nul 2>&1")
 
-            clear_current_context()
-            _log_event('close_app', 'ok', {'name': name})
-            return f"Closed {name}."
+    if result != 0:
+        _log_event('close_app', 'not_running', {'name': name})
+        return f"{name} is not running."
 
-    return "I couldn't find the application to close."
+    clear_current_context()
+    _log_event('close_app', 'ok', {'name': name})
+    return f"Closed {name}."
 
 
 def open_again():
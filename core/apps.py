@@ -1,7 +1,7 @@
 import os
 import subprocess
 from memory.context import set_context
-import os
+from core.matcher import load_catalog
 
 # command = how to open
 # process = how to close
@@ -31,3 +31,7 @@ APPS = {
         "process": "Code.exe"
     }
 }
+
+# Further apps (name -> {"command", "process"}) can be listed in data/apps.json
+APPS_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'apps.json')
+APPS.update(load_catalog(APPS_PATH))
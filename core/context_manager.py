@@ -1,12 +1,58 @@
-from typing import Dict, Any, List, Tuple
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from memory.short_term import ShortTermMemory
 from memory.long_term import LongTermMemory
+from memory.retrieval_cache import RetrievalCache
+from memory.shards import ShardedMemory, default_shards
 from memory.affect import detect_affect
 
 class ContextManager:
-    def __init__(self, short_window: int = 8):
+    def __init__(self, short_window: int = 8, cache_size: int = 256, user_id: Optional[str] = None,
+                 shards: Optional[ShardedMemory] = None):
         self.stm = ShortTermMemory(max_turns=short_window)
-        self.ltm = LongTermMemory()
+        self.user_id = user_id
+        # Repeated or reworded requests reuse earlier long-term retrievals
+        self.retrieval_cache = RetrievalCache(max_entries=cache_size)
+        if user_id is None:
+            # single-user: the process's store at the default paths
+            self._shards = None
+            self.ltm = LongTermMemory.shared()
+            self.ltm.add_listener(self._on_memory_added)
+        else:
+            # per-user: the user's shard is leased for each operation, so it can be unloaded between them
+            self._shards = shards or default_shards()
+            self.ltm = None
+            self._listening = None
+
+    @contextmanager
+    def memory(self) -> Iterator[LongTermMemory]:
+        """This user's long-term memory, held open for the duration of the block."""
+        if self._shards is None:
+            yield self.ltm
+            return
+        with self._shards.lease(self.user_id) as ltm:
+            if self._listening is None or self._listening() is not ltm:
+                # first use, or the shard was unloaded and reopened: memories added in between
+                # were not seen by the listener
+                ltm.add_listener(self._on_memory_added)
+                self._listening = weakref.ref(ltm)
+                self.retrieval_cache.clear()
+            yield ltm
+
+    def close(self):
+        # Stop listening to a shared store once this context is discarded
+        if self._shards is None:
+            if self.ltm is not None:
+                self.ltm.remove_listener(self._on_memory_added)
+                self.ltm.close()
+                self.ltm = None
+            return
+        if self._listening is not None:
+            ltm = self._listening()
+            if ltm is not None:
+                ltm.remove_listener(self._on_memory_added)
+            self._listening = None
 
     def push_user(self, text: str):
         self.stm.push_user(text)
@@ -14,11 +60,34 @@ class ContextManager:
     def push_assistant(self, text: str):
         self.stm.push_assistant(text)
 
+    def _on_memory_added(self, entry: Dict[str, Any], tokens: set):
+        # The new memory's words changed df, which reweighs every memory that shares one, and
+        # in dense mode it can match queries without sharing any word (character n-grams), so
+        # any cached ranking may be stale (see memory/retrieval_cache.py)
+        self.retrieval_cache.clear()
+
+    def retrieve(self, query: str, tags: Optional[List[str]] = None, top_k: int = 5) -> List[Dict[str, Any]]:
+        with self.memory() as ltm:
+            key = RetrievalCache.make_key(ltm.tokenize(query), tags, top_k)
+            version = self.retrieval_cache.version
+            ids = self.retrieval_cache.get(key)
+            if ids is not None:
+                hits = [ltm.get(i) for i in ids]
+                if all(h is not None for h in hits):
+                    return hits
+            hits = ltm.retrieve(query, tags=tags, top_k=top_k)
+            # skipped if a memory was added while retrieving
+            self.retrieval_cache.put(key, [h['id'] for h in hits], version)
+            return hits
+
+    def retrieval_stats(self) -> Dict[str, Any]:
+        return self.retrieval_cache.stats()
+
     def build_context(self, user_input: str) -> Dict[str, Any]:
         # Affect
         affect = detect_affect(user_input)
         # Long-term retrieval using the query
-        ltm_hits = self.ltm.retrieve(user_input, top_k=5)
+        ltm_hits = self.retrieve(user_input, top_k=5)
         # Short-term window
         window = self.stm.get_window()
         return {
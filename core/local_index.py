@@ -0,0 +1,473 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from nlp.preprocess import split_words, tokenize
+
+# Offline document search: a BM25 inverted index over a directory of .txt / .md / .html files.
+#
+# The index is a list of immutable segments plus a manifest naming them. A refresh walks the
+# directory, parses only files that are new or whose mtime/size changed, and writes them as
+# one new segment; a file's previous version (or a removed file) simply stops being referenced
+# by the manifest, which maps each file to its (segment, doc) slot. Past MAX_SEGMENTS the live
+# documents are merged into a single segment. The manifest is replaced atomically, so a crash
+# leaves the previous index in place, and stray segment directories are removed on load.
+#
+# Per segment directory:
+#   terms.json   term -> [start, count] into the postings arrays
+#   ids.u32      doc numbers of each term's postings, term after term
+#   tfs.u32      term frequencies, parallel to ids.u32
+#   lengths.u32  tokens per doc
+#   text.bin     extracted text of every doc, back to back (for snippets)
+#   docs.jsonl   per doc: path, title and its slice of text.bin
+# The arrays and text are memory-mapped, so only the postings a query touches are read.
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+DOCS_DIR = os.path.join(BASE_DIR, 'docs')
+INDEX_DIR = os.path.join(BASE_DIR, 'docs_index')
+EXTENSIONS = {'.txt': 'text', '.md': 'markdown', '.markdown': 'markdown', '.html': 'html', '.htm': 'html'}
+MANIFEST = 'manifest.json'
+K1 = 1.2
+B = 0.75
+MAX_SEGMENTS = 8
+# seconds between directory scans triggered by searches
+REFRESH_INTERVAL = 30.0
+SNIPPET_CHARS = 240
+# Question words dropped from queries ("What is X?") as long as something else is left
+QUERY_STOPWORDS = {
+    'what', 'who', 'whom', 'which', 'when', 'where', 'why', 'how', 'is', 'are', 'was', 'were',
+    'do', 'does', 'did', 'the', 'a', 'an', 'of', 'in', 'on', 'to', 'for', 'and', 'or', 'tell',
+    'me', 'about', 'please',
+}
+
+
+# ---------- document parsing ----------
+
+class _HTMLText(HTMLParser):
+    _SKIP = {'script', 'style', 'noscript', 'template'}
+    _BLOCK = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ''
+        self.parts: List[str] = []
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skip += 1
+        elif tag == 'title':
+            self._in_title = True
+        elif tag in self._BLOCK:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif tag == 'title':
+            self._in_title = False
+        elif tag in self._BLOCK:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        if self._in_title:
+            self.title += data
+        else:
+            self.parts.append(data)
+
+
+_MD_LINK = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+_MD_MARKUP = re.compile(r'^\s{0,3}(?:#{1,6}|>|[-*+]|\d+\.)\s+|[*`]+|^[-=]{3,}\s*$', re.M)
+
+
+def _squash(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def read_document(path: str, kind: str) -> Tuple[str, str]:
+    """(title, plain text) of a document; the title falls back to the file name."""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        raw = f.read()
+    title = ''
+    if kind == 'html':
+        parser = _HTMLText()
+        parser.feed(raw)
+        parser.close()
+        title = _squash(parser.title)
+        text = ''.join(parser.parts)
+    elif kind == 'markdown':
+        lines = raw.splitlines()
+        for i, line in enumerate(lines):
+            if line.startswith('# '):
+                # the heading becomes the title rather than the start of every snippet
+                title = _squash(line[2:])
+                raw = '\n'.join(lines[:i] + lines[i + 1:])
+                break
+        text = _MD_MARKUP.sub(' ', _MD_LINK.sub(r'\1', raw))
+    else:
+        text = raw
+        first = next((line.strip() for line in raw.splitlines() if line.strip()), '')
+        if len(first) <= 80:
+            title = first
+    return title or Path(path).stem, _squash(text)
+
+
+# ---------- segments ----------
+
+def _map_array(path: str, dtype) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class _Segment:
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'terms.json'), 'r', encoding='utf-8') as f:
+            self.terms: Dict[str, List[int]] = json.load(f)
+        self.ids = _map_array(os.path.join(directory, 'ids.u32'), '<u4')
+        self.tfs = _map_array(os.path.join(directory, 'tfs.u32'), '<u4')
+        self.lengths = _map_array(os.path.join(directory, 'lengths.u32'), '<u4')
+        with open(os.path.join(directory, 'docs.jsonl'), 'r', encoding='utf-8') as f:
+            self.docs = [json.loads(line) for line in f]
+        self._text: Optional[mmap.mmap] = None
+        text_path = os.path.join(directory, 'text.bin')
+        if os.path.getsize(text_path):
+            with open(text_path, 'rb') as f:
+                self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        span = self.terms.get(term)
+        if span is None:
+            return self.ids[:0], self.tfs[:0]
+        start, count = span
+        return self.ids[start:start + count], self.tfs[start:start + count]
+
+    def text(self, doc: int) -> str:
+        start, n = self.docs[doc]['text']
+        return self._text[start:start + n].decode('utf-8') if n else ''
+
+
+def _write_segment(directory: str, docs: Sequence[Dict[str, Any]]):
+    # docs: {'path', 'title', 'text'}; doc numbers are positions in this list. A directory
+    # of this name can only be left over from an interrupted refresh.
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    lengths = np.zeros(len(docs), dtype='<u4')
+    with open(os.path.join(directory, 'text.bin'), 'wb') as text_f, \
+            open(os.path.join(directory, 'docs.jsonl'), 'w', encoding='utf-8') as docs_f:
+        pos = 0
+        for n, doc in enumerate(docs):
+            toks = split_words(doc['title'] + ' ' + doc['text'])
+            lengths[n] = len(toks)
+            tf: Dict[str, int] = {}
+            for t in toks:
+                tf[t] = tf.get(t, 0) + 1
+            for t, c in tf.items():
+                postings.setdefault(t, []).append((n, c))
+            data = doc['text'].encode('utf-8')
+            text_f.write(data)
+            docs_f.write(json.dumps({'path': doc['path'], 'title': doc['title'], 'text': [pos, len(data)]},
+                                    ensure_ascii=False) + '\n')
+            pos += len(data)
+    terms: Dict[str, List[int]] = {}
+    ids: List[int] = []
+    tfs: List[int] = []
+    for t in sorted(postings):
+        plist = postings[t]
+        terms[t] = [len(ids), len(plist)]
+        ids.extend(n for n, _ in plist)
+        tfs.extend(c for _, c in plist)
+    np.asarray(ids, dtype='<u4').tofile(os.path.join(directory, 'ids.u32'))
+    np.asarray(tfs, dtype='<u4').tofile(os.path.join(directory, 'tfs.u32'))
+    lengths.tofile(os.path.join(directory, 'lengths.u32'))
+    with open(os.path.join(directory, 'terms.json'), 'w', encoding='utf-8') as f:
+        json.dump(terms, f, ensure_ascii=False)
+
+
+class _State:
+    """An immutable view of the index: its segments and which of their docs are live."""
+
+    def __init__(self, manifest: Dict[str, Any], segments: Dict[str, _Segment]):
+        self.manifest = manifest
+        self.segments = segments
+        self.live = {name: np.zeros(len(seg.docs), dtype=bool) for name, seg in segments.items()}
+        for seg_name, doc, _, _ in manifest['files'].values():
+            self.live[seg_name][doc] = True
+        self.n_docs = len(manifest['files'])
+        total = sum(int(seg.lengths[self.live[name]].sum()) for name, seg in segments.items())
+        self.avgdl = max(1.0, total / self.n_docs) if self.n_docs else 1.0
+
+
+def _snippet(text: str, terms: Sequence[str]) -> str:
+    # The SNIPPET_CHARS window holding the most distinct query terms, cut at word boundaries
+    if not text:
+        return ''
+    if len(text) <= SNIPPET_CHARS:
+        return text
+    pattern = re.compile(r'(?<![^\W_])(' + '|'.join(re.escape(t) for t in terms) + r')(?![^\W_])', re.I)
+    hits = []
+    for m in pattern.finditer(text) if terms else ():
+        hits.append((m.start(), m.group(1).lower()))
+        if len(hits) >= 256:
+            break
+    best_start, best_count = 0, 0
+    for i, (p, _) in enumerate(hits):
+        start = max(0, p - SNIPPET_CHARS // 4)
+        count = len({t for q, t in hits[i:] if q < start + SNIPPET_CHARS})
+        if count > best_count:
+            best_start, best_count = start, count
+    end = min(len(text), best_start + SNIPPET_CHARS)
+    if best_start > 0:
+        space = text.find(' ', best_start)
+        best_start = space + 1 if 0 <= space < best_start + 40 else best_start
+    if end < len(text):
+        space = text.rfind(' ', best_start, end)
+        end = space if space > best_start else end
+    return ('...' if best_start > 0 else '') + text[best_start:end] + ('...' if end < len(text) else '')
+
+
+class LocalIndex:
+    def __init__(self, docs_dir: Optional[str] = None, index_dir: Optional[str] = None,
+                 refresh_interval: float = REFRESH_INTERVAL):
+        self.docs_dir = docs_dir or os.getenv('JARVIS_DOCS_DIR', DOCS_DIR)
+        self.index_dir = index_dir or INDEX_DIR
+        self.refresh_interval = refresh_interval
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._last_scan = 0.0
+        self._state = self._load()
+
+    # ----- persistence -----
+
+    def _empty_manifest(self) -> Dict[str, Any]:
+        return {'docs_dir': os.path.abspath(self.docs_dir), 'next_segment': 1, 'segments': [], 'files': {}}
+
+    def _load(self) -> _State:
+        try:
+            with open(os.path.join(self.index_dir, MANIFEST), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            segments = {name: _Segment(os.path.join(self.index_dir, name)) for name in manifest['segments']}
+        except (OSError, ValueError, KeyError):
+            # missing or damaged: start empty, the next refresh indexes everything again
+            manifest, segments = self._empty_manifest(), {}
+        if manifest.get('docs_dir') != os.path.abspath(self.docs_dir):
+            # built over another directory; its paths mean nothing here
+            manifest = dict(self._empty_manifest(), next_segment=manifest.get('next_segment', 1))
+            segments = {}
+        self._remove_unreferenced(manifest)
+        return _State(manifest, segments)
+
+    def _remove_unreferenced(self, manifest: Dict[str, Any]):
+        # Segments dropped by a refresh or left by an interrupted one. Removal can fail while
+        # a search still maps the files (Windows); it is retried on the next refresh or load.
+        keep = set(manifest['segments'])
+        for name in os.listdir(self.index_dir):
+            if name.startswith('seg_') and name not in keep:
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+    def _save_manifest(self, manifest: Dict[str, Any]):
+        path = os.path.join(self.index_dir, MANIFEST)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    # ----- building -----
+
+    def _scan(self) -> Dict[str, List[int]]:
+        found: Dict[str, List[int]] = {}
+        if not os.path.isdir(self.docs_dir):
+            return found
+        for root, dirs, files in os.walk(self.docs_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if os.path.splitext(name)[1].lower() not in EXTENSIONS:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found[os.path.relpath(path, self.docs_dir).replace(os.sep, '/')] = [st.st_mtime_ns, st.st_size]
+        return found
+
+    def refresh(self) -> Dict[str, int]:
+        """Index new and changed files, forget removed ones. Returns the counts."""
+        with self._build_lock:
+            self._last_scan = time.time()
+            state = self._state
+            manifest = state.manifest
+            files = dict(manifest['files'])
+            found = self._scan()
+            changed = [rel for rel, stat in found.items() if rel not in files or files[rel][2:] != stat]
+            removed = [rel for rel in files if rel not in found]
+            if not changed and not removed:
+                return {'added': 0, 'removed': 0, 'docs': state.n_docs}
+            for rel in removed:
+                del files[rel]
+            next_segment = manifest['next_segment']
+            segments = list(manifest['segments'])
+            docs = []
+            for rel in changed:
+                path = os.path.join(self.docs_dir, rel)
+                try:
+                    title, text = read_document(path, EXTENSIONS[os.path.splitext(rel)[1].lower()])
+                except OSError:
+                    files.pop(rel, None)
+                    continue
+                docs.append({'path': rel, 'title': title, 'text': text, 'stat': found[rel]})
+            if docs:
+                name = f'seg_{next_segment:06d}'
+                next_segment += 1
+                _write_segment(os.path.join(self.index_dir, name), docs)
+                segments.append(name)
+                for n, doc in enumerate(docs):
+                    files[doc['path']] = [name, n] + doc['stat']
+            in_use = {v[0] for v in files.values()}
+            segments = [s for s in segments if s in in_use]
+            if len(segments) > MAX_SEGMENTS:
+                name = f'seg_{next_segment:06d}'
+                next_segment += 1
+                self._merge(state, docs, files, name)
+                segments = [name]
+            manifest = {'docs_dir': manifest['docs_dir'], 'next_segment': next_segment, 'segments': segments,
+                        'files': files}
+            self._save_manifest(manifest)
+            loaded = {s: state.segments.get(s) or _Segment(os.path.join(self.index_dir, s)) for s in segments}
+            new_state = _State(manifest, loaded)
+            with self._lock:
+                self._state = new_state
+            self._remove_unreferenced(manifest)
+            return {'added': len(docs), 'removed': len(removed), 'docs': new_state.n_docs}
+
+    def _merge(self, state: _State, fresh: List[Dict[str, Any]], files: Dict[str, List[Any]], name: str):
+        # Rewrites every live doc into one segment from the stored text (no re-parsing);
+        # updates files in place to point at it
+        fresh_by_path = {d['path']: d for d in fresh}
+        docs = []
+        for rel, (seg_name, doc, mtime, size) in files.items():
+            d = fresh_by_path.get(rel)
+            if d is None or d['stat'] != [mtime, size]:
+                seg = state.segments[seg_name]
+                d = {'path': rel, 'title': seg.docs[doc]['title'], 'text': seg.text(doc)}
+            docs.append(d)
+        _write_segment(os.path.join(self.index_dir, name), docs)
+        for n, d in enumerate(docs):
+            files[d['path']] = [name, n] + files[d['path']][2:]
+
+    def _maybe_refresh(self):
+        if time.time() - self._last_scan >= self.refresh_interval and not self._build_lock.locked():
+            self.refresh()
+
+    # ----- searching -----
+
+    def search(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
+        self._maybe_refresh()
+        state = self._state
+        terms = list(dict.fromkeys(tokenize(query)))
+        content = [t for t in terms if t not in QUERY_STOPWORDS]
+        terms = content or terms
+        if not terms or not state.n_docs or max_results <= 0:
+            return []
+        # postings of each term restricted to live docs, per segment
+        hits: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        df = np.zeros(len(terms))
+        for name, seg in state.segments.items():
+            live = state.live[name]
+            per_term = []
+            for j, t in enumerate(terms):
+                ids, tfs = seg.postings(t)
+                keep = live[ids]
+                ids, tfs = ids[keep], tfs[keep]
+                df[j] += len(ids)
+                per_term.append((ids, tfs))
+            hits[name] = per_term
+        idf = np.log(1.0 + (state.n_docs - df + 0.5) / (df + 0.5))
+        found: List[Tuple[float, str, int]] = []
+        for name, per_term in hits.items():
+            seg = state.segments[name]
+            scores = None
+            for j, (ids, tfs) in enumerate(per_term):
+                if not len(ids):
+                    continue
+                if scores is None:
+                    scores = np.zeros(len(seg.docs))
+                tf = tfs.astype(np.float64)
+                norm = K1 * (1.0 - B + B * seg.lengths[ids] / state.avgdl)
+                scores[ids] += idf[j] * tf * (K1 + 1.0) / (tf + norm)
+            if scores is None:
+                continue
+            k = min(max_results, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            found.extend((float(scores[d]), name, int(d)) for d in top if scores[d] > 0)
+        found.sort(key=lambda x: -x[0])
+        now = datetime.utcnow().isoformat()
+        results = []
+        for score, name, doc in found[:max_results]:
+            seg = state.segments[name]
+            meta = seg.docs[doc]
+            results.append({
+                "title": meta['title'],
+                "snippet": _snippet(seg.text(doc), terms),
+                "source": Path(os.path.abspath(os.path.join(self.docs_dir, meta['path']))).as_uri(),
+                "retrieved_at": now,
+            })
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        state = self._state
+        return {
+            'docs': state.n_docs,
+            'segments': len(state.segments),
+            'terms': sum(len(s.terms) for s in state.segments.values()),
+            'docs_dir': self.docs_dir,
+        }
+
+
+_default: Optional[LocalIndex] = None
+_default_lock = threading.Lock()
+
+
+def default_index() -> LocalIndex:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = LocalIndex()
+        return _default
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or update the local document search index.")
+    parser.add_argument('--docs', help="directory of .txt/.md/.html documents (default: data/docs)")
+    parser.add_argument('--query', help="search the index after updating it")
+    args = parser.parse_args(argv)
+
+    index = LocalIndex(docs_dir=args.docs)
+    start = time.time()
+    counts = index.refresh()
+    print(f"Indexed {counts['added']} new or changed, removed {counts['removed']}; "
+          f"{counts['docs']} documents in {time.time() - start:.2f}s.")
+    if args.query:
+        for r in index.search(args.query):
+            print(f"- {r['title']} ({r['source']})\n  {r['snippet']}")
+
+
+if __name__ == '__main__':
+    main()
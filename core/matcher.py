@@ -0,0 +1,108 @@
+import json
+import os
+from typing import Any, Dict, Generic, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+# Multi-pattern matching for catalog names (apps, websites) in user text. The names are
+# compiled once into an Aho-Corasick automaton, so finding them is a single pass over the
+# text however many names the catalog holds. Only whole-word matches count ("calc" does not
+# match inside "calculator"), and the longest one wins ("visual studio code" over "code").
+
+V = TypeVar('V')
+
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() or ch == '_'
+
+
+class PhraseMatcher(Generic[V]):
+    def __init__(self, phrases: Iterable[Tuple[str, V]] = ()):
+        # node 0 is the root; per node: transitions, failure link, the phrase ending here
+        # (index into _phrases, or -1) and the nearest node on the failure chain that ends one
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[int] = [-1]
+        self._out_link: List[int] = [0]
+        self._phrases: List[Tuple[str, V]] = []
+        for phrase, value in phrases:
+            self._insert(phrase.lower(), value)
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self._phrases)
+
+    def _insert(self, phrase: str, value: V):
+        if not phrase:
+            return
+        node = 0
+        for ch in phrase:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(-1)
+                self._out_link.append(0)
+            node = nxt
+        if self._out[node] == -1:
+            self._out[node] = len(self._phrases)
+            self._phrases.append((phrase, value))
+        else:
+            # a repeated name keeps its latest value, as a dict update would
+            self._phrases[self._out[node]] = (phrase, value)
+
+    def _build(self):
+        # Breadth-first, so a node's failure target is finished before its children's
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                ft = self._fail[child] = self._goto[f].get(ch, 0)
+                self._out_link[child] = ft if self._out[ft] != -1 else self._out_link[ft]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str, V]]:
+        """Whole-word matches as (start, end, phrase, value), in order of their end."""
+        text = text.lower()
+        goto, fail, out, out_link = self._goto, self._fail, self._out, self._out_link
+        node = 0
+        n = len(text)
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not node or (i + 1 < n and _is_word(text[i + 1])):
+                continue
+            # every phrase ending here, longest first
+            m = node if out[node] != -1 else out_link[node]
+            while m:
+                phrase, value = self._phrases[out[m]]
+                start = i + 1 - len(phrase)
+                if start == 0 or not _is_word(text[start - 1]):
+                    yield start, i + 1, phrase, value
+                m = out_link[m]
+
+    def longest(self, text: str) -> Optional[Tuple[str, V]]:
+        """The longest whole-word match (the leftmost on a tie), or None."""
+        best = None
+        for start, end, phrase, value in self.finditer(text):
+            # matches arrive in order of end, so on a tie the one kept is the leftmost
+            if best is None or end - start > best[1] - best[0]:
+                best = (start, end, phrase, value)
+        return None if best is None else (best[2], best[3])
+
+
+def load_catalog(path: str) -> Dict[str, Any]:
+    """Extra catalog entries from a JSON object file (name -> entry); empty if it does not exist."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f'{path}: expected a JSON object of name -> entry')
+    return {str(k).lower(): v for k, v in data.items()}
@@ -1,7 +1,8 @@
 # jarvis/core/question_analyzer.py
 
 from enum import Enum
-import re
+
+from nlp.preprocess import compile_phrases, has_phrase, starts_with_phrase, tokenize
 
 
 # =========================
@@ -22,37 +23,47 @@ class QuestionType(Enum):
 
 TIME_KEYWORDS = [
     "today", "current", "now", "latest", "present",
-    "this year", "this month", "right now"
+    "this year", "this month", "right now", "currently"
 ]
 
 REAL_TIME_KEYWORDS = [
-    "price", "rate", "cost", "weather", "score", "stock"
+    "price", "rate", "cost", "weather", "score", "stock",
+    "prices", "rates", "costs", "scores", "stocks"
 ]
 
+UNANSWERABLE_KEYWORDS = ["password", "otp", "my account", "my email"]
+
+OPINION_STARTS = ["why", "how", "should", "is it", "do you think"]
+
+# Matched as whole words on the shared tokens, so "now" does not fire inside "know" or
+# "rate" inside "separate"; inflected forms are listed explicitly above
+_UNANSWERABLE = compile_phrases(UNANSWERABLE_KEYWORDS)
+_REAL_TIME = compile_phrases(REAL_TIME_KEYWORDS)
+_TIME = compile_phrases(TIME_KEYWORDS)
+_OPINION = compile_phrases(OPINION_STARTS)
+
 
 # =========================
 # Question Classification
 # =========================
 
 def classify_question(question: str) -> QuestionType:
-    q = question.lower()
+    tokens = tokenize(question)
 
     # Unanswerable / private
-    if re.search(r"\b(password|otp|my account|my email)\b", q):
+    if has_phrase(tokens, _UNANSWERABLE):
         return QuestionType.UNANSWERABLE
 
     # Real-time numeric (highest risk)
-    for word in REAL_TIME_KEYWORDS:
-        if word in q:
-            return QuestionType.REAL_TIME_NUMERIC
+    if has_phrase(tokens, _REAL_TIME):
+        return QuestionType.REAL_TIME_NUMERIC
 
     # Time-sensitive factual
-    for word in TIME_KEYWORDS:
-        if word in q:
-            return QuestionType.TIME_SENSITIVE_FACT
+    if has_phrase(tokens, _TIME):
+        return QuestionType.TIME_SENSITIVE_FACT
 
     # Opinion / explanation
-    if q.startswith(("why", "how", "should", "is it", "do you think")):
+    if starts_with_phrase(tokens, _OPINION):
         return QuestionType.OPINION
 
     # Default safe case
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from core.question_analyzer import QuestionType, classify_question
+from nlp.preprocess import normalize
+
+# Web search results cached in memory and in an append-only file, keyed by the normalized
+# query: case and whitespace folded and trailing ?/./! dropped, but other punctuation kept,
+# since it can change the question ("2+2" vs "2*2", "c++" vs "c"). How long a result stays
+# fresh follows the kind of question: facts keep for days, "current"/"today" questions for
+# minutes, prices and scores for seconds. Past that a result is still served
+# for up to STALE_FACTOR times its TTL while a background search refreshes it; older results
+# are searched again before answering. The least recently used entries are dropped past
+# max_entries, and the file is rewritten once it holds COMPACT_FACTOR times that many lines.
+
+CACHE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'search_cache.jsonl')
+MAX_ENTRIES = 512
+TTL_BY_TYPE = {
+    QuestionType.TIMELESS_FACT: 7 * 24 * 3600,
+    QuestionType.OPINION: 24 * 3600,
+    QuestionType.TIME_SENSITIVE_FACT: 10 * 60,
+    QuestionType.REAL_TIME_NUMERIC: 30,
+    # private questions are never cached
+    QuestionType.UNANSWERABLE: 0,
+}
+STALE_FACTOR = 1.0
+COMPACT_FACTOR = 2
+
+
+def make_key(query: str) -> str:
+    return normalize(query).rstrip('?.!').rstrip()
+
+
+class _Entry:
+    __slots__ = ('results', 'requested', 'fetched_at', 'ttl')
+
+    def __init__(self, results: List[Dict[str, Any]], requested: int, fetched_at: float, ttl: float):
+        self.results = results
+        # max_results of the search that produced these; serves any request up to it
+        self.requested = requested
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+
+    def covers(self, max_results: int) -> bool:
+        return max_results <= self.requested or len(self.results) < self.requested
+
+    def to_json(self, key: str) -> Dict[str, Any]:
+        return {'key': key, 'results': self.results, 'requested': self.requested,
+                'fetched_at': self.fetched_at, 'ttl': self.ttl}
+
+
+class SearchCache:
+    def __init__(self, path: Optional[str] = CACHE_PATH, max_entries: Optional[int] = None):
+        self.path = path
+        if max_entries is None:
+            max_entries = int(os.getenv('JARVIS_SEARCH_CACHE_SIZE', MAX_ENTRIES))
+        self.max_entries = max_entries
+        self._items: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._lines = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        now = time.time()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # torn last line from an interrupted append
+                    continue
+                self._lines += 1
+                entry = _Entry(rec['results'], rec['requested'], rec['fetched_at'], rec['ttl'])
+                self._items.pop(rec['key'], None)
+                if now - entry.fetched_at < entry.ttl * (1 + STALE_FACTOR):
+                    self._items[rec['key']] = entry
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def _persist(self, key: str, entry: _Entry):
+        # called with the lock held
+        if not self.path:
+            return
+        if self._lines >= max(1, self.max_entries) * COMPACT_FACTOR:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for k, e in self._items.items():
+                    f.write(json.dumps(e.to_json(k), ensure_ascii=False) + '\n')
+            os.replace(tmp, self.path)
+            self._lines = len(self._items)
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry.to_json(key), ensure_ascii=False) + '\n')
+        self._lines += 1
+
+    def _store(self, key: str, results: List[Dict[str, Any]], max_results: int, ttl: float):
+        # empty results are usually a failed search, so they are not kept
+        if ttl <= 0 or not results or self.max_entries <= 0:
+            return
+        entry = _Entry(results, max_results, time.time(), ttl)
+        with self._lock:
+            self._items[key] = entry
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+            self._persist(key, entry)
+
+    def _refresh(self, key: str, query: str, max_results: int, ttl: float,
+                 fetch: Callable[[str, int], List[Dict[str, Any]]]):
+        try:
+            self._store(key, fetch(query, max_results), max_results, ttl)
+        except Exception:
+            # the stale entry stays until it runs out; the next request past that retries
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_fetch(self, query: str, max_results: int, fetch: Callable[[str, int], List[Dict[str, Any]]],
+                     namespace: str = '') -> List[Dict[str, Any]]:
+        # namespace keeps results from different providers apart
+        key = f'{namespace}:{make_key(query)}' if namespace else make_key(query)
+        ttl = TTL_BY_TYPE.get(classify_question(query), 0)
+        now = time.time()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry.covers(max_results):
+                age = now - entry.fetched_at
+                if age < entry.ttl:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return [dict(r) for r in entry.results[:max_results]]
+                if age < entry.ttl * (1 + STALE_FACTOR) and ttl > 0:
+                    self._items.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(target=self._refresh, args=(key, query, entry.requested, ttl, fetch),
+                                         daemon=True).start()
+                    return [dict(r) for r in entry.results[:max_results]]
+            self.misses += 1
+        results = fetch(query, max_results)
+        self._store(key, results, max_results, ttl)
+        return [dict(r) for r in results]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.stale_hits + self.misses
+            return {
+                'size': len(self._items),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.stale_hits) / total if total else 0.0,
+            }
@@ -1,23 +1,106 @@
 # core/search_engine.py
 
-from ddgs import DDGS
+import os
 from datetime import datetime
+from typing import Dict, List, Optional
 
+from core.search_cache import SearchCache
 
-def search_web(query: str, max_results: int = 5) -> list:
+# Search goes through pluggable providers, each returning the same result dicts:
+#   {"title", "snippet", "source", "retrieved_at"}
+# Built in: "ddg" (DuckDuckGo web search, the default for search_web) and "local" (BM25 over
+# the documents in data/docs, see core/local_index.py; the default for search_offline).
+# Others can be added with register_provider. Network providers go through the result cache.
+
+DEFAULT_PROVIDER = 'ddg'
+DEFAULT_OFFLINE_PROVIDER = 'local'
+
+# Results are reused across calls; see core/search_cache.py for how long
+_cache = SearchCache()
+
+
+class SearchProvider:
+    name = ''
+    # results are cached (see core/search_cache.py); worth it for network searches only
+    cached = False
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, str]]:
+        raise NotImplementedError
+
+
+class DuckDuckGoProvider(SearchProvider):
+    name = 'ddg'
+    cached = True
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, str]]:
+        # imported here so offline use never loads the web client
+        from ddgs import DDGS
+
+        results = []
+
+        with DDGS() as ddgs:
+            for r in ddgs.text(query, max_results=max_results):
+                results.append({
+                    "title": r.get("title"),
+                    "snippet": r.get("body"),
+                    "source": r.get("href"),
+                    "retrieved_at": datetime.utcnow().isoformat()
+                })
+
+        return results
+
+
+class LocalProvider(SearchProvider):
+    name = 'local'
+
+    def __init__(self, index=None):
+        self._index = index
+
+    def search(self, query: str, max_results: int) -> List[Dict[str, str]]:
+        if self._index is None:
+            from core.local_index import default_index
+            self._index = default_index()
+        return self._index.search(query, max_results)
+
+
+_providers: Dict[str, SearchProvider] = {}
+
+
+def register_provider(provider: SearchProvider):
+    _providers[provider.name] = provider
+
+
+register_provider(DuckDuckGoProvider())
+register_provider(LocalProvider())
+
+
+def get_provider(name: Optional[str] = None) -> SearchProvider:
+    name = name or os.getenv('JARVIS_SEARCH_PROVIDER', DEFAULT_PROVIDER)
+    provider = _providers.get(name)
+    if provider is None:
+        raise ValueError(f"Unknown search provider: {name}")
+    return provider
+
+
+def search_web(query: str, max_results: int = 5, provider: Optional[str] = None) -> list:
     """
-    Execute a live web search and return raw results.
+    Return search results for the query from the given provider (default: web search).
+    Cached providers answer from the cache while results are fresh (or briefly stale, with
+    a refresh in the background), otherwise with a live search.
     """
+    p = get_provider(provider)
+    if p.cached:
+        return _cache.get_or_fetch(query, max_results, p.search, namespace=p.name)
+    return p.search(query, max_results)
 
-    results = []
 
-    with DDGS() as ddgs:
-        for r in ddgs.text(query, max_results=max_results):
-            results.append({
-                "title": r.get("title"),
-                "snippet": r.get("body"),
-                "source": r.get("href"),
-                "retrieved_at": datetime.utcnow().isoformat()
-            })
+def search_offline(query: str, max_results: int = 5) -> list:
+    """
+    Search without the network: the local document index unless JARVIS_OFFLINE_PROVIDER
+    names another provider.
+    """
+    return search_web(query, max_results, provider=os.getenv('JARVIS_OFFLINE_PROVIDER', DEFAULT_OFFLINE_PROVIDER))
+
 
-    return results
+def search_cache_stats() -> dict:
+    return _cache.stats()
@@ -1,3 +1,7 @@
+import os
+
+from core.matcher import load_catalog
+
 WEBSITES = {
     "google": "https://www.google.com",
     "youtube": "https://www.youtube.com",
@@ -5,3 +9,7 @@ WEBSITES = {
     "github": "https://github.com",
     "facebook": "https://www.facebook.com"
 }
+
+# Further sites (name -> url) can be listed in data/websites.json
+WEBSITES_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'websites.json')
+WEBSITES.update(load_catalog(WEBSITES_PATH))
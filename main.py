@@ -8,7 +8,7 @@ import os
 
 # Optional offline QA utilities
 from core.question_normalizer import normalize_question
-from core.search_engine import search_web
+from core.search_engine import search_offline
 from core.verifier import verify_prime_minister
 from core.answer_generator import generate_final_answer
 
@@ -37,13 +37,13 @@ def get_user_input():
 
 def offline_answer(user_input: str) -> str:
     """
-    Offline/hybrid fallback using web search. For specific recognized
+    Offline fallback using the local document index (no network). For specific recognized
     patterns (e.g., "Prime Minister" questions) it performs verification.
-    Otherwise it returns a concise snippet from top search result.
+    Otherwise it returns a concise snippet from the top search result.
     """
     try:
         q = normalize_question(user_input)
-        results = search_web(q, max_results=5)
+        results = search_offline(q, max_results=5)
 
         if not results:
             return "I couldn't retrieve any information right now."
@@ -79,7 +79,7 @@ def main():
     from ui.server import app as flask_app
 
     def run_server():
-        flask_app.run(host='127.0.0.1', port=5000, debug=False)
+        flask_app.run(host='127.0.0.1', port=5000, debug=False, threaded=True)
 
     t = Thread(target=run_server, daemon=True)
     t.start()
@@ -1,18 +1,35 @@
 from typing import Dict
 
+from nlp.preprocess import compile_phrases, has_phrase, normalize, tokenize
+
 # Simple affect detector using keyword heuristics
 
 URGENCY = {"asap", "urgent", "hurry", "quick", "now", "immediately", "fast", "quickly"}
 FRUSTRATION = {"not working", "broken", "annoyed", "frustrated", "why", "again?", "error", "doesn't work", "doesnt work"}
 
 
+def _is_words(phrase: str) -> bool:
+    return all(ch.isalnum() or ch in " '" for ch in phrase)
+
+
+# Keywords are matched as whole words on the shared tokens ("now" does not fire inside
+# "know"); the few that rely on punctuation ("again?") are looked for in the normalized text
+_URGENCY = compile_phrases(URGENCY)
+_FRUSTRATION = compile_phrases(p for p in FRUSTRATION if _is_words(p))
+_FRUSTRATION_MARKED = [normalize(p) for p in FRUSTRATION if not _is_words(p)]
+
+
 def detect_affect(text: str) -> Dict[str, str]:
-    t = text.lower()
+    tokens = tokenize(text)
     tone = "neutral"
-    if any(w in t for w in URGENCY):
+    if has_phrase(tokens, _URGENCY):
         tone = "brief-fast"
-    if any(w in t for w in FRUSTRATION):
+    if has_phrase(tokens, _FRUSTRATION):
         tone = "empathetic-reassuring"
+    elif _FRUSTRATION_MARKED:
+        t = normalize(text)
+        if any(p in t for p in _FRUSTRATION_MARKED):
+            tone = "empathetic-reassuring"
     return {
         "tone": tone,
         "urgency": "high" if tone == "brief-fast" else "normal",
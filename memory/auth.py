@@ -1,13 +1,22 @@
 import os
+import re
 import json
 import time
+import argparse
 import secrets
 import hashlib
-from typing import Optional
+import threading
+from typing import Optional, Dict, Any
 from getpass import getpass
 
 BASE_DIR = os.path.dirname(__file__)
 AUTH_PATH = os.path.join(BASE_DIR, 'auth.json')
+# API tokens for the web server: sha256 of the token -> {user_id, admin, created_at}. A request's
+# user (and so its memory shard) comes from its token only; admin tokens may also change the
+# shared intent model. Issue one with: python -m memory.auth token <user_id> [--admin]
+API_TOKENS_PATH = os.path.join(BASE_DIR, 'api_tokens.json')
+# User ids double as shard directory names (memory/shards.py)
+USER_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
 
 # Session cache to avoid repeated prompts within a short window
 _auth_ok_until: float = 0.0
@@ -95,6 +104,57 @@ def require_auth(reason: str = "", ttl_seconds: int = 900) -> bool:
     return False
 
 
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+# Token table cached by file identity, so each request does not re-read it
+_tokens: Dict[str, Dict[str, Any]] = {}
+_tokens_stamp = None
+_tokens_lock = threading.Lock()
+
+
+def _load_tokens() -> Dict[str, Dict[str, Any]]:
+    global _tokens, _tokens_stamp
+    try:
+        st = os.stat(API_TOKENS_PATH)
+    except OSError:
+        return {}
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _tokens_lock:
+        if stamp != _tokens_stamp:
+            try:
+                with open(API_TOKENS_PATH, 'r', encoding='utf-8') as f:
+                    _tokens = json.load(f)
+            except Exception:
+                _tokens = {}
+            _tokens_stamp = stamp
+        return _tokens
+
+
+def issue_api_token(user_id: str, admin: bool = False) -> str:
+    if not USER_ID_RE.match(user_id):
+        raise ValueError('User ids are 1-64 letters, digits, "_" or "-".')
+    token = secrets.token_urlsafe(32)
+    data = dict(_load_tokens())
+    data[_token_hash(token)] = {'user_id': user_id, 'admin': bool(admin), 'created_at': time.time()}
+    tmp = API_TOKENS_PATH + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, API_TOKENS_PATH)
+    return token
+
+
+def user_for_token(token: str) -> Optional[Dict[str, Any]]:
+    # The token's {user_id, admin}, or None if it was never issued
+    if not token:
+        return None
+    rec = _load_tokens().get(_token_hash(token))
+    if not rec or not USER_ID_RE.match(str(rec.get('user_id', ''))):
+        return None
+    return {'user_id': rec['user_id'], 'admin': bool(rec.get('admin'))}
+
+
 def ensure_setup():
     if has_pin():
         return
@@ -103,3 +163,17 @@ def ensure_setup():
         set_pin_interactive()
     else:
         print("Warning: sensitive operations will be unavailable until you set a PIN.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Issue an API token for the web server.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    tok = sub.add_parser('token', help='issue a token for a user id')
+    tok.add_argument('user_id')
+    tok.add_argument('--admin', action='store_true', help='may also correct the intent model')
+    args = parser.parse_args()
+    print(issue_api_token(args.user_id, admin=args.admin))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import zlib
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Dense embeddings for LongTermMemory's optional dense mode (numpy only, no model download).
+#
+# A text is encoded as the counts of the character 3-grams of its words ("<word>" padded, so
+# prefixes and suffixes count) plus the words themselves, hashed into N_BUCKETS buckets and
+# projected to DIM dimensions by a fixed random +-1 matrix, then L2-normalised. Misheard
+# words ("favrite", "colour") keep most of their 3-grams, so they still land close.
+#
+# DenseIndex keeps the vectors (int8 with a per-row scale) in an inverted-file (IVF) index: k-means centroids
+# over the vectors, each vector filed under its nearest centroid, and a query only scores the
+# lists of its NPROBE nearest centroids. Those candidates are screened on the first
+# SCREEN_DIM components (the projection's components are independent, so a prefix is itself a
+# noisier random projection) and only the best are scored in full. Files live in a generation directory named by
+# CURRENT, so a rebuild (compaction, retraining on a changed encoder) is swapped in atomically:
+#   ids.txt      one memory id per line, in vector order; defines how many rows are committed
+#   vectors.bin  per row: DIM int8 components, then a float32 scale
+#   ivf.npz      centroids and the assignment of the rows it was trained on
+#   assign.i32   assignments of rows added since, after a header naming the ivf.npz they use
+# A memory id may appear more than once (its text was replaced); the last row wins.
+
+ENCODER = 'char3-h15-d256-v1'
+N_BUCKETS = 1 << 15
+DIM = 256
+# Below this many rows every vector is scored; at this size the centroids are first trained
+TRAIN_MIN = 4096
+# Centroids are retrained (and every row reassigned) once the index has grown this much
+RETRAIN_GROWTH = 4
+MAX_LISTS = 4096
+NPROBE = 8
+SCREEN_DIM = 64
+# at least this many screened candidates are scored in full
+RERANK_MIN = 64
+TRAIN_SAMPLE_PER_LIST = 32
+KMEANS_ITERS = 8
+
+_ROW = np.dtype([('q', 'i1', (DIM,)), ('scale', '<f4')])
+
+_projection: Optional[np.ndarray] = None
+
+
+def _get_projection() -> np.ndarray:
+    # Derived from a fixed SHAKE-128 stream rather than a seeded RNG so stored vectors stay
+    # valid across numpy versions
+    global _projection
+    if _projection is None:
+        raw = hashlib.shake_128(ENCODER.encode('ascii')).digest(N_BUCKETS * DIM // 8)
+        bits = np.unpackbits(np.frombuffer(raw, dtype=np.uint8))
+        _projection = (bits.astype(np.float32) * 2.0 - 1.0).reshape(N_BUCKETS, DIM)
+    return _projection
+
+
+def _features(tokens: Sequence[str]) -> Dict[int, float]:
+    counts: Dict[int, float] = {}
+    for tok in tokens:
+        w = f'<{tok}>'
+        grams = [w] + [w[i:i + 3] for i in range(len(w) - 2)]
+        for g in grams:
+            b = zlib.crc32(g.encode('utf-8')) & (N_BUCKETS - 1)
+            counts[b] = counts.get(b, 0.0) + 1.0
+    return counts
+
+
+def encode_many(token_lists: Sequence[Sequence[str]]) -> np.ndarray:
+    """Unit vectors (float32, one row per token list); an empty list encodes to zeros."""
+    proj = _get_projection()
+    out = np.zeros((len(token_lists), DIM), dtype=np.float32)
+    for i, tokens in enumerate(token_lists):
+        feats = _features(tokens)
+        if not feats:
+            continue
+        idx = np.fromiter(feats.keys(), dtype=np.int64, count=len(feats))
+        # sub-linear counts so a repeated word does not swamp the rest
+        w = np.sqrt(np.fromiter(feats.values(), dtype=np.float32, count=len(feats)))
+        v = w @ proj[idx]
+        norm = np.linalg.norm(v)
+        if norm > 0:
+            out[i] = v / norm
+    return out
+
+
+def _quantize(vecs: np.ndarray) -> np.ndarray:
+    rows = np.zeros(len(vecs), dtype=_ROW)
+    scale = np.abs(vecs).max(axis=1) / 127.0
+    rows['scale'] = scale
+    rows['q'] = np.rint(vecs / np.where(scale > 0, scale, 1.0)[:, None])
+    return rows
+
+
+def _read_lines(path: str) -> List[str]:
+    # Drops (and truncates away) a torn last line left by a crash
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    end = data.rfind(b'\n') + 1
+    if end < len(data):
+        os.truncate(path, end)
+    return data[:end].decode('utf-8').split('\n')[:-1]
+
+
+class DenseIndex:
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._ids: List[str] = []
+        # id -> its latest row
+        self._latest: Dict[str, int] = {}
+        # int8 components (split at SCREEN_DIM into two contiguous arrays, so screening
+        # gathers only the head) and scale per row, in buffers grown by doubling; the first
+        # len(self._ids) rows are in use
+        self._head = np.zeros((0, SCREEN_DIM), dtype=np.int8)
+        self._tail = np.zeros((0, DIM - SCREEN_DIM), dtype=np.int8)
+        self._scale = np.zeros(0, dtype=np.float32)
+        self._centroids: Optional[np.ndarray] = None
+        self._trained_n = 0
+        self._ivf_gen = 0
+        # centroid -> rows filed under it
+        self._lists: List[array] = []
+        self._gen_dir = self._load_current()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    def __contains__(self, eid: str) -> bool:
+        return eid in self._latest
+
+    def _set_rows(self, rows: np.ndarray):
+        self._head = np.ascontiguousarray(rows['q'][:, :SCREEN_DIM])
+        self._tail = np.ascontiguousarray(rows['q'][:, SCREEN_DIM:])
+        self._scale = np.ascontiguousarray(rows['scale'])
+
+    def _append_rows(self, rows: np.ndarray):
+        n = len(self._ids)
+        if n + len(rows) > len(self._scale):
+            cap = max(2 * len(self._scale), n + len(rows), 1024)
+            head = np.zeros((cap, SCREEN_DIM), dtype=np.int8)
+            tail = np.zeros((cap, DIM - SCREEN_DIM), dtype=np.int8)
+            scale = np.zeros(cap, dtype=np.float32)
+            head[:n] = self._head[:n]
+            tail[:n] = self._tail[:n]
+            scale[:n] = self._scale[:n]
+            self._head, self._tail, self._scale = head, tail, scale
+        self._head[n:n + len(rows)] = rows['q'][:, :SCREEN_DIM]
+        self._tail[n:n + len(rows)] = rows['q'][:, SCREEN_DIM:]
+        self._scale[n:n + len(rows)] = rows['scale']
+
+    def _rows(self, idx) -> np.ndarray:
+        # int8 components of the given rows (a slice or an index array)
+        if isinstance(idx, slice):
+            return np.hstack([self._head[idx], self._tail[idx]])
+        return np.hstack([self._head.take(idx, axis=0), self._tail.take(idx, axis=0)])
+
+    # -- persistence --------------------------------------------------------------------
+
+    def _load_current(self) -> str:
+        try:
+            with open(os.path.join(self.directory, 'CURRENT'), 'r', encoding='utf-8') as f:
+                cur = json.load(f)
+            if cur.get('encoder') == ENCODER and os.path.isdir(os.path.join(self.directory, cur['dir'])):
+                return os.path.join(self.directory, cur['dir'])
+        except Exception:
+            pass
+        # missing, or built by another encoder: start an empty generation; the owner re-adds
+        return self._new_generation()
+
+    def _new_generation(self) -> str:
+        gens = [int(n[1:]) for n in os.listdir(self.directory) if n.startswith('g') and n[1:].isdigit()]
+        name = f"g{max(gens, default=0) + 1:06d}"
+        os.makedirs(os.path.join(self.directory, name))
+        self._switch_to(name)
+        return os.path.join(self.directory, name)
+
+    def _switch_to(self, name: str):
+        path = os.path.join(self.directory, 'CURRENT')
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'dir': name, 'encoder': ENCODER}, f)
+        os.replace(tmp, path)
+        # older generations are unreferenced now
+        for n in os.listdir(self.directory):
+            if n.startswith('g') and n != name:
+                shutil.rmtree(os.path.join(self.directory, n), ignore_errors=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._gen_dir, name)
+
+    def _load(self):
+        ids = _read_lines(self._path('ids.txt'))
+        path = self._path('vectors.bin')
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        # ids.txt is written last, so it bounds what was committed
+        n = min(len(ids), size // _ROW.itemsize)
+        if size > n * _ROW.itemsize:
+            os.truncate(path, n * _ROW.itemsize)
+        rows = np.fromfile(path, dtype=_ROW) if n else np.zeros(0, dtype=_ROW)
+        if len(ids) > n:
+            ids = ids[:n]
+            with open(self._path('ids.txt'), 'w', encoding='utf-8') as f:
+                f.write(''.join(i + '\n' for i in ids))
+        self._ids = ids
+        self._latest = {eid: row for row, eid in enumerate(ids)}
+        self._set_rows(rows)
+        try:
+            with np.load(self._path('ivf.npz')) as z:
+                self._centroids = z['centroids']
+                assign = z['assign']
+                self._ivf_gen = int(z['gen'])
+        except (OSError, KeyError, ValueError):
+            self._centroids = None
+            return
+        self._trained_n = len(assign)
+        tail = np.zeros(0, dtype=np.int32)
+        try:
+            raw = np.fromfile(self._path('assign.i32'), dtype=np.int32)
+            if len(raw) and raw[0] == self._ivf_gen:
+                tail = raw[1:]
+        except (OSError, ValueError):
+            pass
+        assign = np.concatenate([assign, tail])[:n]
+        if len(assign) < n:
+            # rows added without a recorded assignment (crash, or a retraining that was cut short)
+            assign = np.concatenate([assign, self._assign(len(assign), n)])
+            self._rewrite_tail(assign)
+        self._build_lists(assign)
+
+    def _rewrite_tail(self, assign: np.ndarray):
+        path = self._path('assign.i32')
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.asarray([self._ivf_gen], dtype=np.int32).tofile(f)
+            assign[self._trained_n:].astype(np.int32).tofile(f)
+        os.replace(tmp, path)
+
+    def _build_lists(self, assign: np.ndarray):
+        order = np.argsort(assign, kind='stable').astype(np.int32)
+        bounds = np.searchsorted(assign[order], np.arange(len(self._centroids) + 1))
+        self._lists = [array('i', order[bounds[c]:bounds[c + 1]].tobytes()) for c in range(len(self._centroids))]
+
+    # -- updates ------------------------------------------------------------------------
+
+    def add(self, ids: List[str], token_lists: Sequence[Sequence[str]]):
+        if not ids:
+            return
+        rows = _quantize(encode_many(token_lists))
+        start = len(self._ids)
+        # vectors, then assignments, then ids: a crash leaves at most unreferenced tails
+        with open(self._path('vectors.bin'), 'ab') as f:
+            rows.tofile(f)
+        self._append_rows(rows)
+        if self._centroids is not None:
+            assign = self._assign(start, start + len(rows))
+            if not os.path.exists(self._path('assign.i32')):
+                self._rewrite_tail(np.zeros(self._trained_n, dtype=np.int32))
+            with open(self._path('assign.i32'), 'ab') as f:
+                assign.astype(np.int32).tofile(f)
+            for i, c in enumerate(assign.tolist()):
+                self._lists[c].append(start + i)
+        with open(self._path('ids.txt'), 'a', encoding='utf-8') as f:
+            f.write(''.join(i + '\n' for i in ids))
+        for i, eid in enumerate(ids):
+            self._ids.append(eid)
+            self._latest[eid] = start + i
+        n = len(self._ids)
+        if (self._centroids is None and n >= TRAIN_MIN) or (self._centroids is not None and n >= RETRAIN_GROWTH * self._trained_n):
+            self._train()
+
+    def _scores(self, rows: Optional[np.ndarray], qv: np.ndarray) -> np.ndarray:
+        # cosine with the query for the given rows (all rows when None)
+        if rows is None:
+            n = len(self._ids)
+            return (self._head[:n] @ qv[:SCREEN_DIM] + self._tail[:n] @ qv[SCREEN_DIM:]) * self._scale[:n]
+        return ((self._head.take(rows, axis=0) @ qv[:SCREEN_DIM] + self._tail.take(rows, axis=0) @ qv[SCREEN_DIM:])
+                * self._scale.take(rows))
+
+    def _assign(self, start: int, stop: int) -> np.ndarray:
+        out = np.empty(stop - start, dtype=np.int32)
+        for i in range(start, stop, 65536):
+            j = min(i + 65536, stop)
+            # the scale is positive, so it does not change the nearest centroid
+            out[i - start:j - start] = np.argmax(self._rows(slice(i, j)).astype(np.float32) @ self._centroids.T, axis=1)
+        return out
+
+    def _train(self):
+        # Spherical k-means on a sample, then every row is filed under its nearest centroid
+        n = len(self._ids)
+        k = int(min(MAX_LISTS, max(16, 2 * math.sqrt(n))))
+        rng = np.random.default_rng(n)
+        pick = rng.choice(n, min(n, k * TRAIN_SAMPLE_PER_LIST), replace=False)
+        sample = self._rows(pick).astype(np.float32) * self._scale[pick][:, None]
+        cent = sample[rng.choice(len(sample), k, replace=False)]
+        for _ in range(KMEANS_ITERS):
+            near = np.argmax(sample @ cent.T, axis=1)
+            sums = np.zeros_like(cent)
+            np.add.at(sums, near, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # an empty cluster keeps its old centroid
+            cent = np.where(norms > 0, sums / np.maximum(norms, 1e-12), cent)
+        self._centroids = cent
+        assign = self._assign(0, n)
+        self._ivf_gen += 1
+        self._trained_n = n
+        path = self._path('ivf.npz')
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, centroids=cent, assign=assign, gen=np.int64(self._ivf_gen))
+        os.replace(path + '.tmp', path)
+        self._rewrite_tail(assign)
+        self._build_lists(assign)
+
+    def compact(self, live: set):
+        # Keep only the latest row of each live id, written into a fresh generation
+        keep = sorted(row for eid, row in self._latest.items() if eid in live)
+        ids = [self._ids[r] for r in keep]
+        rows = np.zeros(len(keep), dtype=_ROW)
+        rows['q'] = self._rows(np.asarray(keep, dtype=np.int64))
+        rows['scale'] = self._scale[keep]
+        old_dir = self._gen_dir
+        gens = [int(n[1:]) for n in os.listdir(self.directory) if n.startswith('g') and n[1:].isdigit()]
+        name = f"g{max(gens, default=0) + 1:06d}"
+        self._gen_dir = os.path.join(self.directory, name)
+        os.makedirs(self._gen_dir)
+        rows.tofile(self._path('vectors.bin'))
+        with open(self._path('ids.txt'), 'w', encoding='utf-8') as f:
+            f.write(''.join(i + '\n' for i in ids))
+        self._ids = ids
+        self._latest = {eid: row for row, eid in enumerate(ids)}
+        self._set_rows(rows)
+        self._centroids = None
+        self._trained_n = 0
+        self._lists = []
+        if len(ids) >= TRAIN_MIN:
+            self._train()
+        try:
+            self._switch_to(name)
+        except OSError:
+            self._gen_dir = old_dir
+            raise
+
+    # -- queries ------------------------------------------------------------------------
+
+    def search(self, qv: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """Approximate top-k (id, cosine) for a unit query vector, best first."""
+        if not self._ids or k <= 0:
+            return []
+        if self._centroids is None:
+            rows = np.arange(len(self._ids))
+            scores = self._scores(None, qv)
+        else:
+            cs = self._centroids @ qv
+            nprobe = min(NPROBE, len(cs))
+            probe = np.argpartition(-cs, nprobe - 1)[:nprobe]
+            rows = np.concatenate([np.frombuffer(self._lists[c], dtype=np.int32) for c in probe])
+            m = max(RERANK_MIN, 4 * k)
+            if len(rows) > m:
+                screen = (self._head.take(rows, axis=0) @ qv[:SCREEN_DIM]) * self._scale.take(rows)
+                rows = rows[np.argpartition(-screen, m - 1)[:m]]
+            scores = self._scores(rows, qv)
+        # over-fetch a little: rows superseded by a later version of the same id are dropped
+        m = min(len(rows), k * 2)
+        if m == 0:
+            return []
+        top = np.argpartition(-scores, m - 1)[:m]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        out: List[Tuple[str, float]] = []
+        for i in top.tolist():
+            row = int(rows[i])
+            eid = self._ids[row]
+            if self._latest.get(eid) == row:
+                out.append((eid, float(scores[i])))
+                if len(out) == k:
+                    break
+        return out
+
+    def score(self, qv: np.ndarray, ids: List[str]) -> np.ndarray:
+        """Exact cosine of the query with each given id (0 for ids without a vector)."""
+        rows = [self._latest.get(eid, -1) for eid in ids]
+        have = np.asarray([r >= 0 for r in rows], dtype=bool)
+        out = np.zeros(len(ids), dtype=np.float32)
+        if have.any():
+            idx = np.asarray(rows, dtype=np.int64)[have]
+            out[have] = self._scores(idx, qv)
+        return out
@@ -0,0 +1,249 @@
+import json
+import os
+import struct
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Embedding storage for LongTermMemory.
+#
+# Tokens are interned into a global, append-only vocabulary (vocab.txt, one token per line,
+# id = line number). A vector is packed as bytes: n little-endian uint32 token ids followed by
+# their n float32 weights. Vectors are kept resident in that form and written to numbered
+# binary segments (seg_000001.bin, ...), each record being
+#   <u32 payload length><u64 simhash><u16 id length><id utf-8><packed vector>
+# Older JSON segments (seg_*.jsonl) and the single-file embeddings.json are still read and
+# are rewritten in the binary format by the next compaction.
+
+_HEADER = struct.Struct('<IQH')
+
+
+class Vocabulary:
+    def __init__(self, path: str):
+        self.path = path
+        self.terms: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self._flushed = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = f.read()
+        except OSError:
+            return
+        lines = data.split('\n')
+        if lines and lines[-1] == '':
+            lines.pop()
+        elif lines:
+            # torn last line from a crash; no record can reference it yet
+            lines.pop()
+            with open(self.path, 'r+', encoding='utf-8') as f:
+                f.truncate(len('\n'.join(lines).encode('utf-8')) + (1 if lines else 0))
+        self.terms = lines
+        self.ids = {t: i for i, t in enumerate(lines)}
+        self._flushed = len(lines)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def intern(self, term: str) -> int:
+        i = self.ids.get(term)
+        if i is None:
+            i = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+        return i
+
+    def flush(self):
+        # New terms must be on disk before any record that references them
+        if self._flushed < len(self.terms):
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(t + '\n' for t in self.terms[self._flushed:]))
+            self._flushed = len(self.terms)
+
+    def pack(self, tf: Dict[str, float]) -> bytes:
+        n = len(tf)
+        return struct.pack(f'<{n}I{n}f', *[self.intern(t) for t in tf], *tf.values())
+
+    def term_ids(self, vec: bytes) -> Tuple[int, ...]:
+        return struct.unpack_from(f'<{len(vec) // 8}I', vec)
+
+    def terms_of(self, vec: bytes) -> List[str]:
+        terms = self.terms
+        return [terms[i] for i in self.term_ids(vec)]
+
+    def unpack(self, vec: bytes) -> Dict[str, float]:
+        n = len(vec) // 8
+        ids = struct.unpack_from(f'<{n}I', vec)
+        weights = struct.unpack_from(f'<{n}f', vec, 4 * n)
+        terms = self.terms
+        return {terms[i]: w for i, w in zip(ids, weights)}
+
+
+class SegmentLog:
+    """Append-only log of (id, packed vector, simhash) records split into numbered segments.
+
+    Later records win on replay. Compaction rewrites the live records into a single fresh
+    segment and drops the older ones. Records in the old idf-weighted format ({"id": ...,
+    "vec": ...}, or embeddings.json) are reported in legacy_ids so the owner can re-derive
+    their term frequencies; needs_rewrite is set when any JSON input was read.
+    """
+
+    def __init__(self, directory: str, legacy_path: Optional[str] = None,
+                 max_records: int = 5000, compact_after: int = 8):
+        self.directory = directory
+        self.legacy_path = legacy_path
+        self.max_records = max_records
+        self.compact_after = compact_after
+        os.makedirs(directory, exist_ok=True)
+        self.vocab = Vocabulary(os.path.join(directory, 'vocab.txt'))
+        self._active_seq = 0
+        self._active_count = 0
+        self.legacy_ids: set = set()
+        self.needs_rewrite = False
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        segs = []
+        for name in os.listdir(self.directory):
+            if not name.startswith('seg_'):
+                continue
+            stem, ext = os.path.splitext(name)
+            if ext in ('.bin', '.jsonl'):
+                try:
+                    segs.append((int(stem[4:]), os.path.join(self.directory, name)))
+                except ValueError:
+                    continue
+        segs.sort()
+        return segs
+
+    def _seg_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"seg_{seq:06d}.bin")
+
+    def scan(self) -> Iterator[Tuple[str, bytes, Optional[int]]]:
+        # Stream (id, packed vector, simhash) records in replay order without holding the
+        # whole map; an id may repeat and the later record wins. legacy_ids is complete once
+        # the scan finishes.
+        self.legacy_ids = set()
+        self.needs_rewrite = False
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            self.needs_rewrite = True
+            try:
+                with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                    legacy = json.load(f)
+            except Exception:
+                legacy = {}
+            for eid, vec in legacy.items():
+                self.legacy_ids.add(eid)
+                yield eid, self.vocab.pack(vec), None
+        for seq, path in self._segments():
+            if path.endswith('.jsonl'):
+                self.needs_rewrite = True
+                yield from self._scan_json(path)
+                # never appended to; the next append starts a binary segment
+                count = self.max_records
+            else:
+                count = yield from self._scan_bin(path)
+            self._active_seq, self._active_count = seq, count
+
+    def _scan_json(self, path: str):
+        count = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except Exception:
+                        # torn tail write from a crash; skip it
+                        continue
+                    count += 1
+                    if 'tf' in rec:
+                        self.legacy_ids.discard(rec['id'])
+                        yield rec['id'], self.vocab.pack(rec['tf']), rec.get('sh')
+                    else:
+                        self.legacy_ids.add(rec['id'])
+                        yield rec['id'], self.vocab.pack(rec['vec']), None
+        except OSError:
+            pass
+        return count
+
+    def _scan_bin(self, path: str):
+        count = 0
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return count
+        pos = 0
+        with memoryview(data) as mv:
+            while pos + _HEADER.size <= len(data):
+                size, sh, id_len = _HEADER.unpack_from(data, pos)
+                end = pos + _HEADER.size + size
+                if end > len(data) or id_len > size:
+                    break
+                body = pos + _HEADER.size
+                eid = str(mv[body:body + id_len], 'utf-8')
+                count += 1
+                self.legacy_ids.discard(eid)
+                yield eid, bytes(mv[body + id_len:end]), sh
+                pos = end
+        if pos < len(data):
+            # Torn write at the tail (crash mid-append); drop it so later appends stay aligned
+            os.truncate(path, pos)
+        return count
+
+    @staticmethod
+    def _record(eid: str, vec: bytes, sh: int) -> bytes:
+        raw = eid.encode('utf-8')
+        return _HEADER.pack(len(raw) + len(vec), sh, len(raw)) + raw + vec
+
+    def append(self, eid: str, vec: bytes, sh: int) -> bool:
+        return self.append_many([(eid, vec, sh)])
+
+    def append_many(self, records: List[Tuple[str, bytes, int]]) -> bool:
+        # One write per segment touched. Returns True when a new segment was started
+        self.vocab.flush()
+        rolled = False
+        i = 0
+        while i < len(records):
+            if self._active_seq == 0 or self._active_count >= self.max_records:
+                self._active_seq += 1
+                self._active_count = 0
+                rolled = True
+            chunk = records[i:i + self.max_records - self._active_count]
+            with open(self._seg_path(self._active_seq), 'ab') as f:
+                f.write(b''.join(self._record(*rec) for rec in chunk))
+            self._active_count += len(chunk)
+            i += len(chunk)
+        return rolled
+
+    def needs_compaction(self) -> bool:
+        return len(self._segments()) >= self.compact_after
+
+    def compact(self, records: Iterable[Tuple[str, bytes, int]]):
+        old = self._segments()
+        seq = (old[-1][0] if old else 0) + 1
+        path = self._seg_path(seq)
+        tmp = path + '.tmp'
+        count = 0
+        with open(tmp, 'wb') as f:
+            for rec in records:
+                f.write(self._record(*rec))
+                count += 1
+        self.vocab.flush()
+        os.replace(tmp, path)
+        # A crash before these removals is harmless: replaying old segments then the new one
+        # yields the same map
+        for _, p in old:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+        if self.legacy_path:
+            try:
+                os.remove(self.legacy_path)
+            except OSError:
+                pass
+        self._active_seq, self._active_count = seq, count
+        self.legacy_ids = set()
+        self.needs_rewrite = False
@@ -0,0 +1,59 @@
+import argparse
+import json
+import time
+from typing import Any, Dict, Iterator
+
+from memory.long_term import LongTermMemory, StoreLockedError
+
+# Bulk importer for long-term memory.
+# Usage: python -m memory.ingest notes.jsonl [--type habit] [--tag imported] [--source import]
+# Each line is a JSON object with at least 'text' (optional 'type', 'tags', 'source', extra
+# fields), or a bare JSON string. Malformed or empty lines are skipped.
+
+
+def iter_records(path: str, mtype: str = 'note', tags=None, source: str = 'import') -> Iterator[Dict[str, Any]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            if isinstance(rec, str):
+                rec = {'text': rec}
+            if not isinstance(rec, dict) or not str(rec.get('text', '')).strip():
+                continue
+            rec.setdefault('type', mtype)
+            rec.setdefault('source', source)
+            if tags:
+                rec['tags'] = list(rec.get('tags') or []) + [t for t in tags if t not in (rec.get('tags') or [])]
+            yield rec
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import memories from a JSONL file into long-term memory.")
+    parser.add_argument('path', help="JSONL file, one memory per line")
+    parser.add_argument('--type', default='note', help="default memory type (fact | habit | task | preference | note)")
+    parser.add_argument('--tag', action='append', default=[], help="tag added to every imported memory (repeatable)")
+    parser.add_argument('--source', default='import', help="source recorded on each memory")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    try:
+        ltm = LongTermMemory()
+    except StoreLockedError as e:
+        # a running assistant owns the store; importing alongside it would corrupt the index
+        print(f"Cannot import: {e}. Stop the assistant and try again.")
+        return 1
+    try:
+        ids = ltm.add_many(iter_records(args.path, mtype=args.type, tags=args.tag, source=args.source))
+    finally:
+        ltm.close()
+    print(f"Imported {len(ids)} memories in {time.time() - start:.2f}s.")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
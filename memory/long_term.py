@@ -2,17 +2,104 @@ import json
 import os
 import time
 import math
-from typing import List, Dict, Any, Optional, Tuple
+import heapq
+import queue
+import threading
+from array import array
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+
+from memory.record_store import JsonlStore, MmapStore
+from memory.embedding_log import SegmentLog
+from memory.simhash import simhash, bands, distance, BANDS, MAX_DISTANCE
+from nlp.preprocess import split_words, tokenize
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    # Optional: array helpers (tag bitmaps, dense mode) and the matrix scorer below
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    # Optional: vectorized scoring over a CSR matrix; without it the pure-Python scorer is used
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+try:
+    # Optional dense mode (needs numpy only)
+    from memory.dense import DenseIndex, encode_many
+except ImportError:
+    DenseIndex = None
 
 # Simple long-term memory store with JSONL persistence and lightweight embedding via bag-of-words tf-idf-ish
-# Falls back gracefully if no embedding backend. Stored under memory/long_term.jsonl and memory/embeddings.json
+# Falls back gracefully if no embedding backend. Stored under memory/long_term.jsonl and memory/embeddings/
+# (interned vocabulary plus append-only binary segments of packed vectors, see embedding_log; JSON
+# segments and memory/embeddings.json are older formats, migrated on load)
+# The optional 'mmap' backend (JARVIS_LTM_BACKEND=mmap) keeps records in memory/long_term.bin instead.
 
 BASE_DIR = os.path.dirname(__file__)
 STORE_PATH = os.path.join(BASE_DIR, 'long_term.jsonl')
+BIN_PATH = os.path.join(BASE_DIR, 'long_term.bin')
+BIN_INDEX_PATH = os.path.join(BASE_DIR, 'long_term.idx')
 EMB_PATH = os.path.join(BASE_DIR, 'embeddings.json')
+EMB_DIR = os.path.join(BASE_DIR, 'embeddings')
+# Side log of field updates ({"id": ..., "set": {...}}) merged over the store until compaction
+UPDATES_PATH = os.path.join(BASE_DIR, 'long_term.updates.jsonl')
+# df table plus the store byte offset and crc32 it covers, so startup only tokenizes the tail
+DF_SNAPSHOT_PATH = os.path.join(BASE_DIR, 'df_snapshot.json')
+# The rest of the index (rows, postings, fingerprints, tags, ...) as of the same snapshot, and
+# the JSONL store's row offsets; with both current, startup loads instead of rebuilding
+INDEX_SNAPSHOT_PATH = os.path.join(BASE_DIR, 'index_snapshot.bin')
+JSONL_INDEX_PATH = os.path.join(BASE_DIR, 'long_term.jsonl.idx')
+# Dense mode's vectors and ANN index (see dense.py)
+DENSE_DIR = os.path.join(BASE_DIR, 'dense')
+# Held exclusively by the process that has the store open (see _lock_store)
+LOCK_PATH = os.path.join(BASE_DIR, 'long_term.lock')
+
+# A segment is closed once it holds this many records; compaction runs once this many segments exist
+SEGMENT_MAX_RECORDS = 5000
+COMPACT_AFTER_SEGMENTS = 8
+# The update log is folded into the store once it reaches this many lines
+COMPACT_AFTER_UPDATES = 10000
+# Rows added since the CSR matrix was built are scored as a small tail block until they
+# exceed max(MATRIX_TAIL_ROWS, rows/8), at which point the matrix is rebuilt
+MATRIX_TAIL_ROWS = 1024
+# Hot tier: at most this many term-frequency vectors stay in RAM (JARVIS_LTM_HOT_BUDGET, 0 = no
+# limit). preference/habit rows are always resident; other rows are evicted oldest first, where
+# each retrieval hit counts as HOT_ACCESS_WEIGHT seconds of recency. Cold rows keep their index
+# entries but their vectors are re-derived from the stored text when needed.
+HOT_BUDGET = 50000
+HOT_ACCESS_WEIGHT = 3600.0
+# The cold tier is only scored when the best hot score is below this, and then only for the
+# COLD_MAX_CANDIDATES rows with the largest idf overlap with the query
+COLD_SCORE_THRESHOLD = 0.35
+COLD_MAX_CANDIDATES = 2000
+# Adds from any thread are queued to a single writer thread, which commits whatever has queued
+# up (up to this many entries) with one append and one fsync per file
+GROUP_COMMIT_MAX = 512
+# An insert whose SimHash is within simhash.MAX_DISTANCE bits of a stored memory of the same
+# type is merged into it when their token sets also overlap this much (Jaccard); the check
+# matters for short texts, where a few shared words already give close fingerprints;
+# below ten distinct tokens only an identical token set passes
+NEAR_DUP_MIN_JACCARD = 0.9
+# Dense mode (JARVIS_LTM_DENSE=1): retrieval ranks by the cosine of hashed character n-gram
+# embeddings through an approximate index instead of exact-token tf-idf, so misheard or
+# misspelt words still match. Hits below DENSE_MIN_SCORE are dropped; texts sharing no
+# words mostly score within +-0.2.
+DENSE_MIN_SCORE = 0.25
 
 # Types: fact | habit | task | preference | note
 
+# Fields every entry has (see _make_entry); anything else is an extra field
+_ENTRY_FIELDS = ('id', 'type', 'text', 'tags', 'created_at', 'last_seen', 'source')
+
 def _now() -> float:
     return time.time()
 
@@ -25,6 +112,28 @@ def _load_json(path: str, default):
         return default
 
 
+class StoreLockedError(RuntimeError):
+    """The store is already open, normally by another process."""
+
+
+def _lock_store(path: str):
+    # One process per store: each one interns new terms into the shared vocabulary file and
+    # compaction rewrites the store from its own rows, so a second writer would corrupt both.
+    # Within a process, LongTermMemory.shared() hands every caller the same instance instead.
+    # The OS drops the lock when the holder exits, however it exits.
+    f = open(path, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        raise StoreLockedError(f"long-term memory at {os.path.dirname(os.path.abspath(path))} is already open")
+    return f
+
+
 def _save_json(path: str, data):
     tmp = path + '.tmp'
     with open(tmp, 'w', encoding='utf-8') as f:
@@ -32,54 +141,665 @@ def _save_json(path: str, data):
     os.replace(tmp, path)
 
 
-def _ensure_file(path: str):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    if not os.path.exists(path):
-        with open(path, 'w', encoding='utf-8') as f:
-            pass
+# Stored text is split with the uncached tokenizer; queries use the memoized tokenize(),
+# shared with the rest of the request
+_tok = split_words
 
-# Very lightweight tokenizer
 
-def _tok(text: str) -> List[str]:
-    return [t for t in ''.join(ch.lower() if ch.isalnum() else ' ' for ch in text).split() if t]
+def _jaccard(a, b) -> float:
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a or b else 1.0
 
 
-class LongTermMemory:
+class _OpenStore:
+    # One shared instance per store directory (see LongTermMemory.shared)
+    __slots__ = ('lock', 'ltm', 'refs')
+
     def __init__(self):
-        _ensure_file(STORE_PATH)
-        self.embeddings: Dict[str, Dict[str, float]] = _load_json(EMB_PATH, {})
+        self.lock = threading.Lock()
+        self.ltm: Optional['LongTermMemory'] = None
+        self.refs = 0
+
+
+# realpath of a store's directory -> its shared instance in this process
+_open_stores: Dict[str, _OpenStore] = {}
+_open_stores_lock = threading.Lock()
+
+
+class _WriteRequest:
+    __slots__ = ('entries', 'ids', 'done', 'error')
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries = entries
+        # resulting id per entry: its own, or the existing memory it was merged into
+        self.ids: List[str] = []
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class LongTermMemory:
+    """Long-term memory shared by all threads.
+
+    Inserts are committed by one writer thread in groups; every other read or update holds
+    self._lock, so readers always see whole commits and never a half-indexed entry.
+    """
+
+    def __init__(self, backend: Optional[str] = None, hot_budget: Optional[int] = None, dense: Optional[bool] = None,
+                 root: Optional[str] = None):
+        backend = backend or os.getenv('JARVIS_LTM_BACKEND', 'jsonl')
+        # All files live under root when given (one directory per store, see shards.py);
+        # otherwise at the module-level paths
+        paths = [STORE_PATH, BIN_PATH, BIN_INDEX_PATH, EMB_PATH, EMB_DIR, UPDATES_PATH, DF_SNAPSHOT_PATH, DENSE_DIR,
+                 LOCK_PATH, INDEX_SNAPSHOT_PATH, JSONL_INDEX_PATH]
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+            paths = [os.path.join(root, os.path.basename(p)) for p in paths]
+        (self.store_path, self.bin_path, self.bin_index_path, self.emb_path, self.emb_dir,
+         self.updates_path, self.df_snapshot_path, self.dense_dir, self.lock_path, self.index_snapshot_path,
+         self.jsonl_index_path) = paths
+        # set when the instance is handed out by shared()
+        self._slot: Optional[_OpenStore] = None
+        self._key: Optional[str] = None
+        # Raises StoreLockedError if this store is already open; released by close()
+        self._lock_file = _lock_store(self.lock_path)
+        try:
+            self._open(backend, hot_budget, dense)
+        except BaseException:
+            self._lock_file.close()
+            raise
+
+    @classmethod
+    def shared(cls, root: Optional[str] = None, **kwargs) -> 'LongTermMemory':
+        """The process's open instance for this store, opened on first use. Every caller
+        close()s it once; the store is released after the last close. Options only apply to
+        the call that opens it. Raises StoreLockedError if another process has it open."""
+        key = os.path.realpath(root if root is not None else os.path.dirname(LOCK_PATH))
+        while True:
+            with _open_stores_lock:
+                slot = _open_stores.get(key)
+                if slot is None:
+                    slot = _open_stores[key] = _OpenStore()
+            with slot.lock:
+                with _open_stores_lock:
+                    if _open_stores.get(key) is not slot:
+                        # the last holder closed it while we waited; start over
+                        continue
+                if slot.ltm is None:
+                    try:
+                        ltm = cls(root=root, **kwargs)
+                    except BaseException:
+                        with _open_stores_lock:
+                            del _open_stores[key]
+                        raise
+                    ltm._slot, ltm._key = slot, key
+                    slot.ltm = ltm
+                slot.refs += 1
+                return slot.ltm
+
+    def _open(self, backend: str, hot_budget: Optional[int], dense: Optional[bool]):
+        if dense is None:
+            dense = os.getenv('JARVIS_LTM_DENSE', '0') == '1'
+        if hot_budget is None:
+            hot_budget = int(os.getenv('JARVIS_LTM_HOT_BUDGET', HOT_BUDGET))
+        self.hot_budget = hot_budget
+        # Guards the index and the files; re-entrant because updates may trigger compaction
+        self._lock = threading.RLock()
+        self._id_lock = threading.Lock()
+        self._queue: 'queue.Queue[Optional[_WriteRequest]]' = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        if backend == 'mmap':
+            self._store = MmapStore(self.bin_path, self.bin_index_path)
+            self._import_jsonl()
+        elif backend == 'jsonl':
+            self._store = JsonlStore(self.store_path, self.jsonl_index_path)
+        else:
+            raise ValueError(f"Unknown long-term memory backend: {backend}")
+        self._emb_log = SegmentLog(self.emb_dir, legacy_path=self.emb_path, max_records=SEGMENT_MAX_RECORDS,
+                                   compact_after=COMPACT_AFTER_SEGMENTS)
+        # Tokens interned to int ids; shared with the embedding log, which persists it
+        self.vocab = self._emb_log.vocab
+        # Hot tier: id -> term frequencies (token count / text length) packed by the vocabulary
+        # as uint32 ids + float32 weights; idf is applied at query time. Filled by _build_index
+        # from the embedding log.
+        self.embeddings: Dict[str, bytes] = {}
+        # hot row -> recency used for eviction; row -> retrieval hits
+        self._hot_seen: Dict[int, float] = {}
+        self._access: Dict[int, int] = {}
+        # rows with tokens whose vectors are not resident
+        self._n_cold = 0
+        # rows promoted back to the hot tier since the CSR matrix was built (scored separately)
+        self._pending_hot: set = set()
+        # token -> idf, dropped whenever the token's df changes
+        self._idf_cache: Dict[str, float] = {}
+        # id -> pending field updates from the update log, applied on every read
+        self._overlay: Dict[str, Dict[str, Any]] = {}
+        self._overlay_lines = 0
+        # Update-log lines that changed a record's text or deleted it. The df snapshot records
+        # this so a snapshot taken before such a change is never trusted.
+        self._revision = 0
+        # Tombstoned rows: kept in place so row ordinals stay valid, dropped by compact()
+        self._dead: set = set()
+        # preference key -> live rows holding it (normally one, see add_or_update_preference)
+        self._pref_rows: Dict[str, List[int]] = {}
+        # SimHash of each row's distinct tokens (0 = none) and, per 16-bit band, band value ->
+        # rows; add() merges an insert into a same-type row within MAX_DISTANCE bits. The
+        # bands are built from _fp on the first insert (see _bands)
+        self._fp = array('Q')
+        self._fp_bands: Optional[List[Dict[int, List[int]]]] = None
+        # per row: last_seen (or the id's time), which picks the hot tier at startup
+        self._seen = array('d')
+        self._load_overlay()
+        # Rows are addressed by ordinal (store order); records themselves live in the store
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        # Inverted index: token -> rows whose text contains it
+        self.postings: Dict[str, List[int]] = {}
+        # preference/habit rows always receive the type bonus, so they are always candidates
+        self._boosted: List[int] = []
+        # Tag index: lowercased tag -> bitmap of rows (Python int, bit i set for row i)
+        self._tag_bits: Dict[str, int] = {}
+        # CSR matrix of term frequencies (numpy/scipy only), one column per vocabulary id
+        self._mat = None
+        self._mat_rows = 0
+        self._tail_mat = None
+        # _pending_hot's rows as one more block, keyed by the rows it holds
+        self._pending_mat = None
+        # idf^2 per column and a version stamp that invalidates cached row norms
+        self._col_w2 = None
+        self._w2_version = 0
+        self._df_dirty: set = set()
+        # Highest millisecond stamp used in an id; new ids are kept strictly above it
+        self._last_id_ms = 0
+        # Callbacks run after each insert with (entry, distinct tokens), e.g. to invalidate caches
+        self._add_listeners: List[Callable[[Dict[str, Any], set], None]] = []
+        self._dense = None
+        # (store size, update log size) the saved snapshots describe, while they are current
+        self._snapshot_stamp: Optional[Tuple[int, int]] = None
         self.df: Dict[str, int] = self._recompute_df()
+        if self._emb_log.legacy_ids or self._emb_log.needs_rewrite:
+            self._migrate_legacy_embeddings()
+        # without numpy, dense mode falls back to the tf-idf scorer
+        self._dense = DenseIndex(self.dense_dir) if dense and DenseIndex is not None else None
+        if self._dense is not None:
+            self._sync_dense()
+
+    def _sync_dense(self):
+        # Encode rows the dense index has no vector for: a crash between the store write and
+        # the index write, a first start in dense mode, or a changed encoder
+        missing = [row for row, eid in enumerate(self._ids) if row not in self._dead and eid not in self._dense]
+        for i in range(0, len(missing), GROUP_COMMIT_MAX):
+            ids: List[str] = []
+            tokens: List[List[str]] = []
+            for row in missing[i:i + GROUP_COMMIT_MAX]:
+                toks = _tok(self._entry(row).get('text',''))
+                if toks:
+                    ids.append(self._ids[row])
+                    tokens.append(toks)
+            self._dense.add(ids, tokens)
+
+    def _migrate_legacy_embeddings(self):
+        # One-time pass: older vectors had insert-time idf baked in, so rebuild the resident
+        # ones from the stored text; compaction re-derives the cold ones while rewriting the
+        # log, and also converts JSON segments to the binary format
+        for eid in self._emb_log.legacy_ids:
+            if eid in self.embeddings:
+                vec = self._cold_vec(self._rows[eid])
+                if vec:
+                    self.embeddings[eid] = vec
+        self._reset_matrix()
+        self.compact_embeddings()
+
+    def _import_jsonl(self):
+        # First start of the mmap backend: carry over an existing JSONL store
+        if os.path.getsize(self.bin_path) == 0 and os.path.exists(self.store_path):
+            src = JsonlStore(self.store_path)
+            entries = [e for _, e in src.rows()]
+            if entries:
+                self._store.rewrite(entries)
 
     def _recompute_df(self) -> Dict[str, int]:
-        df: Dict[str, int] = {}
-        for entry in self.iter_all():
-            seen = set(_tok(entry.get('text','')))
-            for t in seen:
-                df[t] = df.get(t, 0) + 1
-        return df
+        snap = _load_json(self.df_snapshot_path, {})
+        if self._load_index_snapshot(snap):
+            return self.df
+        tail = self._build_index(snap)
+        if tail is None:
+            # Snapshot does not describe this store (rewritten or truncated); rebuild from scratch
+            tail = self._build_index({})
+        if tail:
+            self.save_df_snapshot()
+        return self.df
 
-    def iter_all(self):
+    def _build_index(self, snap: Dict[str, Any]) -> Optional[int]:
+        # Single pass over the store that (re)builds df together with the inverted index,
+        # then one streaming pass over the embedding log. Rows covered by the snapshot take
+        # df from it and their tokens from the stored embedding; only rows past the snapshot
+        # offset are tokenized. Only the hot tier's vectors are kept. Returns the number of
+        # rows tokenized, or None if the snapshot checksum does not match.
+        covered = int(snap.get('offset', 0)) if snap.get('df') is not None else 0
+        if covered and (self._store.checksum(covered) != snap.get('checksum')
+                        or snap.get('revision', 0) != self._revision):
+            return None
+        self.df = dict(snap.get('df') or {}) if covered else {}
+        self._ids = []
+        self._rows = {}
+        self.postings = {}
+        self._boosted = []
+        self._tag_bits = {}
+        self._idf_cache = {}
+        self.embeddings = {}
+        self._hot_seen = {}
+        self._access = {}
+        self._dead = set()
+        self._pref_rows = {}
+        self._fp = array('Q')
+        self._fp_bands = None
+        self._seen = array('d')
+        self._reset_matrix()
+        tail = 0
+        # per row: postings built yet
+        posted = bytearray()
+        seen = self._seen
+        tail_vec: Dict[int, bytes] = {}
+        for end, entry in self._store.rows():
+            count_df = end > covered
+            if 'text' not in entry and (count_df or entry.get('type') == 'preference'):
+                # partial record from the store's own index; decode it to tokenize or to
+                # read its preference key
+                entry = self._store.get(len(self._ids))
+            upd = self._overlay.get(entry.get('id'))
+            if upd:
+                entry.update(upd)
+            row = len(self._ids)
+            # text replaced through the update log: the embedding log holds several versions
+            # for this id, so tokenize the current one (df is already in the snapshot)
+            rewritten = bool(upd) and 'text' in upd
+            if count_df or rewritten:
+                tokens = _tok(entry.get('text',''))
+                self._index_entry(entry, count_df=count_df, tokens=tokens)
+                if tokens and row not in self._dead:
+                    tail_vec[row] = self._pack(tokens)
+                tail += 1 if count_df else 0
+            else:
+                # postings come from the embedding log below
+                self._index_entry(entry, count_df=False, tokens=())
+            posted.append(1 if count_df or rewritten or row in self._dead else 0)
+        hot = self._select_hot(seen)
+        n_tokens = len(tail_vec)
+        for eid, vec, sh in self._emb_log.scan():
+            row = self._rows.get(eid)
+            if row is None or row in self._dead:
+                continue
+            if not posted[row]:
+                # A stored vector's terms are exactly the entry's distinct tokens
+                posted[row] = 1
+                n_tokens += 1
+                terms = self.vocab.terms_of(vec)
+                for t in terms:
+                    self.postings.setdefault(t, []).append(row)
+                self._index_fp(row, sh if sh is not None else simhash(terms))
+            if row in hot and row not in tail_vec:
+                self.embeddings[eid] = vec
+                self._hot_seen[row] = seen[row]
+        for row, vec in tail_vec.items():
+            if row in hot:
+                self.embeddings[self._ids[row]] = vec
+                self._hot_seen[row] = seen[row]
+        for row in [r for r, done in enumerate(posted) if not done]:
+            # covered row without a stored vector (crash between the two writes)
+            vec = self._cold_vec(row)
+            if vec:
+                n_tokens += 1
+                terms = self.vocab.terms_of(vec)
+                for t in terms:
+                    self.postings.setdefault(t, []).append(row)
+                self._index_fp(row, simhash(terms))
+                if row in hot:
+                    self.embeddings[self._ids[row]] = vec
+                    self._hot_seen[row] = seen[row]
+        self._n_cold = n_tokens - len(self.embeddings)
+        return tail
+
+    def _select_hot(self, seen) -> set:
+        # preference/habit rows plus the most recently seen others, up to the budget
+        if not self.hot_budget or len(seen) <= self.hot_budget:
+            return set(range(len(seen)))
+        hot = set(self._boosted)
+        rest = (r for r in range(len(seen)) if r not in hot)
+        hot.update(heapq.nlargest(max(self.hot_budget - len(hot), 0), rest, key=seen.__getitem__))
+        return hot
+
+    @staticmethod
+    def _id_time(eid: str) -> float:
+        # ids are mem_<ms>, so they double as a creation time when last_seen is not at hand
+        return int(eid[4:]) / 1000.0 if eid.startswith('mem_') and eid[4:].isdigit() else 0.0
+
+    def _updates_size(self) -> int:
         try:
-            with open(STORE_PATH, 'r', encoding='utf-8') as f:
+            return os.path.getsize(self.updates_path)
+        except OSError:
+            return 0
+
+    def save_df_snapshot(self):
+        # df, the store's row index and the rest of the index, all as of now
+        with self._lock:
+            stamp = {
+                'offset': self._store.size,
+                'checksum': f"{self._store.crc:08x}",
+                'revision': self._revision,
+            }
+            _save_json(self.df_snapshot_path, dict(stamp, df=self.df))
+            self._store.save_index()
+            self._save_index_snapshot(stamp)
+            self._snapshot_stamp = (self._store.size, self._updates_size())
+
+    def _save_index_snapshot(self, stamp: Dict[str, Any]):
+        # One JSON header line, then the per-row fingerprints (u64) and recency (f64), and the
+        # postings as per-term lengths (u32) plus the rows end to end (u32), in header order
+        terms = list(self.postings)
+        lens = array('I', [len(self.postings[t]) for t in terms])
+        rows = array('I')
+        for t in terms:
+            rows.extend(self.postings[t])
+        header = dict(
+            stamp,
+            updates=self._updates_size(),
+            rows=len(self._ids),
+            n_tokens=len(self.embeddings) + self._n_cold,
+            last_id_ms=self._last_id_ms,
+            ids=self._ids,
+            dead=sorted(self._dead),
+            boosted=self._boosted,
+            pref_rows=self._pref_rows,
+            tags={tag: format(bits, 'x') for tag, bits in self._tag_bits.items() if bits},
+            terms=terms,
+        )
+        tmp = self.index_snapshot_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(header, ensure_ascii=False).encode('utf-8') + b'\n')
+            for part in (self._fp, self._seen, lens, rows):
+                part.tofile(f)
+        os.replace(tmp, self.index_snapshot_path)
+
+    def _load_index_snapshot(self, snap: Dict[str, Any]) -> bool:
+        # Restore the index saved with the df snapshot when both still describe the store and
+        # the update log byte for byte; only the hot tier's vectors are then read, from the
+        # embedding log. False (nothing changed) when anything is out of date.
+        try:
+            with open(self.index_snapshot_path, 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                if (snap.get('df') is None or header.get('updates') != self._updates_size()
+                        or header.get('revision') != self._revision
+                        or any(header.get(k) != snap.get(k) for k in ('offset', 'checksum', 'revision'))):
+                    return False
+                n, terms = header['rows'], header['terms']
+                fp, seen, lens, rows = array('Q'), array('d'), array('I'), array('I')
+                fp.fromfile(f, n)
+                seen.fromfile(f, n)
+                lens.fromfile(f, len(terms))
+                rows.fromfile(f, sum(lens))
+        except (OSError, ValueError, KeyError, EOFError):
+            return False
+        if not self._store.restore(header['offset'], header['checksum']) or len(self._store) != n:
+            return False
+        self.df = dict(snap['df'])
+        self._ids = header['ids']
+        self._rows = {eid: row for row, eid in enumerate(self._ids)}
+        self.postings = {}
+        pos = 0
+        for t, k in zip(terms, lens):
+            self.postings[t] = rows[pos:pos + k].tolist()
+            pos += k
+        self._boosted = header['boosted']
+        self._dead = set(header['dead'])
+        self._pref_rows = header['pref_rows']
+        self._tag_bits = {tag: int(bits, 16) for tag, bits in header['tags'].items()}
+        self._last_id_ms = header['last_id_ms']
+        self._fp = fp
+        self._fp_bands = None
+        self._seen = seen
+        self._idf_cache = {}
+        self.embeddings = {}
+        self._hot_seen = {}
+        self._access = {}
+        self._reset_matrix()
+        hot = self._select_hot(seen)
+        for eid, vec, _ in self._emb_log.scan():
+            row = self._rows.get(eid)
+            # later records win: a rewritten text's vector follows the original's
+            if row is not None and row in hot and row not in self._dead:
+                self.embeddings[eid] = vec
+                self._hot_seen[row] = seen[row]
+        self._n_cold = header['n_tokens'] - len(self.embeddings)
+        self._snapshot_stamp = (self._store.size, self._updates_size())
+        return True
+
+    def _index_entry(self, entry: Dict[str, Any], count_df: bool = True, tokens=None, row: Optional[int] = None,
+                     fp: Optional[int] = None):
+        # Index a new row, or re-index an existing one (row given) after _unindex_row. fp is
+        # the tokens' SimHash when the caller already has it
+        eid = entry['id']
+        if row is None:
+            row = len(self._ids)
+            self._ids.append(eid)
+            self._rows[eid] = row
+            self._fp.append(0)
+            self._seen.append(entry.get('last_seen') or self._id_time(eid))
+            if eid.startswith('mem_') and eid[4:].isdigit():
+                self._last_id_ms = max(self._last_id_ms, int(eid[4:]))
+        if entry.get('deleted'):
+            self._dead.add(row)
+            return
+        if tokens is None:
+            tokens = _tok(entry.get('text',''))
+        tokens = set(tokens)
+        for t in tokens:
+            if count_df:
+                self.df[t] = self.df.get(t, 0) + 1
+                self._idf_cache.pop(t, None)
+                if self._col_w2 is not None:
+                    self._df_dirty.add(t)
+            self.postings.setdefault(t, []).append(row)
+        if entry.get('type') in ('preference','habit'):
+            self._boosted.append(row)
+        for tag in set(t.lower() for t in entry.get('tags') or []):
+            self._tag_bits[tag] = self._tag_bits.get(tag, 0) | (1 << row)
+        key = self._pref_key(entry)
+        if key is not None:
+            self._pref_rows.setdefault(key, []).append(row)
+        if tokens:
+            self._index_fp(row, fp if fp is not None else simhash(tokens))
+
+    def _bands(self) -> List[Dict[int, List[int]]]:
+        # Band tables, built on first use: startup only needs the fingerprints themselves
+        if self._fp_bands is None:
+            tables: List[Dict[int, List[int]]] = [{} for _ in range(BANDS)]
+            for row, fp in enumerate(self._fp):
+                if fp:
+                    for band, value in zip(tables, bands(fp)):
+                        band.setdefault(value, []).append(row)
+            self._fp_bands = tables
+        return self._fp_bands
+
+    def _index_fp(self, row: int, fp: int):
+        self._fp[row] = fp
+        if fp and self._fp_bands is not None:
+            for band, value in zip(self._fp_bands, bands(fp)):
+                band.setdefault(value, []).append(row)
+
+    def _unindex_fp(self, row: int):
+        fp = self._fp[row]
+        if fp and self._fp_bands is not None:
+            for band, value in zip(self._fp_bands, bands(fp)):
+                rows = band.get(value)
+                if rows is not None and row in rows:
+                    rows.remove(row)
+                    if not rows:
+                        del band[value]
+        self._fp[row] = 0
+
+    def _near_duplicate(self, fp: int, tokens: set, mtype: Any) -> Optional[int]:
+        # A live row of the same type within MAX_DISTANCE bits; candidates share a band
+        seen = set()
+        for band, value in zip(self._bands(), bands(fp)):
+            for row in band.get(value, ()):
+                if row in seen:
+                    continue
+                seen.add(row)
+                if distance(fp, self._fp[row]) > MAX_DISTANCE:
+                    continue
+                other = self.embeddings.get(self._ids[row]) or self._cold_vec(row) or b''
+                if _jaccard(tokens, self.vocab.terms_of(other)) >= NEAR_DUP_MIN_JACCARD and self._entry(row).get('type') == mtype:
+                    return row
+        return None
+
+    def _unindex_row(self, row: int, entry: Dict[str, Any], tokens):
+        # Undo _index_entry for a row whose text is replaced or which is being deleted
+        for t in set(tokens):
+            n = self.df.get(t, 0) - 1
+            if n > 0:
+                self.df[t] = n
+            else:
+                self.df.pop(t, None)
+            self._idf_cache.pop(t, None)
+            if self._col_w2 is not None:
+                self._df_dirty.add(t)
+            rows = self.postings.get(t)
+            if rows is not None:
+                try:
+                    rows.remove(row)
+                except ValueError:
+                    pass
+                if not rows:
+                    del self.postings[t]
+        if row in self._boosted:
+            self._boosted.remove(row)
+        for tag in set(t.lower() for t in entry.get('tags') or []):
+            if tag in self._tag_bits:
+                self._tag_bits[tag] &= ~(1 << row)
+        key = self._pref_key(entry)
+        if key is not None and row in self._pref_rows.get(key, ()):
+            self._pref_rows[key].remove(row)
+        if self.embeddings.pop(self._ids[row], None) is not None:
+            self._hot_seen.pop(row, None)
+        elif tokens:
+            self._n_cold -= 1
+        self._unindex_fp(row)
+        self._drop_matrix_row(row)
+
+    def _drop_matrix_row(self, row: int):
+        # Zero a row's entries in whichever built block holds it, so a replaced or deleted
+        # row stops scoring without a rebuild; _replace_row then scores the new text on the
+        # side through _pending_hot
+        self._pending_hot.discard(row)
+        blocks = [(0, self._mat)] if self._mat is not None else []
+        if self._tail_mat is not None:
+            blocks.append((self._mat_rows, self._tail_mat[1]))
+        for start, block in blocks:
+            local = row - start
+            m, mc = block[0], block[1]
+            if 0 <= local < m.shape[0]:
+                lo, hi = m.indptr[local], m.indptr[local + 1]
+                # the same entries in the column-major copy: this row's slot in each of its columns
+                for col in m.indices[lo:hi]:
+                    c0, c1 = mc.indptr[col], mc.indptr[col + 1]
+                    mc.data[c0 + np.searchsorted(mc.indices[c0:c1], local)] = 0.0
+                m.data[lo:hi] = 0.0
+                if block[2] is not None:
+                    block[2][local] = 0.0
+
+    @staticmethod
+    def _pref_key(entry: Dict[str, Any]) -> Optional[str]:
+        # Preferences are stored as "preference:<key>=<value>"
+        text = entry.get('text') or ''
+        if entry.get('type') != 'preference' or not text.startswith('preference:') or '=' not in text:
+            return None
+        return text[len('preference:'):].split('=', 1)[0]
+
+    def _load_overlay(self):
+        self._overlay = {}
+        self._overlay_lines = 0
+        self._revision = 0
+        try:
+            with open(self.updates_path, 'r', encoding='utf-8') as f:
                 for line in f:
                     line = line.strip()
                     if not line:
                         continue
                     try:
-                        yield json.loads(line)
+                        rec = json.loads(line)
                     except Exception:
                         continue
+                    fields = rec.get('set', {})
+                    self._overlay.setdefault(rec['id'], {}).update(fields)
+                    self._overlay_lines += 1
+                    if 'text' in fields or 'deleted' in fields:
+                        self._revision += 1
         except Exception:
             return
 
-    def _write_entry(self, entry: Dict[str, Any]):
-        with open(STORE_PATH, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    def _entry(self, row: int) -> Dict[str, Any]:
+        # Full record for a row with pending overlay updates applied
+        entry = self._store.get(row)
+        upd = self._overlay.get(entry.get('id'))
+        if upd:
+            entry.update(upd)
+        return entry
 
-    def add(self, text: str, mtype: str = 'note', tags: Optional[List[str]] = None, source: str = 'user', extra: Optional[Dict[str, Any]] = None) -> str:
-        eid = f"mem_{int(_now()*1000)}"
+    def get(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._rows.get(entry_id)
+            if row is None or row in self._dead:
+                return None
+            return dict(self._entry(row))
+
+    def __len__(self) -> int:
+        return len(self._ids) - len(self._dead)
+
+    def iter_all(self):
+        for row in range(len(self._ids)):
+            if row in self._dead:
+                continue
+            # the lock is not held while the caller consumes the entry
+            with self._lock:
+                entry = dict(self._entry(row))
+            yield entry
+
+    @staticmethod
+    def tokenize(text: str) -> Tuple[str, ...]:
+        # The tokenizer retrieval scores with, for callers that key on query terms
+        return tokenize(text)
+
+    def add_listener(self, fn: Callable[[Dict[str, Any], set], None]):
+        self._add_listeners.append(fn)
+
+    def remove_listener(self, fn: Callable[[Dict[str, Any], set], None]):
+        if fn in self._add_listeners:
+            self._add_listeners.remove(fn)
+
+    def approx_bytes(self) -> int:
+        # Rough resident size, for callers that cap how many stores stay loaded: packed
+        # vectors, postings entries and per-row bookkeeping (records stay on disk)
+        with self._lock:
+            size = sum(map(len, self.embeddings.values()))
+            size += 8 * sum(map(len, self.postings.values()))
+            size += 200 * len(self._ids)
+            return size
+
+    def _notify_added(self, entries: List[Dict[str, Any]], tokens: List[List[str]]):
+        for fn in self._add_listeners:
+            for entry, toks in zip(entries, tokens):
+                fn(entry, set(toks))
+
+    def _new_id(self) -> str:
+        # Millisecond ids, bumped past the last one so bursts of adds never collide
+        with self._id_lock:
+            ms = max(int(_now()*1000), self._last_id_ms + 1)
+            self._last_id_ms = ms
+        return f"mem_{ms}"
+
+    def _make_entry(self, text: str, mtype: str = 'note', tags: Optional[List[str]] = None, source: str = 'user', extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         entry = {
-            'id': eid,
+            'id': self._new_id(),
             'type': mtype,
             'text': text.strip(),
             'tags': tags or [],
@@ -89,44 +809,331 @@ class LongTermMemory:
         }
         if extra:
             entry.update(extra)
-        self._write_entry(entry)
-        self._embed_entry(entry)
-        # update df cache
-        for t in set(_tok(entry['text'])):
-            self.df[t] = self.df.get(t, 0) + 1
-        return eid
-
-    def _embed_entry(self, entry: Dict[str, Any]):
-        # Compute simple tf-idf-like vector
-        tokens = _tok(entry.get('text',''))
-        if not tokens:
+        return entry
+
+    def add(self, text: str, mtype: str = 'note', tags: Optional[List[str]] = None, source: str = 'user', extra: Optional[Dict[str, Any]] = None) -> str:
+        entry = self._make_entry(text, mtype=mtype, tags=tags, source=source, extra=extra)
+        return self._submit([entry])[0]
+
+    def add_many(self, items) -> List[str]:
+        """Bulk insert. Items are strings or dicts with 'text' and optional 'type', 'tags',
+        'source'; any other keys are stored as extra fields. The batch is committed as one
+        group: one buffered append and one fsync, and embeddings/df are updated once.
+        Near-duplicates (of stored memories or within the batch) are merged, so the returned
+        ids may repeat or refer to existing memories."""
+        entries: List[Dict[str, Any]] = []
+        for item in items:
+            if isinstance(item, str):
+                item = {'text': item}
+            rest = {k: v for k, v in item.items() if k not in ('text', 'type', 'tags', 'source', 'id')}
+            entries.append(self._make_entry(
+                str(item.get('text', '')),
+                mtype=item.get('type', 'note'),
+                tags=item.get('tags'),
+                source=item.get('source', 'user'),
+                extra=rest or None,
+            ))
+        if not entries:
+            return []
+        return self._submit(entries)
+
+    def _submit(self, entries: List[Dict[str, Any]]) -> List[str]:
+        # Hand entries to the writer thread and wait until they are durable and indexed
+        if threading.current_thread() is self._writer:
+            # an add listener adding memories; the writer cannot wait on itself
+            return self._commit(entries)
+        req = _WriteRequest(entries)
+        with self._id_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._writer_loop, name='ltm-writer', daemon=True)
+                self._writer.start()
+            self._queue.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.ids
+
+    def _writer_loop(self):
+        stop = False
+        while not stop:
+            req = self._queue.get()
+            if req is None:
+                return
+            group = [req]
+            size = len(req.entries)
+            # Everything queued while the previous group was being written goes out together
+            while size < GROUP_COMMIT_MAX:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                group.append(nxt)
+                size += len(nxt.entries)
+            try:
+                ids = self._commit([e for r in group for e in r.entries])
+                pos = 0
+                for r in group:
+                    r.ids = ids[pos:pos + len(r.entries)]
+                    pos += len(r.entries)
+            except Exception as e:
+                for r in group:
+                    r.error = e
+            for r in group:
+                r.done.set()
+
+    def _commit(self, entries: List[Dict[str, Any]]) -> List[str]:
+        with self._lock:
+            ids, entries, tokens, fps = self._merge_duplicates(entries)
+            if not entries:
+                return ids
+            vecs = [(entry['id'], self._pack(toks), fp) for entry, toks, fp in zip(entries, tokens, fps) if toks]
+            # Embeddings go first: a crash before the store write only leaves unused vectors behind
+            rolled = self._emb_log.append_many(vecs)
+            self._store.append(entries, sync=True)
+            for entry, toks, fp in zip(entries, tokens, fps):
+                self._index_entry(entry, tokens=toks, fp=fp)
+            for entry, (eid, vec, _) in zip((e for e, t in zip(entries, tokens) if t), vecs):
+                self.embeddings[eid] = vec
+                self._hot_seen[self._rows[eid]] = entry.get('last_seen') or _now()
+            if self._dense is not None:
+                self._dense.add([eid for eid, _, _ in vecs], [t for t in tokens if t])
+            # compaction reads every row's vector, so it waits until the batch is indexed, and
+            # runs before the budget pass so the batch's vectors are still resident
+            if rolled and self._emb_log.needs_compaction():
+                self.compact_embeddings()
+            self._enforce_budget()
+            self._notify_added(entries, tokens)
+            return ids
+
+    @staticmethod
+    def _merged_fields(kept: Dict[str, Any], dup: Dict[str, Any]) -> Dict[str, Any]:
+        # What a duplicate adds to the memory it is merged into: tags the memory lacks and
+        # its extra fields (the newer value wins); the text, type and source stay
+        fields: Dict[str, Any] = {}
+        have = {t.lower() for t in kept.get('tags') or []}
+        new_tags = [t for t in dict.fromkeys(dup.get('tags') or []) if t.lower() not in have]
+        if new_tags:
+            fields['tags'] = list(kept.get('tags') or []) + new_tags
+        for k, v in dup.items():
+            if k not in _ENTRY_FIELDS and kept.get(k) != v:
+                fields[k] = v
+        return fields
+
+    def _merge_duplicates(self, entries: List[Dict[str, Any]]):
+        # Drop entries whose SimHash is within MAX_DISTANCE of a stored memory (or of an
+        # earlier entry in this group) of the same type; the memory kept gets the duplicate's
+        # tags and extra fields, and a stored one its last_seen bumped. Returns the resulting
+        # id per input entry and the entries to store with their tokens and fingerprints.
+        ids: List[str] = []
+        fresh: List[Dict[str, Any]] = []
+        fresh_tokens: List[List[str]] = []
+        # within-group index: (band number, band value) -> fresh entry positions
+        group: Dict[Tuple[int, int], List[int]] = {}
+        group_fp: List[int] = []
+        merged = False
+        for entry in entries:
+            toks = _tok(entry['text'])
+            fp = simhash(toks)
+            if fp:
+                distinct = set(toks)
+                row = self._near_duplicate(fp, distinct, entry.get('type'))
+                if row is not None:
+                    eid = self._ids[row]
+                    kept = self._entry(row)
+                    fields = self._merged_fields(kept, entry)
+                    for tag in set(t.lower() for t in fields.get('tags', ())):
+                        self._tag_bits[tag] = self._tag_bits.get(tag, 0) | (1 << row)
+                    self._update_fields(eid, dict(fields, last_seen=entry.get('last_seen') or _now()))
+                    self._promote(row, _now())
+                    if fields:
+                        # tag-filtered results may have changed
+                        kept.update(fields)
+                        self._notify_added([kept], [toks])
+                    ids.append(eid)
+                    merged = True
+                    continue
+                match = None
+                for key in enumerate(bands(fp)):
+                    for i in group.get(key, ()):
+                        if (distance(fp, group_fp[i]) <= MAX_DISTANCE and fresh[i].get('type') == entry.get('type')
+                                and _jaccard(distinct, fresh_tokens[i]) >= NEAR_DUP_MIN_JACCARD):
+                            match = i
+                            break
+                    if match is not None:
+                        break
+                if match is not None:
+                    fresh[match].update(self._merged_fields(fresh[match], entry))
+                    ids.append(fresh[match]['id'])
+                    continue
+                for key in enumerate(bands(fp)):
+                    group.setdefault(key, []).append(len(fresh))
+            group_fp.append(fp)
+            fresh.append(entry)
+            fresh_tokens.append(toks)
+            ids.append(entry['id'])
+        if merged:
+            self._enforce_budget()
+        return ids, fresh, fresh_tokens, group_fp
+
+    def close(self):
+        slot = self._slot
+        if slot is None:
+            self._close()
             return
+        with slot.lock:
+            if slot.ltm is not self:
+                # already closed
+                return
+            slot.refs -= 1
+            if slot.refs > 0:
+                return
+            # still registered while closing, so a concurrent shared() waits for the release
+            try:
+                self._close()
+            finally:
+                slot.ltm = None
+                with _open_stores_lock:
+                    if _open_stores.get(self._key) is slot:
+                        del _open_stores[self._key]
+
+    def _close(self):
+        # Drain pending adds, stop the writer and release the store
+        writer = self._writer
+        if writer is not None and writer.is_alive():
+            self._queue.put(None)
+            writer.join()
+        self._writer = None
+        with self._lock:
+            try:
+                if not self._lock_file.closed and self._snapshot_stamp != (self._store.size, self._updates_size()):
+                    # the next open loads the index instead of rebuilding it
+                    self.save_df_snapshot()
+            finally:
+                self._store.close()
+                if not self._lock_file.closed:
+                    self._lock_file.close()
+
+    @staticmethod
+    def _tf(tokens: List[str]) -> Dict[str, float]:
         tf: Dict[str, float] = {}
         for t in tokens:
             tf[t] = tf.get(t, 0.0) + 1.0
         for t in tf:
             tf[t] /= len(tokens)
-        vec: Dict[str, float] = {}
-        for t, v in tf.items():
-            idf = 1.0 / (1.0 + self.df.get(t, 0))
-            vec[t] = v * idf
-        self.embeddings[entry['id']] = vec
-        _save_json(EMB_PATH, self.embeddings)
+        return tf
+
+    def _pack(self, tokens: List[str]) -> bytes:
+        return self.vocab.pack(self._tf(tokens))
+
+    def _idf(self, t: str) -> float:
+        w = self._idf_cache.get(t)
+        if w is None:
+            w = 1.0 / (1.0 + self.df.get(t, 0))
+            self._idf_cache[t] = w
+        return w
+
+    def _weigh(self, tf: Dict[str, float]) -> Dict[str, float]:
+        # Simple tf-idf-like vector using the live df table
+        return {t: v * self._idf(t) for t, v in tf.items()}
+
+    def _cold_vec(self, row: int) -> Optional[bytes]:
+        # A non-resident row's packed vector, re-derived from its stored text
+        tokens = _tok(self._entry(row).get('text',''))
+        return self._pack(tokens) if tokens else None
+
+    def _iter_vectors(self) -> Iterator[Tuple[str, bytes, int]]:
+        # Every live row's current vector, for compaction. Resident ones come from memory;
+        # cold ones are copied from the log, whose last record for an id is its current
+        # vector: one pass finds that record per row, a second copies it. Only rows without
+        # one (a crash between the two writes, the older idf-weighted formats) are re-derived
+        # from the stored text.
+        for row, eid in enumerate(self._ids):
+            vec = self.embeddings.get(eid)
+            if vec and row not in self._dead:
+                yield eid, vec, self._fp[row] or simhash(self.vocab.terms_of(vec))
+        if not self._n_cold:
+            return
+        last = array('q', [-1]) * len(self._ids)
+        for i, (eid, _, _) in enumerate(self._emb_log.scan()):
+            row = self._rows.get(eid)
+            if row is not None:
+                last[row] = i
+        # rows without tokens have no current vector, whatever the log still holds
+        legacy = set(self._emb_log.legacy_ids)
+        for row, eid in enumerate(self._ids):
+            if not self._fp[row] or eid in legacy:
+                last[row] = -1
+        copied = bytearray(len(self._ids))
+        for i, (eid, vec, sh) in enumerate(self._emb_log.scan()):
+            row = self._rows.get(eid)
+            if row is None or last[row] != i or row in self._dead or eid in self.embeddings:
+                continue
+            copied[row] = 1
+            yield eid, vec, self._fp[row]
+        for row, eid in enumerate(self._ids):
+            if not copied[row] and row not in self._dead and eid not in self.embeddings:
+                vec = self._cold_vec(row)
+                if vec:
+                    yield eid, vec, self._fp[row] or simhash(self.vocab.terms_of(vec))
+
+    def compact_embeddings(self):
+        with self._lock:
+            self._emb_log.compact(self._iter_vectors())
+
+    def _promote(self, row: int, seen: float):
+        # Bring a cold row's vector back into the hot tier
+        eid = self._ids[row]
+        if row in self._dead:
+            return
+        if eid in self.embeddings:
+            self._hot_seen[row] = max(self._hot_seen.get(row, 0.0), seen)
+            return
+        vec = self._cold_vec(row)
+        if not vec:
+            return
+        self.embeddings[eid] = vec
+        self._hot_seen[row] = seen
+        self._n_cold -= 1
+        if self._mat is not None:
+            # its matrix row was built empty; scored on the side until the next rebuild
+            self._pending_hot.add(row)
+
+    def _note_hits(self, rows: List[int]):
+        # Retrieval hits count towards staying hot; cold hits are promoted
+        now = _now()
+        for row in rows:
+            self._access[row] = self._access.get(row, 0) + 1
+            if self._ids[row] not in self.embeddings:
+                self._promote(row, now)
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        if not self.hot_budget or len(self.embeddings) <= self.hot_budget:
+            return
+        # Evict down to 90% of the budget at once so the matrix is rebuilt rarely
+        pinned = set(self._boosted)
+        excess = len(self.embeddings) - int(self.hot_budget * 0.9)
+        victims = heapq.nsmallest(
+            excess,
+            (r for r in self._hot_seen if r not in pinned),
+            key=lambda r: self._hot_seen[r] + HOT_ACCESS_WEIGHT * self._access.get(r, 0),
+        )
+        if not victims:
+            return
+        for row in victims:
+            del self.embeddings[self._ids[row]]
+            del self._hot_seen[row]
+        self._n_cold += len(victims)
+        self._reset_matrix()
 
     def _embed_query(self, text: str) -> Dict[str, float]:
-        tokens = _tok(text)
+        tokens = tokenize(text)
         if not tokens:
             return {}
-        tf: Dict[str, float] = {}
-        for t in tokens:
-            tf[t] = tf.get(t, 0.0) + 1.0
-        for t in tf:
-            tf[t] /= len(tokens)
-        vec: Dict[str, float] = {}
-        for t, v in tf.items():
-            idf = 1.0 / (1.0 + self.df.get(t, 0))
-            vec[t] = v * idf
-        return vec
+        return self._weigh(self._tf(tokens))
 
     @staticmethod
     def _cosine(a: Dict[str, float], b: Dict[str, float]) -> float:
@@ -141,36 +1148,440 @@ class LongTermMemory:
             return 0.0
         return dot / (na * nb)
 
+    def _tag_filter(self, tags: Optional[List[str]]) -> Optional[bytes]:
+        # Union of the requested tags' bitmaps as little-endian bytes (bit i = row i), so a
+        # row test is one byte lookup; None means no tag filter
+        if not tags:
+            return None
+        mask = 0
+        for t in tags:
+            mask |= self._tag_bits.get(t.lower(), 0)
+        return mask.to_bytes((len(self._ids) + 7) // 8, 'little')
+
+    @staticmethod
+    def _tagged_rows(bits: bytes):
+        # Rows set in a tag filter, ascending; only the bitmap's non-zero bytes are unpacked
+        b = np.frombuffer(bits, dtype=np.uint8)
+        nz = np.flatnonzero(b)
+        r, c = np.nonzero(np.unpackbits(b[nz, None], axis=1, bitorder='little'))
+        return nz[r] * 8 + c
+
+    @staticmethod
+    def _in_filter(bits: bytes, row: int) -> bool:
+        return bool(bits[row >> 3] >> (row & 7) & 1)
+
+    def _score_cold(self, qv: Dict[str, float], bits: Optional[bytes]) -> List[Tuple[float, int]]:
+        # Cold rows sharing a token with the query, ranked by summed idf of the shared tokens;
+        # only the best COLD_MAX_CANDIDATES are decoded and scored
+        overlap: Dict[int, float] = {}
+        for t in qv:
+            w = self._idf(t)
+            for row in self.postings.get(t, ()):
+                if self._ids[row] not in self.embeddings:
+                    overlap[row] = overlap.get(row, 0.0) + w
+        rows = [r for r in overlap if self._in_filter(bits, r)] if bits is not None else list(overlap)
+        if len(rows) > COLD_MAX_CANDIDATES:
+            rows = heapq.nlargest(COLD_MAX_CANDIDATES, rows, key=overlap.__getitem__)
+        results: List[Tuple[float, int]] = []
+        for row in rows:
+            vec = self._cold_vec(row)
+            sim = self._cosine(qv, self._weigh(self.vocab.unpack(vec))) if vec else 0.0
+            if sim > 0:
+                results.append((sim, row))
+        return results
+
+    def _reset_matrix(self):
+        self._mat = None
+        self._mat_rows = 0
+        self._tail_mat = None
+        self._pending_mat = None
+        self._col_w2 = None
+        self._df_dirty = set()
+        self._pending_hot = set()
+
+    def _build_csr(self, eids: List[str]) -> list:
+        # Block of term frequencies for the given rows: [CSR, CSC copy, norms, version].
+        # The CSC copy holds each column's rows in order, i.e. the term's postings, which is
+        # what a query reads; row norms are filled in lazily by _block_norms because they
+        # depend on the live idf weights
+        vecs = [self.embeddings.get(eid, b'') for eid in eids]
+        nnz = np.fromiter((len(v) // 8 for v in vecs), dtype=np.int64, count=len(vecs))
+        indptr = np.zeros(len(vecs) + 1, dtype=np.int64)
+        np.cumsum(nnz, out=indptr[1:])
+        # The packed vectors laid end to end as 4-byte words: row i holds its nnz[i] ids and
+        # then its nnz[i] weights from word 2 * indptr[i], so both gather in one fancy index
+        words = np.frombuffer(b''.join(vecs), dtype='<u4')
+        pos = np.arange(indptr[-1], dtype=np.int64) + np.repeat(indptr[:-1], nnz)
+        indices = words[pos].astype(np.int64)
+        data = words.view('<f4')[pos + np.repeat(nnz, nnz)].astype(np.float64)
+        m = sparse.csr_matrix((data, indices, indptr), shape=(len(vecs), len(self.vocab)))
+        return [m, m.tocsc(), None, -1]
+
+    def _column_weights(self):
+        # idf^2 per column; only new columns and tokens whose df changed are recomputed
+        w2 = self._col_w2 if self._col_w2 is not None else np.zeros(0)
+        changed = self._col_w2 is None
+        terms = self.vocab.terms
+        if len(w2) < len(terms):
+            fresh = np.asarray([self._idf(t) ** 2 for t in terms[len(w2):]], dtype=np.float64)
+            w2 = np.concatenate([w2, fresh])
+            changed = True
+        if self._df_dirty:
+            for t in self._df_dirty:
+                col = self.vocab.ids.get(t)
+                if col is not None:
+                    w2[col] = self._idf(t) ** 2
+            self._df_dirty = set()
+            changed = True
+        self._col_w2 = w2
+        if changed:
+            self._w2_version += 1
+        return w2
+
+    def _block_norms(self, block: list, w2):
+        # ||tf * idf|| per row as one sparse mat-vec, redone only after the weights moved
+        if block[3] != self._w2_version:
+            m = block[0]
+            squares = sparse.csr_matrix((m.data * m.data, m.indices, m.indptr), shape=m.shape)
+            block[2] = np.sqrt(squares @ w2[:m.shape[1]])
+            block[3] = self._w2_version
+        return block[2]
+
+    @staticmethod
+    def _gather(indptr, indices, data, segments):
+        # indices/data of the given CSR rows (or CSC columns) end to end, and each one's length
+        starts = indptr[segments]
+        lens = indptr[segments + 1] - starts
+        pos = np.arange(int(lens.sum()), dtype=np.int64) + np.repeat(starts - (np.cumsum(lens) - lens), lens)
+        return indices[pos], data[pos], lens
+
+    def _score_block(self, block: list, w2, cols, qs, weights, qnorms, tagged=None):
+        # Cosines of a batch of queries against a block's rows as one sparse product: the
+        # block restricted to the queries' columns times their tf * idf^2 weights, given as
+        # (column, query, weight) triples. Without a tag filter only those columns' postings
+        # are read (from the CSC copy) and multiplied out directly, which spares scipy's
+        # per-call overhead on the common single-query retrieve; with one (tagged: the block's
+        # allowed local rows, sorted) the other rows are dropped first, and when fewer rows
+        # are tagged than the postings hold, the product is taken over the tagged rows
+        # instead. Returns (row, query, cosine) triples with a positive cosine.
+        m, mc = block[0], block[1]
+        known = cols < mc.shape[1]
+        if not known.all():
+            # terms interned after the block was built have no column in it
+            cols, qs, weights = cols[known], qs[known], weights[known]
+        ucols = None
+        if tagged is not None:
+            ucols, at = np.unique(cols, return_inverse=True)
+        if ucols is not None and len(tagged) < int((mc.indptr[ucols + 1] - mc.indptr[ucols]).sum()):
+            wq = sparse.csr_matrix((weights, (at.reshape(-1), qs)), shape=(len(ucols), len(qnorms)))
+            dots = (m[tagged][:, ucols] @ wq).tocoo()
+            rows, qs, vals = tagged[dots.row], dots.col, dots.data
+        else:
+            rows, vals, lens = self._gather(mc.indptr, mc.indices, mc.data, cols)
+            qs = np.repeat(qs, lens)
+            vals = vals * np.repeat(weights, lens)
+            if tagged is not None:
+                at = np.minimum(np.searchsorted(tagged, rows), max(len(tagged) - 1, 0))
+                keep = tagged[at] == rows if len(tagged) else np.zeros(len(rows), dtype=bool)
+                rows, qs, vals = rows[keep], qs[keep], vals[keep]
+            # summed per (query, row); a lone query needs no query part in the key
+            if len(qnorms) > 1:
+                n = np.int64(m.shape[0])
+                keys, inv = np.unique(qs * n + rows, return_inverse=True)
+                qs, rows = np.divmod(keys, n)
+            else:
+                rows, inv = np.unique(rows, return_inverse=True)
+                qs = np.zeros(len(rows), dtype=np.int64)
+            vals = np.bincount(inv.reshape(-1), weights=vals, minlength=len(rows))
+        # rows zeroed by _drop_matrix_row still appear in the postings, with nothing to add
+        hit = vals > 0
+        rows, qs = rows[hit], qs[hit]
+        return rows, qs, vals[hit] / (self._block_norms(block, w2)[rows] * qnorms[qs])
+
+    def _matrix_blocks(self) -> List[Tuple[Any, list]]:
+        # (first row, block) for the matrix and its tail, then (rows, block) for the rows
+        # whose entries there are empty or zeroed (_pending_hot)
+        n = len(self._ids)
+        if (self._mat is None or n - self._mat_rows > max(MATRIX_TAIL_ROWS, self._mat_rows // 8)
+                or len(self._pending_hot) > MATRIX_TAIL_ROWS // 4):
+            self._mat = self._build_csr(self._ids)
+            self._mat_rows = n
+            self._tail_mat = None
+            self._pending_hot = set()
+            self._pending_mat = None
+        blocks: List[Tuple[Any, list]] = [(0, self._mat)]
+        if n > self._mat_rows:
+            if self._tail_mat is None or self._tail_mat[0] != n:
+                self._tail_mat = (n, self._build_csr(self._ids[self._mat_rows:n]))
+            blocks.append((self._mat_rows, self._tail_mat[1]))
+        if self._pending_hot:
+            rows = tuple(sorted(self._pending_hot))
+            if self._pending_mat is None or self._pending_mat[0] != rows:
+                self._pending_mat = (rows, self._build_csr([self._ids[r] for r in rows]))
+            blocks.append((np.asarray(rows, dtype=np.int64), self._pending_mat[1]))
+        return blocks
+
+    def _retrieve_matrix(self, queries: List[str], tags: Optional[List[str]], top_k: int) -> List[List[Dict[str, Any]]]:
+        # All queries are scored together, one sparse product per block over the columns of
+        # their terms, so the cost follows the postings read rather than the number of stored
+        # rows; the boosted rows, the cold tier and the ranking are then per query.
+        # cos = sum(tf_e * tf_q * idf^2) / (||tf_e * idf|| * ||tf_q * idf||)
+        blocks = self._matrix_blocks()
+        w2 = self._column_weights()
+        bits = self._tag_filter(tags)
+        tagged = None
+        if bits is not None:
+            tagged = self._tagged_rows(bits)
+        boosted = np.unique(np.asarray(self._boosted, dtype=np.int64))
+        if tagged is not None:
+            boosted = boosted[np.isin(boosted, tagged)]
+        qvs = [self._embed_query(q) for q in queries]
+        qnorms = np.asarray([math.sqrt(sum(v*v for v in qv.values())) for qv in qvs], dtype=np.float64)
+        cols: List[int] = []
+        qidx: List[int] = []
+        weights: List[float] = []
+        for i, qv in enumerate(qvs):
+            for t, w in qv.items():
+                col = self.vocab.ids.get(t)
+                # tokens never seen in the store cannot match any row
+                if col is not None:
+                    cols.append(col)
+                    qidx.append(i)
+                    weights.append(w * self._idf(t))
+        cols_a = np.asarray(cols, dtype=np.int64)
+        qidx_a = np.asarray(qidx, dtype=np.int64)
+        weights_a = np.asarray(weights, dtype=np.float64)
+        row_parts, q_parts, score_parts = [], [], []
+        if len(cols_a):
+            for where, block in blocks:
+                contiguous = isinstance(where, int)
+                local = None
+                if tagged is not None and contiguous:
+                    lo, hi = np.searchsorted(tagged, [where, where + block[0].shape[0]])
+                    local = tagged[lo:hi] - where
+                elif tagged is not None:
+                    local = np.flatnonzero(np.isin(where, tagged))
+                rows, qs, sims = self._score_block(block, w2, cols_a, qidx_a, weights_a, qnorms, local)
+                row_parts.append(rows + where if contiguous else where[rows])
+                q_parts.append(qs)
+                score_parts.append(sims)
+        # the product's entries grouped by query
+        if row_parts and len(queries) == 1:
+            all_rows, all_scores = np.concatenate(row_parts), np.concatenate(score_parts)
+            bounds = np.asarray([0, len(all_rows)])
+        elif row_parts:
+            all_q = np.concatenate(q_parts)
+            by_query = np.argsort(all_q, kind='stable')
+            all_rows, all_scores = np.concatenate(row_parts)[by_query], np.concatenate(score_parts)[by_query]
+            bounds = np.concatenate([[0], np.cumsum(np.bincount(all_q, minlength=len(queries)))])
+        else:
+            all_rows, all_scores = np.zeros(0, dtype=np.int64), np.zeros(0)
+            bounds = np.zeros(len(queries) + 1, dtype=np.int64)
+        out: List[List[Dict[str, Any]]] = []
+        hits: List[int] = []
+        for i, qv in enumerate(qvs):
+            lo, hi = bounds[i], bounds[i + 1]
+            # small bonus for type preference
+            rows, inv = np.unique(np.concatenate([boosted, all_rows[lo:hi]]), return_inverse=True)
+            scores = np.bincount(inv, weights=np.concatenate([np.full(len(boosted), 0.05), all_scores[lo:hi]]),
+                                 minlength=len(rows))
+            if self._n_cold and (not len(scores) or scores.max() < COLD_SCORE_THRESHOLD):
+                # cold rows are empty in the matrix, so their scores simply take over
+                cold = self._score_cold(qv, bits)
+                if cold:
+                    cold_rows = np.asarray([row for _, row in cold], dtype=np.int64)
+                    rest = ~np.isin(rows, cold_rows)
+                    rows = np.concatenate([rows[rest], cold_rows])
+                    scores = np.concatenate([scores[rest], [sim for sim, _ in cold]])
+                    by_row = np.argsort(rows, kind='stable')
+                    rows, scores = rows[by_row], scores[by_row]
+            rows, scores = rows[scores > 0], scores[scores > 0]
+            # rows are in file order, which a stable sort keeps among ties (rounded, so rows
+            # that tie exactly do so whatever order their products were summed in); only the
+            # returned records are decoded
+            order = rows[np.argsort(-np.round(scores, 12), kind='stable')][:top_k]
+            out.append([dict(self._entry(r)) for r in order])
+            hits.extend(order.tolist())
+        # after the loop: promotions and evictions may reset the blocks scored above
+        self._note_hits(hits)
+        return out
+
+    def retrieve_many(self, queries: List[str], tags: Optional[List[str]] = None, top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        queries = list(queries)
+        if not queries:
+            return []
+        with self._lock:
+            if self._dense is not None:
+                return self._retrieve_dense(queries, tags, top_k)
+            if sparse is None:
+                return [self._retrieve_dict(q, tags, top_k) for q in queries]
+            return self._retrieve_matrix(queries, tags, top_k)
+
     def retrieve(self, query: str, tags: Optional[List[str]] = None, top_k: int = 5) -> List[Dict[str, Any]]:
+        with self._lock:
+            if self._dense is not None:
+                return self._retrieve_dense([query], tags, top_k)[0]
+            if sparse is not None:
+                return self._retrieve_matrix([query], tags, top_k)[0]
+            return self._retrieve_dict(query, tags, top_k)
+
+    def _retrieve_dict(self, query: str, tags: Optional[List[str]], top_k: int) -> List[Dict[str, Any]]:
         qv = self._embed_query(query)
-        results: List[Tuple[float, Dict[str, Any]]] = []
-        tagset = set([t.lower() for t in (tags or [])])
-        for entry in self.iter_all():
-            if tags:
-                etags = set([t.lower() for t in entry.get('tags', [])])
-                if not tagset.intersection(etags):
-                    continue
-            ev = self.embeddings.get(entry['id'])
-            sim = self._cosine(qv, ev) if ev else 0.0
+        results: List[Tuple[float, int]] = []
+        bits = self._tag_filter(tags)
+        if bits is not None and not any(bits):
+            return []
+        boosted = set(self._boosted)
+        # Only entries sharing a token with the query (or carrying the type bonus) can score > 0
+        candidates = set(boosted)
+        for t in qv:
+            candidates.update(self.postings.get(t, ()))
+        if bits is not None:
+            # tag filtering happens on the bitmap, before any scoring
+            candidates = [row for row in candidates if self._in_filter(bits, row)]
+        for row in sorted(candidates):
+            ev = self.embeddings.get(self._ids[row])
+            sim = self._cosine(qv, self._weigh(self.vocab.unpack(ev))) if ev else 0.0
             # small bonus for type preference
-            if 'type' in entry and entry['type'] in ('preference','habit'):
+            if row in boosted:
                 sim += 0.05
             if sim > 0:
-                results.append((sim, entry))
-        results.sort(key=lambda x: x[0], reverse=True)
-        return [e for _, e in results[:top_k]]
+                results.append((sim, row))
+        if self._n_cold and max((sim for sim, _ in results), default=0.0) < COLD_SCORE_THRESHOLD:
+            results.extend(self._score_cold(qv, bits))
+            results.sort(key=lambda x: x[1])
+        # nlargest keeps file order among ties, like a stable sort; only the returned records are decoded
+        top = heapq.nlargest(top_k, results, key=lambda x: x[0])
+        self._note_hits([row for _, row in top])
+        return [dict(self._entry(row)) for _, row in top]
+
+    def _retrieve_dense(self, queries: List[str], tags: Optional[List[str]], top_k: int) -> List[List[Dict[str, Any]]]:
+        # Candidates come from the ANN index, or with a tag filter from exact scores over the
+        # tagged rows; preference/habit rows are always scored and get the type bonus
+        qvs = encode_many([tokenize(q) for q in queries])
+        bits = self._tag_filter(tags)
+        tagged = None
+        if bits is not None:
+            tagged = self._tagged_rows(bits).tolist()
+        boosted = [r for r in self._boosted if bits is None or self._in_filter(bits, r)]
+        out: List[List[Dict[str, Any]]] = []
+        hits: List[int] = []
+        for qv in qvs:
+            scores: Dict[int, float] = {}
+            if qv.any():
+                if tagged is not None:
+                    cand = zip(tagged, self._dense.score(qv, [self._ids[r] for r in tagged]).tolist())
+                else:
+                    # over-fetch: tombstoned rows stay in the index until compaction
+                    cand = ((self._rows.get(eid), sim) for eid, sim in self._dense.search(qv, 2 * top_k + 8))
+                for row, sim in cand:
+                    if row is not None and row not in self._dead and sim >= DENSE_MIN_SCORE:
+                        scores[row] = sim
+            sims = self._dense.score(qv, [self._ids[r] for r in boosted]).tolist() if boosted else []
+            for row, sim in zip(boosted, sims):
+                scores[row] = (sim if sim >= DENSE_MIN_SCORE else 0.0) + 0.05
+            # file order among ties, as in the other scorers
+            top = heapq.nsmallest(top_k, scores, key=lambda r: (-scores[r], r))
+            out.append([dict(self._entry(row)) for row in top])
+            hits.extend(top)
+        self._note_hits(hits)
+        return out
+
+    def _update_fields(self, entry_id: str, fields: Dict[str, Any]):
+        # Append to the update log instead of rewriting the store; compaction folds it in later
+        with self._lock:
+            with open(self.updates_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'id': entry_id, 'set': fields}, ensure_ascii=False) + '\n')
+            self._overlay.setdefault(entry_id, {}).update(fields)
+            self._overlay_lines += 1
+            row = self._rows.get(entry_id)
+            if row is not None and fields.get('last_seen'):
+                self._seen[row] = fields['last_seen']
+            if 'text' in fields or 'deleted' in fields:
+                self._revision += 1
+            if self._overlay_lines >= COMPACT_AFTER_UPDATES:
+                self.compact()
 
     def update_last_seen(self, entry_id: str):
-        # Append an update line to preserve immutability; simple approach: rewrite file
-        entries = list(self.iter_all())
-        for e in entries:
-            if e['id'] == entry_id:
-                e['last_seen'] = _now()
-        with open(STORE_PATH, 'w', encoding='utf-8') as f:
-            for e in entries:
-                f.write(json.dumps(e, ensure_ascii=False) + '\n')
+        now = _now()
+        with self._lock:
+            self._update_fields(entry_id, {'last_seen': now})
+            row = self._rows.get(entry_id)
+            if row is not None:
+                # a memory that was just seen belongs in the hot tier
+                self._promote(row, now)
+                self._enforce_budget()
+
+    def compact(self):
+        # Rewrite the store with all overlay updates merged and tombstoned rows dropped, then
+        # drop the update log. The embedding log goes first so it holds one current vector
+        # per live id when the index is rebuilt from it.
+        with self._lock:
+            self.compact_embeddings()
+            dead = self._dead
+            if self._dense is not None:
+                self._dense.compact({eid for row, eid in enumerate(self._ids) if row not in dead})
+            self._store.rewrite(self._entry(row) for row in range(len(self._ids)) if row not in dead)
+            try:
+                os.remove(self.updates_path)
+            except OSError:
+                pass
+            self._overlay = {}
+            self._overlay_lines = 0
+            self._revision = 0
+            if dead:
+                # Row ordinals shifted; df is unchanged, so re-index as if from a fresh snapshot
+                self._build_index({
+                    'offset': self._store.size,
+                    'checksum': f"{self._store.crc:08x}",
+                    'df': self.df,
+                })
+            # Offsets changed with the rewrite, so the old snapshots no longer apply
+            self.save_df_snapshot()
+
+    def _replace_row(self, row: int, fields: Dict[str, Any]):
+        # Rewrite a record in place through the update log, moving its df, postings, tags and
+        # vector from the old text to the new one
+        old = self._entry(row)
+        eid = old['id']
+        old_tokens = _tok(old.get('text',''))
+        self._unindex_row(row, old, old_tokens)
+        entry = dict(old)
+        entry.update(fields)
+        tokens = _tok(entry.get('text',''))
+        self._index_entry(entry, tokens=tokens, row=row)
+        if tokens:
+            vec = self._pack(tokens)
+            self._emb_log.append(eid, vec, self._fp[row])
+            self.embeddings[eid] = vec
+            self._hot_seen[row] = entry.get('last_seen') or _now()
+            if self._mat is not None:
+                self._pending_hot.add(row)
+            if self._dense is not None:
+                self._dense.add([eid], [tokens])
+        self._update_fields(eid, fields)
+        return entry, set(old_tokens) | set(tokens)
+
+    def _delete_row(self, row: int):
+        old = self._entry(row)
+        self._unindex_row(row, old, _tok(old.get('text','')))
+        self._dead.add(row)
+        self._update_fields(old['id'], {'deleted': True})
 
     def add_or_update_preference(self, key: str, value: str, tags: Optional[List[str]] = None):
-        # If a preference with same key exists, add a new entry marking it updated
+        # One live record per key: an existing preference is rewritten in place and any
+        # older duplicates are tombstoned, so updates never grow the store or df
         text = f"preference:{key}={value}"
+        with self._lock:
+            rows = list(self._pref_rows.get(key, ()))
+            if rows:
+                current = self._ids[rows[-1]]
+                for eid in [self._ids[r] for r in rows[:-1]]:
+                    # looked up by id: a compaction triggered by the update log renumbers rows
+                    self._delete_row(self._rows[eid])
+                entry, tokens = self._replace_row(self._rows[current], {'text': text, 'tags': tags or [key], 'last_seen': _now()})
+                # the df snapshot is not rewritten: the text change bumped the revision, so a
+                # restart ignores the stale snapshot and rebuilds df (and saves a fresh one)
+                self._notify_added([entry], [tokens])
+                return entry['id']
         return self.add(text=text, mtype='preference', tags=(tags or [key]))
@@ -0,0 +1,343 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Record stores backing LongTermMemory. Both expose the same small surface:
+#   rows()       replay the store at startup, yielding (end_offset, entry) per record; entries
+#                may be partial ({'id', 'type', 'tags'}) when the store can skip decoding
+#   append()     write a batch of entries
+#   get(row)     full entry for a row
+#   rewrite()    replace the whole contents (compaction)
+#   checksum(n)  crc32 of the first n bytes, or None if the store is shorter
+#   save_index() persist the row index; restore(size, crc) loads it instead of replaying,
+#                if the store is still exactly those size bytes with that crc32
+# size/crc always describe the bytes on disk so callers can snapshot derived state cheaply.
+
+_LEN = struct.Struct('<I')
+# JsonlStore's row index: <u64 size><u32 crc32> then one u64 offset per row
+_OFFSETS_HEADER = struct.Struct('<QI')
+
+
+def _ensure_file(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        with open(path, 'wb'):
+            pass
+
+
+class JsonlStore:
+    """One JSON object per line; only each record's byte offset is kept in RAM and records
+    are read back from the file when asked for."""
+
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        self.path = path
+        # row offsets saved by save_index (none without an index path)
+        self.index_path = index_path
+        _ensure_file(path)
+        self.offsets = array('Q')
+        self.size = 0
+        self.crc = 0
+        # opened on the first get(); appends go through their own handle
+        self._reader = None
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def rows(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        self.offsets = array('Q')
+        size = 0
+        crc = 0
+        try:
+            with open(self.path, 'rb') as f:
+                for raw in f:
+                    start = size
+                    size += len(raw)
+                    crc = zlib.crc32(raw, crc)
+                    line = raw.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except Exception:
+                        continue
+                    self.offsets.append(start)
+                    yield size, entry
+        except OSError:
+            pass
+        self.size = size
+        self.crc = crc
+
+    def checksum(self, n: int) -> Optional[str]:
+        crc = 0
+        left = n
+        try:
+            with open(self.path, 'rb') as f:
+                while left > 0:
+                    chunk = f.read(min(left, 1 << 20))
+                    if not chunk:
+                        return None
+                    crc = zlib.crc32(chunk, crc)
+                    left -= len(chunk)
+        except OSError:
+            return None
+        return f"{crc:08x}"
+
+    def append(self, entries: List[Dict[str, Any]], sync: bool = False):
+        lines = [(json.dumps(e, ensure_ascii=False) + '\n').encode('utf-8') for e in entries]
+        data = b''.join(lines)
+        with open(self.path, 'ab') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        pos = self.size
+        for line in lines:
+            self.offsets.append(pos)
+            pos += len(line)
+        self.size += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+
+    def get(self, row: int) -> Dict[str, Any]:
+        if self._reader is None:
+            self._reader = open(self.path, 'rb')
+        # the file only grows between rewrites, so a buffer left from an earlier read is
+        # never stale
+        self._reader.seek(self.offsets[row])
+        return json.loads(self._reader.readline().decode('utf-8'))
+
+    def rewrite(self, entries: Iterable[Dict[str, Any]]):
+        tmp = self.path + '.tmp'
+        offsets = array('Q')
+        size = 0
+        crc = 0
+        with open(tmp, 'wb') as f:
+            for e in entries:
+                data = (json.dumps(e, ensure_ascii=False) + '\n').encode('utf-8')
+                f.write(data)
+                offsets.append(size)
+                size += len(data)
+                crc = zlib.crc32(data, crc)
+        # entries may be read through the old file; it must be closed before it can be
+        # replaced on Windows
+        self.close()
+        os.replace(tmp, self.path)
+        self.offsets = offsets
+        self.size = size
+        self.crc = crc
+
+    def save_index(self):
+        if not self.index_path:
+            return
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_OFFSETS_HEADER.pack(self.size, self.crc))
+            self.offsets.tofile(f)
+        os.replace(tmp, self.index_path)
+
+    def restore(self, size: int, crc: str) -> bool:
+        try:
+            if not self.index_path or os.path.getsize(self.path) != size or self.checksum(size) != crc:
+                return False
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+        if len(data) < _OFFSETS_HEADER.size:
+            return False
+        saved_size, saved_crc = _OFFSETS_HEADER.unpack_from(data)
+        if saved_size != size or f"{saved_crc:08x}" != crc:
+            return False
+        offsets = array('Q')
+        offsets.frombytes(data[_OFFSETS_HEADER.size:])
+        self.offsets = offsets
+        self.size = size
+        self.crc = saved_crc
+        return True
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+
+class MmapStore:
+    """Length-prefixed records (<u32 length><utf-8 JSON>) read through a memory map.
+
+    A persisted row index (id, offset, type, tags per record, plus the byte size and crc32
+    it covers) lets startup skip decoding every record and gives O(1) access by row; only
+    records appended after the index was saved are decoded on load.
+    """
+
+    def __init__(self, path: str, index_path: str):
+        self.path = path
+        self.index_path = index_path
+        _ensure_file(path)
+        self.offsets: List[int] = []
+        # (id, type, tags) per row, persisted with the offsets
+        self._meta: List[Tuple[str, Any, List[str]]] = []
+        self.size = 0
+        self.crc = 0
+        self._mm: Optional[mmap.mmap] = None
+        self._mapped = 0
+        self._map()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def _map(self):
+        # (Re)map the whole file; appends extend it past the current mapping
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._mapped = os.path.getsize(self.path)
+        if self._mapped:
+            with open(self.path, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _load_index(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                idx = json.load(f)
+        except Exception:
+            return None
+        size = int(idx.get('size', 0))
+        if not size or self.checksum(size) != idx.get('crc'):
+            return None
+        return idx
+
+    def restore(self, size: int, crc: str) -> bool:
+        self._map()
+        if self._mapped != size:
+            return False
+        idx = self._load_index()
+        if not idx or int(idx['size']) != size or idx.get('crc') != crc:
+            return False
+        rows = idx.get('rows', [])
+        self.offsets = [off for _, off, _, _ in rows]
+        self._meta = [(eid, mtype, tags) for eid, _, mtype, tags in rows]
+        self.size = size
+        self.crc = int(crc, 16)
+        return True
+
+    def rows(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        self.offsets = []
+        self._meta = []
+        self._map()
+        pos = 0
+        crc = 0
+        idx = self._load_index()
+        if idx:
+            pos = int(idx['size'])
+            crc = int(idx['crc'], 16)
+            rows = idx.get('rows', [])
+            for i, (eid, off, mtype, tags) in enumerate(rows):
+                self.offsets.append(off)
+                self._meta.append((eid, mtype, tags))
+                end = rows[i + 1][1] if i + 1 < len(rows) else pos
+                yield end, {'id': eid, 'type': mtype, 'tags': tags}
+        mm = self._mm
+        while mm is not None and pos + _LEN.size <= self._mapped:
+            (n,) = _LEN.unpack_from(mm, pos)
+            end = pos + _LEN.size + n
+            if end > self._mapped:
+                break
+            entry = None
+            try:
+                entry = json.loads(mm[pos + _LEN.size:end])
+            except Exception:
+                pass
+            with memoryview(mm) as mv:
+                crc = zlib.crc32(mv[pos:end], crc)
+            if entry is not None:
+                self.offsets.append(pos)
+                self._meta.append((entry['id'], entry.get('type'), entry.get('tags', [])))
+                yield end, entry
+            pos = end
+        if pos < self._mapped:
+            # Torn write at the tail (crash mid-append); drop it so later appends stay aligned
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            os.truncate(self.path, pos)
+            self._map()
+        self.size = pos
+        self.crc = crc
+
+    def checksum(self, n: int) -> Optional[str]:
+        if n > self._mapped or self._mm is None:
+            return None
+        with memoryview(self._mm) as mv:
+            return f"{zlib.crc32(mv[:n]):08x}"
+
+    @staticmethod
+    def _encode(entries: Iterable[Dict[str, Any]], start: int, offsets: List[int], meta: list) -> bytearray:
+        buf = bytearray()
+        for e in entries:
+            data = json.dumps(e, ensure_ascii=False).encode('utf-8')
+            offsets.append(start + len(buf))
+            meta.append((e['id'], e.get('type'), e.get('tags', [])))
+            buf += _LEN.pack(len(data))
+            buf += data
+        return buf
+
+    def append(self, entries: List[Dict[str, Any]], sync: bool = False):
+        buf = self._encode(entries, self.size, self.offsets, self._meta)
+        with open(self.path, 'ab') as f:
+            f.write(buf)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        self.size += len(buf)
+        self.crc = zlib.crc32(buf, self.crc)
+
+    def get(self, row: int) -> Dict[str, Any]:
+        off = self.offsets[row]
+        if off >= self._mapped:
+            self._map()
+        (n,) = _LEN.unpack_from(self._mm, off)
+        return json.loads(self._mm[off + _LEN.size:off + _LEN.size + n])
+
+    def rewrite(self, entries: Iterable[Dict[str, Any]]):
+        tmp = self.path + '.tmp'
+        # entries may be read from the current mapping, so the new row index is built aside
+        offsets: List[int] = []
+        meta: list = []
+        crc = 0
+        size = 0
+        with open(tmp, 'wb') as f:
+            for e in entries:
+                buf = self._encode([e], size, offsets, meta)
+                f.write(buf)
+                size += len(buf)
+                crc = zlib.crc32(buf, crc)
+        # The mapping must be released before the file can be replaced on Windows
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        os.replace(tmp, self.path)
+        self._map()
+        self.offsets = offsets
+        self._meta = meta
+        self.size = size
+        self.crc = crc
+        self.save_index()
+
+    def save_index(self):
+        data = {
+            'size': self.size,
+            'crc': f"{self.crc:08x}",
+            'rows': [[eid, off, mtype, tags] for off, (eid, mtype, tags) in zip(self.offsets, self._meta)],
+        }
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
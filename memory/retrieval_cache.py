@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Bounded LRU cache of long-term retrieval results.
+# Keys are the query's sorted token multiset (retrieval ignores word order) plus the tag
+# filter and top_k, so rephrasings that tokenize the same share an entry. Only memory ids
+# are cached; records are re-read on a hit so field updates are always visible.
+# Entries are only valid for the df table they were scored with: idf is applied at query
+# time, so a new memory moves the weights, and with them the norms, of every stored memory
+# sharing a word with it, which can reorder queries that have none of its words. The owner
+# therefore clears the cache whenever df changes.
+
+Key = Tuple[Tuple[str, ...], Tuple[str, ...], int]
+
+
+class RetrievalCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._items: 'OrderedDict[Key, List[str]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Bumped by every invalidation; a result computed across a bump may be stale and is
+        # not stored (see put)
+        self.version = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(tokens: Iterable[str], tags: Optional[List[str]], top_k: int) -> Key:
+        return tuple(sorted(tokens)), tuple(sorted(set(t.lower() for t in tags or []))), top_k
+
+    def get(self, key: Key) -> Optional[List[str]]:
+        with self._lock:
+            ids = self._items.get(key)
+            if ids is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return ids
+
+    def put(self, key: Key, ids: List[str], version: Optional[int] = None):
+        # version: self.version read before the retrieval that produced ids
+        with self._lock:
+            if self.max_entries <= 0 or (version is not None and version != self.version):
+                return
+            self._items[key] = ids
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self.invalidations += len(self._items)
+            self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'invalidations': self.invalidations,
+            }
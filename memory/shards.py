@@ -0,0 +1,188 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from memory.long_term import LongTermMemory, BASE_DIR
+
+# Per-user long-term memory. Each user (or session) id gets its own LongTermMemory shard with
+# its own files under SHARDS_DIR/<id>/, so a retrieval only scores that user's memories.
+# Shards are opened on first use and kept in an LRU; once the loaded shards' estimated size
+# passes the cap (JARVIS_LTM_SHARD_MB), the least recently used ones are closed. A shard is
+# only closed while nobody holds a lease on it, so callers never see it shut underneath them,
+# and it stays in the map until its files are released, so a request for that user waits for
+# the close instead of opening the still-locked directory a second time.
+
+SHARDS_DIR = os.path.join(BASE_DIR, 'users')
+SHARD_MEMORY_MB = 512
+# At most this many shard directories are created under the root (JARVIS_LTM_MAX_SHARDS);
+# existing ones always open
+MAX_SHARDS = 1000
+
+
+class ShardLimitError(RuntimeError):
+    """A new shard would exceed the configured number of shard directories."""
+
+
+def shard_dir_name(user_id: str) -> str:
+    # Ids are used as directory names; anything unsafe is replaced, and a hash of the raw id
+    # keeps ids that sanitize to the same name apart
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', user_id)[:64].lstrip('.')
+    if safe != user_id or not safe:
+        safe = f"{safe}-{hashlib.blake2b(user_id.encode('utf-8'), digest_size=6).hexdigest()}"
+    return safe
+
+
+class _Shard:
+    __slots__ = ('ltm', 'leases', 'size', 'ready', 'error', 'closing', 'closed')
+
+    def __init__(self):
+        self.ltm: Optional[LongTermMemory] = None
+        self.leases = 0
+        self.size = 0
+        # set once the loading thread has opened the store (or failed to)
+        self.ready = threading.Event()
+        self.error: Optional[BaseException] = None
+        # evicted: no new leases; closed is set once the store is shut and out of the map
+        self.closing = False
+        self.closed = threading.Event()
+
+
+class ShardedMemory:
+    def __init__(self, root: Optional[str] = None, memory_mb: Optional[int] = None, max_shards: Optional[int] = None,
+                 **ltm_kwargs):
+        self.root = root or SHARDS_DIR
+        if memory_mb is None:
+            memory_mb = int(os.getenv('JARVIS_LTM_SHARD_MB', SHARD_MEMORY_MB))
+        self.max_bytes = memory_mb * 1024 * 1024
+        if max_shards is None:
+            max_shards = int(os.getenv('JARVIS_LTM_MAX_SHARDS', MAX_SHARDS))
+        self.max_shards = max_shards
+        # shard directories on disk (created ones are added as they are opened)
+        try:
+            self._dirs = {e.name for e in os.scandir(self.root) if e.is_dir()}
+        except OSError:
+            self._dirs = set()
+        self._ltm_kwargs = ltm_kwargs
+        self._shards: 'OrderedDict[str, _Shard]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    @contextmanager
+    def lease(self, user_id: str) -> Iterator[LongTermMemory]:
+        """The user's shard, loaded if needed and kept open until the block exits."""
+        shard = self._acquire(user_id)
+        try:
+            yield shard.ltm
+        finally:
+            with self._lock:
+                shard.leases -= 1
+
+    def _acquire(self, user_id: str) -> _Shard:
+        while True:
+            with self._lock:
+                shard = self._shards.get(user_id)
+                if shard is None or not shard.closing:
+                    load = shard is None
+                    if load:
+                        shard = self._shards[user_id] = _Shard()
+                    self._shards.move_to_end(user_id)
+                    shard.leases += 1
+                    break
+            # being evicted: reopen once its files are released
+            shard.closed.wait()
+        if load:
+            # opened outside the lock so other users are not blocked behind a large shard
+            try:
+                name = shard_dir_name(user_id)
+                with self._lock:
+                    if name not in self._dirs:
+                        if len(self._dirs) >= self.max_shards:
+                            raise ShardLimitError(f"no room for another memory shard ({self.max_shards} exist)")
+                        self._dirs.add(name)
+                shard.ltm = LongTermMemory.shared(root=os.path.join(self.root, name), **self._ltm_kwargs)
+                shard.size = shard.ltm.approx_bytes()
+            except BaseException as e:
+                shard.error = e
+                with self._lock:
+                    self._shards.pop(user_id, None)
+            shard.ready.set()
+            if shard.error is None:
+                with self._lock:
+                    self.loads += 1
+                self._evict()
+        else:
+            shard.ready.wait()
+        if shard.error is not None:
+            with self._lock:
+                shard.leases -= 1
+            raise shard.error
+        return shard
+
+    def _evict(self):
+        # Shards grow as they are used, so every loaded shard is re-measured here; this runs
+        # on loads only, which are rare next to queries
+        with self._lock:
+            loaded = [s for s in self._shards.values() if s.ltm is not None and not s.closing]
+        for s in loaded:
+            s.size = s.ltm.approx_bytes()
+        victims = []
+        with self._lock:
+            total = sum(s.size for s in loaded)
+            for uid, s in self._shards.items():
+                if total <= self.max_bytes:
+                    break
+                if s.leases or s.ltm is None or s.closing:
+                    continue
+                s.closing = True
+                total -= s.size
+                victims.append((uid, s))
+            self.evictions += len(victims)
+        for uid, s in victims:
+            try:
+                s.ltm.close()
+            finally:
+                with self._lock:
+                    if self._shards.get(uid) is s:
+                        del self._shards[uid]
+                s.closed.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            live = [s for s in self._shards.values() if not s.closing]
+            return {
+                'loaded': len(live),
+                'approx_bytes': sum(s.size for s in live),
+                'max_bytes': self.max_bytes,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            shards = list(self._shards.values())
+            self._shards.clear()
+        for s in shards:
+            s.ready.wait()
+            if s.closing:
+                # being closed by an eviction
+                s.closed.wait()
+            elif s.ltm is not None:
+                s.ltm.close()
+
+
+_default: Optional[ShardedMemory] = None
+_default_lock = threading.Lock()
+
+
+def default_shards() -> ShardedMemory:
+    # One shared set of shards per process
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ShardedMemory()
+        return _default
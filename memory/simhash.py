@@ -0,0 +1,52 @@
+import hashlib
+import struct
+from functools import lru_cache
+from typing import Iterable, List
+
+# 64-bit SimHash over a text's distinct tokens, used to spot near-duplicate memories.
+# Each token hash is "spread" so its 64 bits sit in 64 separate 32-bit lanes of one Python
+# int; summing the spread hashes then counts, per bit, how many tokens have it set, using
+# big-int additions instead of a 64-step loop per token. A fingerprint bit is set when
+# more than half of the tokens have it.
+
+BITS = 64
+# Fingerprints within MAX_DISTANCE bits must agree exactly on at least one of BANDS
+# 16-bit bands (pigeonhole), so an index keyed on the bands finds every such pair
+BANDS = 4
+BAND_BITS = BITS // BANDS
+MAX_DISTANCE = BANDS - 1
+
+_LANE = 32
+_SPREAD8 = [sum(((b >> i) & 1) << (_LANE * i) for i in range(8)) for b in range(256)]
+_COUNTS = struct.Struct(f'<{BITS}I')
+
+
+@lru_cache(maxsize=65536)
+def _spread(token: str) -> int:
+    h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+    s = 0
+    for i in range(8):
+        s |= _SPREAD8[(h >> (8 * i)) & 255] << (_LANE * 8 * i)
+    return s
+
+
+def simhash(tokens: Iterable[str]) -> int:
+    distinct = set(tokens)
+    if not distinct:
+        return 0
+    acc = sum(map(_spread, distinct))
+    n = len(distinct)
+    fp = 0
+    for bit, count in enumerate(_COUNTS.unpack(acc.to_bytes(BITS * _LANE // 8, 'little'))):
+        if 2 * count > n:
+            fp |= 1 << bit
+    return fp
+
+
+def bands(fp: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(fp >> (BAND_BITS * i)) & mask for i in range(BANDS)]
+
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
@@ -0,0 +1,211 @@
+import math
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ml.predict import predict_intent
+from ml.train import load_examples, load_corrections
+from nlp.preprocess import tokenize
+
+# Staged intent resolution for the chat path, cheapest first:
+#   nb   the Naive Bayes model (ml/predict.py), accepted at NB_THRESHOLD or for open_* intents
+#   nn   nearest example from data/intents.json (plus recorded corrections) by character
+#        3-gram cosine, accepted at a threshold calibrated on the examples themselves
+#   llm  nothing matched well enough; the caller falls back to the LLM / offline answer
+# Each stage's hits and the scores it saw are counted so the thresholds can be tuned.
+
+NB_THRESHOLD = 0.35
+# Intents the NB stage always accepts (the chat path has routed these regardless of confidence)
+NB_ALWAYS = ('open_app', 'open_website')
+# Calibration: the lowest threshold at which leave-one-out nearest-neighbour matches over the
+# examples are still this precise, kept within [NN_MIN_THRESHOLD, NN_MAX_THRESHOLD]. Out-of-
+# domain queries are not in the examples, so the floor guards against accepting them (they
+# score under 0.4 on data/intents.json). The cap is there because with a few examples per
+# intent, leave-one-out confusions between intents sharing a name ("close notepad" nearest to
+# "open notepad") drive the calibrated value to ~0.83, above in-domain paraphrases such as
+# "hello there" (0.71) or "bye for now" (0.58); which of those intents applies is the NB
+# stage's job, not this threshold's.
+NN_TARGET_PRECISION = 0.9
+NN_MIN_THRESHOLD = 0.5
+NN_MAX_THRESHOLD = 0.55
+HIST_BINS = 10
+
+
+def _grams(text: str) -> Dict[str, float]:
+    # "<word>" plus its 3-grams, so misheard or misspelt words still share most features
+    counts: Dict[str, float] = {}
+    for tok in tokenize(text):
+        w = f'<{tok}>'
+        for g in [w] + [w[i:i + 3] for i in range(len(w) - 2)]:
+            counts[g] = counts.get(g, 0.0) + 1.0
+    return counts
+
+
+class NearestExample:
+    """Cosine nearest neighbour over example utterances."""
+
+    def __init__(self, texts: Sequence[str], labels: Sequence[str]):
+        self._cols: Dict[str, int] = {}
+        self.labels: List[str] = []
+        self._rows: List[Dict[int, float]] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self.add(texts, labels)
+
+    def _vector(self, text: str, grow: bool) -> Tuple[Dict[int, float], float]:
+        feats = _grams(text)
+        # sub-linear counts so a repeated word does not swamp the rest; the norm includes
+        # grams no example has, so unfamiliar words lower the score
+        norm = math.sqrt(sum(feats.values()))
+        vec = {}
+        for g, c in feats.items():
+            col = self._cols.get(g)
+            if col is None and grow:
+                col = self._cols[g] = len(self._cols)
+            if col is not None:
+                vec[col] = math.sqrt(c) / norm
+        return vec, norm
+
+    def add(self, texts: Sequence[str], labels: Sequence[str]):
+        for text, label in zip(texts, labels):
+            vec, norm = self._vector(text, grow=True)
+            if norm:
+                self._rows.append(vec)
+                self.labels.append(label)
+        # small (examples x distinct grams), so it is simply rebuilt
+        m = np.zeros((len(self._rows), len(self._cols)), dtype=np.float32)
+        for i, vec in enumerate(self._rows):
+            m[i, list(vec)] = list(vec.values())
+        self._matrix = m
+
+    def scores(self, text: str) -> np.ndarray:
+        vec, norm = self._vector(text, grow=False)
+        q = np.zeros(self._matrix.shape[1], dtype=np.float32)
+        if vec:
+            q[list(vec)] = list(vec.values())
+        return self._matrix @ q
+
+    def nearest(self, text: str) -> Tuple[Optional[str], float]:
+        if not self.labels:
+            return None, 0.0
+        s = self.scores(text)
+        best = int(s.argmax())
+        return self.labels[best], float(s[best])
+
+    def calibrate(self, target_precision: float = NN_TARGET_PRECISION) -> Optional[float]:
+        """Lowest score at which leave-one-out matches reach target_precision (None if never)."""
+        if len(self.labels) < 2:
+            return None
+        sims = self._matrix @ self._matrix.T
+        np.fill_diagonal(sims, -1.0)
+        nearest = sims.argmax(axis=1)
+        best = sims[np.arange(len(nearest)), nearest]
+        correct = np.array([self.labels[j] == lab for j, lab in zip(nearest, self.labels)])
+        order = np.argsort(-best, kind='stable')
+        precision = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+        ok = np.flatnonzero(precision >= target_precision)
+        if not len(ok):
+            return None
+        return float(best[order[ok[-1]]])
+
+
+class _StageStats:
+    __slots__ = ('hits', 'seen', 'hist')
+
+    def __init__(self):
+        self.hits = 0
+        self.seen = 0
+        # scores this stage produced, accepted or not, in HIST_BINS buckets over [0, 1]
+        self.hist = [0] * HIST_BINS
+
+    def record(self, score: float, hit: bool):
+        self.seen += 1
+        self.hits += hit
+        self.hist[min(HIST_BINS - 1, max(0, int(score * HIST_BINS)))] += 1
+
+
+class IntentCascade:
+    def __init__(self, texts: Optional[Sequence[str]] = None, labels: Optional[Sequence[str]] = None,
+                 nb_threshold: Optional[float] = None, nn_threshold: Optional[float] = None):
+        if texts is None:
+            # the training examples plus recorded corrections, as ml/train.py reads them
+            texts, labels = load_examples()
+            extra_texts, extra_labels = load_corrections()
+            texts, labels = texts + extra_texts, labels + extra_labels
+        self.nn = NearestExample(texts, labels)
+        if nb_threshold is None:
+            nb_threshold = float(os.getenv('JARVIS_NB_THRESHOLD', NB_THRESHOLD))
+        self.nb_threshold = nb_threshold
+        if nn_threshold is None and os.getenv('JARVIS_NN_THRESHOLD'):
+            nn_threshold = float(os.getenv('JARVIS_NN_THRESHOLD'))
+        self.nn_calibrated = self.nn.calibrate()
+        if nn_threshold is None:
+            nn_threshold = min(NN_MAX_THRESHOLD, max(NN_MIN_THRESHOLD, self.nn_calibrated or 0.0))
+        self.nn_threshold = nn_threshold
+        self._lock = threading.Lock()
+        self._stats = {'nb': _StageStats(), 'nn': _StageStats()}
+        self.total = 0
+        self.fallbacks = 0
+
+    def add_examples(self, texts: Sequence[str], labels: Sequence[str]):
+        # e.g. corrections learned online; the threshold keeps its calibrated value
+        with self._lock:
+            self.nn.add(texts, labels)
+
+    def classify(self, text: str) -> Tuple[Optional[str], float, str]:
+        """(intent, confidence, stage); intent is None when stage is 'llm'."""
+        intent, confidence = predict_intent(text)
+        hit = confidence >= self.nb_threshold or intent in NB_ALWAYS
+        with self._lock:
+            self.total += 1
+            self._stats['nb'].record(confidence, hit)
+        if hit:
+            return intent, confidence, 'nb'
+
+        with self._lock:
+            intent, score = self.nn.nearest(text)
+            hit = intent is not None and score >= self.nn_threshold
+            self._stats['nn'].record(score, hit)
+            if not hit:
+                self.fallbacks += 1
+        if hit:
+            return intent, score, 'nn'
+        return None, confidence, 'llm'
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.total
+            out: Dict[str, Any] = {
+                'total': total,
+                'thresholds': {'nb': self.nb_threshold, 'nn': self.nn_threshold,
+                               'nn_calibrated': self.nn_calibrated},
+                'llm': {'hits': self.fallbacks, 'hit_rate': self.fallbacks / total if total else 0.0},
+            }
+            for name, s in self._stats.items():
+                out[name] = {
+                    'hits': s.hits,
+                    'seen': s.seen,
+                    # share of all utterances resolved here, and of those that reached this stage
+                    'hit_rate': s.hits / total if total else 0.0,
+                    'stage_hit_rate': s.hits / s.seen if s.seen else 0.0,
+                    'score_hist': list(s.hist),
+                }
+            return out
+
+
+_cascade: Optional[IntentCascade] = None
+_cascade_lock = threading.Lock()
+
+
+def get_cascade() -> IntentCascade:
+    global _cascade
+    if _cascade is None:
+        with _cascade_lock:
+            if _cascade is None:
+                _cascade = IntentCascade()
+    return _cascade
+
+
+def classify_intent(text: str) -> Tuple[Optional[str], float, str]:
+    return get_cascade().classify(text)
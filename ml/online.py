@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ml import predict
+from ml.predict import NumpyIntentModel
+from ml.train import INTENTS_PATH, CORRECTIONS_PATH, load_examples, load_corrections
+from nlp.preprocess import clean_text
+
+# Incremental intent learning. The learner keeps MultinomialNB's per-class token counts over
+# the vocabulary of the trained model (model.npz, or model.pkl without an export) and adds
+# each batch of corrected utterances to them. Tokens outside that vocabulary are ignored, as
+# the exported model ignores them, so a correction only moves the scores of words the model
+# already knows and utterances without any keep their intent and confidence. The class prior
+# is kept from training as well: corrections are the misclassified utterances, not a sample
+# of traffic. New words reach the model with the next full run of ml/train.py, which folds in
+# the corrections appended to CORRECTIONS_PATH; word_coverage() tells callers which words of a
+# correction are waiting for that.
+#
+# Every update publishes a new immutable NumpyIntentModel through predict.swap_model: requests
+# already scoring keep the model they started with, the next ones pick up the new one.
+
+# MultinomialNB's default smoothing, as fitted by ml/train.py
+ALPHA = 1.0
+
+
+def _base_model() -> NumpyIntentModel:
+    if os.path.exists(predict.NPZ_PATH):
+        return NumpyIntentModel.load(predict.NPZ_PATH)
+    if not os.path.exists(predict.MODEL_PATH):
+        raise FileNotFoundError('No trained intent model; run python -m ml.train first.')
+    sk = predict._SklearnIntentModel(predict.MODEL_PATH)
+    return NumpyIntentModel(
+        {t: int(i) for t, i in sk.vectorizer.vocabulary_.items()},
+        sk.model.class_log_prior_,
+        sk.model.feature_log_prob_,
+        np.asarray(sk.model.classes_, dtype=str),
+        token_pattern=sk.vectorizer.token_pattern,
+        lowercase=sk.vectorizer.lowercase,
+    )
+
+
+class OnlineIntentLearner:
+    def __init__(self, intents_path: str = INTENTS_PATH, corrections_path: Optional[str] = CORRECTIONS_PATH,
+                 base: Optional[NumpyIntentModel] = None):
+        self.corrections_path = corrections_path
+        self.base = base if base is not None else _base_model()
+        self._class_index = {str(c): i for i, c in enumerate(self.base.classes)}
+        self._lock = threading.Lock()
+        # Recounted from the training data rather than recovered from the exported log
+        # probabilities; corrections the export already includes are counted once either way
+        self._counts = np.zeros((len(self._class_index), len(self.base.vocab)), dtype=np.float64)
+        sentences, labels = load_examples(intents_path)
+        if corrections_path:
+            extra_sentences, extra_labels = load_corrections(corrections_path)
+            sentences += extra_sentences
+            labels += extra_labels
+        self._add_counts(sentences, labels)
+        self.updates = 0
+        self.model = self._snapshot()
+
+    @property
+    def intents(self) -> List[str]:
+        return list(self._class_index)
+
+    def word_coverage(self, text: str) -> Tuple[List[str], List[str]]:
+        """Distinct words of text the model knows, and those it has no column for; the latter
+        only count after a full retrain."""
+        vocab = self.base.vocab
+        words = list(dict.fromkeys(self.base._tokens(clean_text(text))))
+        return [t for t in words if t in vocab], [t for t in words if t not in vocab]
+
+    def _add_counts(self, sentences: Sequence[str], labels: Sequence[str]):
+        vocab = self.base.vocab
+        for text, label in zip(sentences, labels):
+            row = self._class_index.get(label)
+            if row is None:
+                continue
+            cols = [vocab[t] for t in self.base._tokens(text) if t in vocab]
+            np.add.at(self._counts[row], cols, 1.0)
+
+    def _snapshot(self) -> NumpyIntentModel:
+        # a fresh array per snapshot, so later updates never touch a published model
+        smoothed = self._counts + ALPHA
+        feature_log_prob = np.log(smoothed) - np.log(smoothed.sum(axis=1, keepdims=True))
+        base = self.base
+        return NumpyIntentModel(base.vocab, base.class_log_prior, feature_log_prob, base.classes,
+                                token_pattern=base._token_re.pattern, lowercase=base.lowercase)
+
+    def learn(self, texts: Sequence[str], intents: Sequence[str], persist: bool = True) -> NumpyIntentModel:
+        """Fold corrected (text, intent) pairs into the model and publish the result."""
+        if len(texts) != len(intents):
+            raise ValueError('texts and intents must have the same length')
+        unknown = sorted(set(intents) - set(self._class_index))
+        if unknown:
+            raise ValueError(f"unknown intent(s): {', '.join(unknown)}")
+        cleaned = [clean_text(t) for t in texts]
+        with self._lock:
+            if cleaned:
+                self._add_counts(cleaned, intents)
+                if persist and self.corrections_path:
+                    with open(self.corrections_path, 'a', encoding='utf-8') as f:
+                        for text, intent in zip(texts, intents):
+                            f.write(json.dumps({'text': text, 'intent': intent}, ensure_ascii=False) + '\n')
+                self.updates += len(cleaned)
+            self.model = self._snapshot()
+            predict.swap_model(self.model)
+            return self.model
+
+
+_learner: Optional[OnlineIntentLearner] = None
+_learner_lock = threading.Lock()
+
+
+def get_learner() -> OnlineIntentLearner:
+    # Built on the first correction (or on load when pending corrections exist)
+    global _learner
+    if _learner is None:
+        with _learner_lock:
+            if _learner is None:
+                _learner = OnlineIntentLearner()
+    return _learner
+
+
+def learn(texts: Sequence[str], intents: Sequence[str]) -> NumpyIntentModel:
+    return get_learner().learn(texts, intents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Feed a corrected utterance into the intent model.')
+    parser.add_argument('text')
+    parser.add_argument('intent')
+    args = parser.parse_args()
+
+    model = learn([args.text], [args.intent])
+    intent, confidence = model.predict(clean_text(args.text))
+    print(f"Recorded correction. Now predicted: {intent} ({confidence:.2f})")
+    _, unknown = get_learner().word_coverage(args.text)
+    if unknown:
+        print(f"Not in the model's vocabulary until the next python -m ml.train: {', '.join(unknown)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,154 @@
+import os
 import pickle
-from nlp.preprocess import clean_text
+import re
+import threading
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+from nlp.preprocess import clean_text, split_words, tokenize
+
+# Intent prediction from the model exported by ml/train.py. The NumPy artifact (model.npz:
+# vocabulary plus MultinomialNB log probabilities) is scored directly, so sklearn and scipy
+# are never imported; model.pkl is only used when no .npz export exists. Either is loaded on
+# the first prediction rather than at import. Corrections learned online (ml/online.py) are
+# published with swap_model; if some are newer than the export, the online model is rebuilt on load.
+
+BASE_DIR = os.path.dirname(__file__)
+MODEL_PATH = os.path.join(BASE_DIR, 'model.pkl')
+NPZ_PATH = os.path.join(BASE_DIR, 'model.npz')
+DEFAULT_TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+CORRECTIONS_PATH = os.path.join(BASE_DIR, '..', 'data', 'intent_corrections.jsonl')
+
+
+class NumpyIntentModel:
+    """CountVectorizer + MultinomialNB inference reimplemented over the exported arrays."""
+
+    def __init__(self, vocab: Dict[str, int], class_log_prior: np.ndarray, feature_log_prob: np.ndarray,
+                 classes: np.ndarray, token_pattern: str = DEFAULT_TOKEN_PATTERN, lowercase: bool = True):
+        self.vocab = vocab
+        self.class_log_prior = class_log_prior
+        # feature-major, so one token's log probabilities across classes are contiguous
+        self.feature_log_prob_t = np.ascontiguousarray(feature_log_prob.T)
+        self.classes = classes
+        self._token_re = re.compile(token_pattern)
+        self.lowercase = lowercase
+        # CountVectorizer's default tokens are the shared (memoized) tokens of two or more
+        # characters, except that it keeps underscores inside words
+        self._shared_tokens = lowercase and token_pattern == DEFAULT_TOKEN_PATTERN
+
+    @classmethod
+    def load(cls, path: str = NPZ_PATH) -> 'NumpyIntentModel':
+        with np.load(path) as z:
+            return cls(
+                {t: i for i, t in enumerate(z['vocab'].tolist())},
+                z['class_log_prior'],
+                z['feature_log_prob'],
+                z['classes'],
+                token_pattern=str(z['token_pattern']),
+                lowercase=bool(z['lowercase']),
+            )
+
+    def _tokens(self, text: str, split=tokenize):
+        if self._shared_tokens and '_' not in text:
+            return split(text)
+        return self._token_re.findall(text.lower() if self.lowercase else text)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        # single-character tokens are never in the vocabulary, so they need no filtering
+        cols = [self.vocab[t] for t in self._tokens(text) if t in self.vocab]
+        # joint log likelihood: prior + sum of token log probabilities (repeats count)
+        jll = self.class_log_prior + self.feature_log_prob_t[cols].sum(axis=0) if cols else self.class_log_prior
+        best = int(jll.argmax())
+        # max posterior = 1 / sum(exp(jll - jll_max))
+        return str(self.classes[best]), float(1.0 / np.exp(jll - jll[best]).sum())
+
+    def predict_many(self, texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # Token columns for the whole batch in CSR layout (indptr/cols), then a single gather
+        # of their log probabilities and a segmented sum per text
+        vocab, tokens = self.vocab, self._tokens
+        cols, indptr = [], [0]
+        for text in texts:
+            # uncached: a batch (log replay, evaluation) would only flush the shared cache
+            cols.extend([vocab[t] for t in tokens(text, split_words) if t in vocab])
+            indptr.append(len(cols))
+        indptr = np.asarray(indptr, dtype=np.int64)
+        n = len(indptr) - 1
+        jll = np.tile(self.class_log_prior, (n, 1))
+        if cols:
+            starts = indptr[:-1]
+            # reduceat needs in-range, non-empty segments; texts without known tokens keep the prior
+            nz = np.flatnonzero(indptr[1:] > starts)
+            jll[nz] += np.add.reduceat(self.feature_log_prob_t[np.asarray(cols, dtype=np.int64)], starts[nz], axis=0)
+        best = jll.argmax(axis=1)
+        top = jll[np.arange(n), best]
+        conf = 1.0 / np.exp(jll - top[:, None]).sum(axis=1)
+        return self.classes[best].astype(str), conf
+
+
+class _SklearnIntentModel:
+    # Fallback for a model.pkl without the NumPy export
+    def __init__(self, path: str = MODEL_PATH):
+        with open(path, "rb") as f:
+            self.vectorizer, self.model = pickle.load(f)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        X = self.vectorizer.transform([clean_text(text)])
+
+        probs = self.model.predict_proba(X)[0]
+        max_prob = max(probs)
+        intent = self.model.classes_[probs.argmax()]
+
+        return intent, max_prob
+
+    def predict_many(self, texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        probs = self.model.predict_proba(self.vectorizer.transform([clean_text(t) for t in texts]))
+        return np.asarray(self.model.classes_)[probs.argmax(axis=1)], probs.max(axis=1)
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def _pending_corrections() -> bool:
+    # corrections recorded after the last full training run are not in model.npz / model.pkl
+    if not os.path.exists(CORRECTIONS_PATH):
+        return False
+    exported = [os.path.getmtime(p) for p in (NPZ_PATH, MODEL_PATH) if os.path.exists(p)]
+    return not exported or os.path.getmtime(CORRECTIONS_PATH) > max(exported)
+
+
+def _load_model():
+    if _pending_corrections():
+        try:
+            from ml.online import get_learner
+            return get_learner().model
+        except ImportError:
+            pass
+    return NumpyIntentModel.load() if os.path.exists(NPZ_PATH) else _SklearnIntentModel()
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _load_model()
+    return _model
+
+
+def swap_model(model):
+    # A single reference assignment: callers that already fetched the old model finish with it
+    global _model
+    with _model_lock:
+        _model = model
 
-with open("ml/model.pkl", "rb") as f:
-    vectorizer, model = pickle.load(f)
 
 def predict_intent(text: str):
-    text = clean_text(text)
-    X = vectorizer.transform([text])
+    # Models normalize the text themselves; the NumPy model reuses the request's shared tokens
+    return get_model().predict(text)
 
-    probs = model.predict_proba(X)[0]
-    max_prob = max(probs)
-    intent = model.classes_[probs.argmax()]
 
-    return intent, max_prob
+def predict_intents(texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Batch form of predict_intent: arrays of intents and confidences, in input order."""
+    return get_model().predict_many(texts)
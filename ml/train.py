@@ -1,34 +1,104 @@
 import json
+import os
 import pickle
+from typing import TYPE_CHECKING, List, Tuple
 
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.naive_bayes import MultinomialNB
+import numpy as np
+
+if TYPE_CHECKING:
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.naive_bayes import MultinomialNB
 
 from nlp.preprocess import clean_text
 
+BASE_DIR = os.path.dirname(__file__)
+INTENTS_PATH = os.path.join(BASE_DIR, '..', 'data', 'intents.json')
+# Corrected utterances fed in through ml/online.py, one {"text", "intent"} object per line
+CORRECTIONS_PATH = os.path.join(BASE_DIR, '..', 'data', 'intent_corrections.jsonl')
+MODEL_PATH = os.path.join(BASE_DIR, 'model.pkl')
+# NumPy-only export used by ml/predict.py (no sklearn needed at inference time)
+NPZ_PATH = os.path.join(BASE_DIR, 'model.npz')
+
+
+def load_examples(path: str = INTENTS_PATH) -> Tuple[List[str], List[str]]:
+    with open(path, "r") as f:
+        intents = json.load(f)
+
+    sentences = []
+    labels = []
+
+    for intent, examples in intents.items():
+        for example in examples:
+            sentences.append(clean_text(example))
+            labels.append(intent)
+    return sentences, labels
+
+
+def load_corrections(path: str = CORRECTIONS_PATH) -> Tuple[List[str], List[str]]:
+    sentences = []
+    labels = []
+    if not os.path.exists(path):
+        return sentences, labels
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # torn last line from an interrupted append
+                continue
+            sentences.append(clean_text(rec['text']))
+            labels.append(rec['intent'])
+    return sentences, labels
+
+
+def train(sentences: List[str], labels: List[str]):
+    # sklearn is only needed to fit; ml/online.py reads the examples without it
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+
+    # Convert text to numbers
+    vectorizer = CountVectorizer()
+    X = vectorizer.fit_transform(sentences)
+
+    # Train model
+    model = MultinomialNB()
+    model.fit(X, labels)
+    return vectorizer, model
+
 
-# Load training data
-with open("data/intents.json", "r") as f:
-    intents = json.load(f)
+def export_npz(vectorizer: 'CountVectorizer', model: 'MultinomialNB', path: str = NPZ_PATH):
+    # Vocabulary in column order plus the fitted log probabilities; predict.py rebuilds the
+    # same scores from these with plain NumPy
+    vocab = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(
+            f,
+            vocab=np.asarray(vocab, dtype=str),
+            class_log_prior=model.class_log_prior_,
+            feature_log_prob=model.feature_log_prob_,
+            classes=np.asarray(model.classes_, dtype=str),
+            token_pattern=np.asarray(vectorizer.token_pattern),
+            lowercase=np.asarray(vectorizer.lowercase),
+        )
+    os.replace(tmp, path)
 
-sentences = []
-labels = []
 
-for intent, examples in intents.items():
-    for example in examples:
-        sentences.append(clean_text(example))
-        labels.append(intent)
+def main():
+    sentences, labels = load_examples()
+    # corrections made since the last run are folded into the full model
+    extra_sentences, extra_labels = load_corrections()
+    sentences += extra_sentences
+    labels += extra_labels
+    vectorizer, model = train(sentences, labels)
 
-# Convert text to numbers
-vectorizer = CountVectorizer()
-X = vectorizer.fit_transform(sentences)
+    # Save model
+    with open(MODEL_PATH, "wb") as f:
+        pickle.dump((vectorizer, model), f)
+    export_npz(vectorizer, model)
 
-# Train model
-model = MultinomialNB()
-model.fit(X, labels)
+    print("ML intent model trained and saved successfully.")
 
-# Save model
-with open("ml/model.pkl", "wb") as f:
-    pickle.dump((vectorizer, model), f)
 
-print("ML intent model trained and saved successfully.")
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,68 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Shared text normalization. Everything that inspects an utterance (intent scoring, affect,
+# question analysis, memory lookup) splits it with tokenize(), which is memoized, so the text
+# of a request is tokenized once however many of them look at it.
+
+# Typographic punctuation folded to ASCII, so "doesn’t" and "doesn't" read alike
+_ASCII_PUNCT = str.maketrans({
+    '\u2018': "'", '\u2019': "'", '\u201a': "'", '\u201b': "'",
+    '\u201c': '"', '\u201d': '"', '\u201e': '"',
+    '\u2013': '-', '\u2014': '-', '\u2212': '-',
+    '\u2026': '...', '\u00a0': ' ',
+})
+# Runs of letters and digits: \w without the underscore, i.e. exactly the str.isalnum characters
+_WORD_RE = re.compile(r'[^\W_]+')
+TOKEN_CACHE_SIZE = 4096
+
+
 def clean_text(text):
     return text.lower().strip()
+
+
+def normalize(text: str) -> str:
+    """Lowercased, typographic punctuation folded to ASCII, whitespace runs collapsed."""
+    return ' '.join(text.translate(_ASCII_PUNCT).lower().split())
+
+
+def split_words(text: str) -> List[str]:
+    """Lowercased word tokens; not memoized, for bulk text such as stored memories."""
+    # Lowercased per token: lowering the whole text first can introduce combining marks
+    # ("İ" -> "i̇") that would split a word
+    return [t.lower() for t in _WORD_RE.findall(text)]
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def tokenize(text: str) -> Tuple[str, ...]:
+    """split_words, memoized; a tuple because callers share the cached result."""
+    return tuple(split_words(text))
+
+
+Phrases = Dict[str, List[Tuple[str, ...]]]
+
+
+def compile_phrases(phrases: Iterable[str]) -> Phrases:
+    """Phrases as token sequences grouped by their first token, for has_phrase."""
+    compiled: Phrases = {}
+    for phrase in phrases:
+        toks = tuple(split_words(phrase))
+        if toks:
+            compiled.setdefault(toks[0], []).append(toks)
+    return compiled
+
+
+def has_phrase(tokens: Sequence[str], phrases: Phrases) -> bool:
+    """Whether any of the phrases occurs in tokens as whole consecutive words."""
+    for i, tok in enumerate(tokens):
+        for p in phrases.get(tok, ()):
+            if len(p) == 1 or tuple(tokens[i:i + len(p)]) == p:
+                return True
+    return False
+
+
+def starts_with_phrase(tokens: Sequence[str], phrases: Phrases) -> bool:
+    if not tokens:
+        return False
+    return any(tuple(tokens[:len(p)]) == p for p in phrases.get(tokens[0], ()))
@@ -0,0 +1,26 @@
+import pytest
+
+from memory import auth
+
+
+@pytest.fixture(autouse=True)
+def tokens_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(auth, 'API_TOKENS_PATH', str(tmp_path / 'api_tokens.json'))
+
+
+def test_token_names_its_user():
+    alice = auth.issue_api_token('alice')
+    admin = auth.issue_api_token('ops', admin=True)
+    assert auth.user_for_token(alice) == {'user_id': 'alice', 'admin': False}
+    assert auth.user_for_token(admin) == {'user_id': 'ops', 'admin': True}
+    assert auth.user_for_token(alice + 'x') is None
+    assert auth.user_for_token('') is None
+    # only the hash is stored
+    with open(auth.API_TOKENS_PATH, encoding='utf-8') as f:
+        assert alice not in f.read()
+
+
+@pytest.mark.parametrize('user_id', ['', '../etc', 'a' * 65, 'bob smith', 'x/y'])
+def test_unsafe_user_ids_are_refused(user_id):
+    with pytest.raises(ValueError):
+        auth.issue_api_token(user_id)
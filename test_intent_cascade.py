@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from ml import cascade
+from ml.cascade import IntentCascade, NearestExample, NN_MAX_THRESHOLD, NN_MIN_THRESHOLD
+
+
+@pytest.fixture
+def nb(monkeypatch):
+    # The NB stage's answer per text; anything else is an unsure guess
+    answers = {}
+    monkeypatch.setattr(cascade, 'predict_intent', lambda text: answers.get(text, ('time', 0.1)))
+    return answers
+
+
+def test_stages_run_cheapest_first(nb):
+    c = IntentCascade(['open it again', 'what time is it'], ['open_again', 'time'], nb_threshold=0.35, nn_threshold=0.5)
+    nb['what is the time'] = ('time', 0.9)
+    nb['open spotify'] = ('open_app', 0.2)
+    assert c.classify('what is the time') == ('time', 0.9, 'nb')
+    # open_* intents are taken from NB whatever their confidence
+    assert c.classify('open spotify') == ('open_app', 0.2, 'nb')
+    intent, score, stage = c.classify('open it agian')
+    assert (intent, stage) == ('open_again', 'nn') and score >= 0.5
+    assert c.classify('explain quantum physics') == (None, 0.1, 'llm')
+    stats = c.stats()
+    assert stats['total'] == 4
+    assert (stats['nb']['hits'], stats['nn']['seen'], stats['nn']['hits'], stats['llm']['hits']) == (2, 2, 1, 1)
+
+
+def test_calibration_is_the_lowest_score_still_precise_enough():
+    nn = NearestExample(['red apple', 'red apples', 'green pear', 'green pears', 'red pear'],
+                        ['apple', 'apple', 'pear', 'pear', 'apple'])
+    sims = nn._matrix @ nn._matrix.T
+    # leave-one-out matches, best first: the pears (right), the apples (right), then "red pear"
+    # to "green pear" (wrong), so precision is 1 down to the apples and 4/5 with all five
+    assert sims[2, 3] > sims[0, 1] > sims[4, 2] > max(sims[4, 0], sims[4, 1])
+    assert nn.calibrate(target_precision=0.9) == pytest.approx(float(sims[0, 1]))
+    assert nn.calibrate(target_precision=0.8) == pytest.approx(float(sims[4, 2]))
+    assert NearestExample(['only one'], ['x']).calibrate() is None
+
+
+def test_calibrated_threshold_keeps_paraphrases_off_the_llm(nb):
+    c = IntentCascade()
+    assert NN_MIN_THRESHOLD <= c.nn_threshold <= NN_MAX_THRESHOLD
+    for text, intent in [('hello there', 'greeting'), ('hi there', 'greeting'), ('good evening', 'greeting'),
+                         ('what time is it now', 'time'), ('bye for now', 'exit'), ('quit please', 'exit'),
+                         ('open it again', 'open_again'), ('close the browser', 'close_app')]:
+        assert c.classify(text)[::2] == (intent, 'nn'), text
+    for text in ['what is the capital of france', 'explain quantum physics', 'how are you']:
+        assert c.classify(text)[2] == 'llm', text
+
+
+def test_added_examples_resolve_without_moving_the_threshold(nb):
+    c = IntentCascade(['what time is it', 'close it'], ['time', 'close_app'], nn_threshold=0.6)
+    assert c.classify('shut down spotify')[2] == 'llm'
+    c.add_examples(['shut down spotify'], ['close_app'])
+    assert c.classify('shut down spotify')[::2] == ('close_app', 'nn')
+    assert c.classify('shut spotify down')[::2] == ('close_app', 'nn')
+    assert c.nn_threshold == 0.6
@@ -0,0 +1,112 @@
+import pytest
+
+pytest.importorskip('sklearn')
+
+from ml import predict
+from ml.train import load_examples, train, export_npz
+
+
+@pytest.fixture(scope='module')
+def models(tmp_path_factory):
+    sentences, labels = load_examples()
+    vectorizer, model = train(sentences, labels)
+    path = str(tmp_path_factory.mktemp('intent') / 'model.npz')
+    export_npz(vectorizer, model, path)
+    return sentences, vectorizer, model, predict.NumpyIntentModel.load(path)
+
+
+def _sklearn_predict(vectorizer, model, text):
+    probs = model.predict_proba(vectorizer.transform([text]))[0]
+    return model.classes_[probs.argmax()], max(probs)
+
+
+def test_numpy_matches_sklearn_on_training_examples(models):
+    sentences, vectorizer, model, engine = models
+    for text in sentences:
+        intent, conf = engine.predict(text)
+        expected_intent, expected_conf = _sklearn_predict(vectorizer, model, text)
+        assert intent == expected_intent
+        assert conf == pytest.approx(expected_conf, abs=1e-9)
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    'zzqx unknown words only',
+    'hello hello hello there',
+    'WHAT is the TIME right now?',
+    'please open youtube and tell me a joke',
+    'a b c',
+])
+def test_numpy_matches_sklearn_on_unseen_text(models, text):
+    _, vectorizer, model, engine = models
+    text = predict.clean_text(text)
+    intent, conf = engine.predict(text)
+    expected_intent, expected_conf = _sklearn_predict(vectorizer, model, text)
+    assert intent == expected_intent
+    assert conf == pytest.approx(expected_conf, abs=1e-9)
+
+
+def test_batch_matches_single_predictions(models):
+    sentences, _, _, engine = models
+    texts = sentences + ['', 'zzqx unknown words only', 'hello hello hello there']
+    intents, confidences = engine.predict_many(texts)
+    assert len(intents) == len(confidences) == len(texts)
+    for text, intent, conf in zip(texts, intents, confidences):
+        expected_intent, expected_conf = engine.predict(text)
+        assert intent == expected_intent
+        assert conf == pytest.approx(expected_conf, abs=1e-12)
+
+
+def test_online_learning_swaps_in_corrected_model(models, tmp_path, monkeypatch):
+    from ml.online import OnlineIntentLearner
+
+    monkeypatch.setattr(predict, '_model', None)
+    corrections = tmp_path / 'corrections.jsonl'
+    learner = OnlineIntentLearner(corrections_path=str(corrections), base=models[3])
+    text = 'open the calculator again'
+    target = next(i for i in learner.intents if i != learner.model.predict(text)[0])
+
+    before = learner.model
+    for _ in range(5):
+        learner.learn([text], [target])
+    assert predict.get_model() is learner.model is not before
+    assert predict.predict_intent(text)[0] == target
+    # the published snapshot is not changed by later updates
+    assert before.predict(text)[0] != target
+    assert len(corrections.read_text().splitlines()) == 5
+    # corrections are replayed when the learner is rebuilt
+    rebuilt = OnlineIntentLearner(corrections_path=str(corrections), base=models[3])
+    assert rebuilt.model.predict(text)[0] == target
+
+    with pytest.raises(ValueError):
+        learner.learn([text], ['no_such_intent'])
+
+
+def test_online_learning_matches_export_and_ignores_unknown_words(models, tmp_path, monkeypatch):
+    from ml.online import OnlineIntentLearner
+
+    monkeypatch.setattr(predict, '_model', None)
+    sentences, _, _, engine = models
+    learner = OnlineIntentLearner(corrections_path=str(tmp_path / 'corrections.jsonl'), base=engine)
+    for text in sentences:
+        assert learner.model.predict(text)[0] == engine.predict(text)[0]
+        assert learner.model.predict(text)[1] == pytest.approx(engine.predict(text)[1], abs=1e-9)
+
+    oov = ['how are you', 'i am bored', 'explain quantum physics']
+    before = [learner.model.predict(t) for t in oov]
+    learner.learn(['please close the notepad'], ['close_app'])
+    assert [learner.model.predict(t) for t in oov] == before
+    intents, confidences = learner.model.predict_many([])
+    assert len(intents) == len(confidences) == 0
+
+
+def test_online_learning_reports_words_left_for_the_retrain(models, tmp_path, monkeypatch):
+    from ml.online import OnlineIntentLearner
+
+    monkeypatch.setattr(predict, '_model', None)
+    learner = OnlineIntentLearner(corrections_path=str(tmp_path / 'corrections.jsonl'), base=models[3])
+    assert learner.word_coverage('Close zzqx, close it') == (['close', 'it'], ['zzqx'])
+    assert learner.word_coverage('zzqx qqqv') == ([], ['zzqx', 'qqqv'])
+    # recorded for the next retrain even though the model cannot use it yet
+    learner.learn(['zzqx qqqv'], ['exit'])
+    assert '"zzqx qqqv"' in (tmp_path / 'corrections.jsonl').read_text()
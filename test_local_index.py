@@ -0,0 +1,152 @@
+import json
+import math
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from core import local_index
+from core.local_index import K1, B, LocalIndex, MANIFEST
+
+# heading (the title, which is indexed too) and body per document
+DOCS = {
+    'a.md': ('one', 'cat cat dog'),
+    'b.md': ('two', 'cat bird bird bird bird bird'),
+    'c.md': ('three', 'dog'),
+    'd.md': ('four', 'fish fish fish'),
+}
+
+
+def write(docs_dir, name, title, body):
+    with open(os.path.join(docs_dir, name), 'w', encoding='utf-8') as f:
+        f.write(f'# {title}\n{body}\n')
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    docs_dir, index_dir = tmp_path / 'docs', tmp_path / 'index'
+    docs_dir.mkdir()
+    for name, (title, body) in DOCS.items():
+        write(str(docs_dir), name, title, body)
+    return str(docs_dir), str(index_dir)
+
+
+def open_index(dirs):
+    # searches never rescan the directory; the tests refresh explicitly
+    return LocalIndex(docs_dir=dirs[0], index_dir=dirs[1], refresh_interval=math.inf)
+
+
+def titles(index, query):
+    return [r['title'] for r in index.search(query, max_results=10)]
+
+
+def segments_on_disk(index_dir):
+    return sorted(n for n in os.listdir(index_dir) if n.startswith('seg_'))
+
+
+def test_ranking_matches_hand_computed_bm25(dirs):
+    index = open_index(dirs)
+    index.refresh()
+    # doc lengths (heading word included) 4, 7, 2, 4: avgdl 4.25, N 4
+    def bm25(tf, dl, df):
+        idf = math.log(1 + (4 - df + 0.5) / (df + 0.5))
+        return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / 4.25))
+    # "cat dog": one 1.679, three 0.885, two 0.548; "three" only has dog, but it is the
+    # shortest document, so it outranks "two"'s single cat
+    one = bm25(2, 4, 2) + bm25(1, 4, 2)
+    two = bm25(1, 7, 2)
+    three = bm25(1, 2, 2)
+    assert one > three > two
+    assert titles(index, 'cat dog') == ['one', 'three', 'two']
+    # "dog bird": bird is rarer (idf 1.204 against 0.693), so five birds in a long document win
+    assert bm25(5, 7, 1) > bm25(1, 2, 2) > bm25(1, 4, 2)
+    assert titles(index, 'dog bird') == ['two', 'three', 'one']
+    # question words are dropped while something else is left
+    assert titles(index, 'what is a cat?') == ['one', 'two']
+    assert titles(index, 'what') == []
+    assert titles(index, 'fish')[0] == 'four'
+
+
+def test_segments_are_reopened_without_reparsing(dirs, monkeypatch):
+    index = open_index(dirs)
+    assert index.refresh() == {'added': 4, 'removed': 0, 'docs': 4}
+    assert index.stats()['segments'] == 1
+    expected = index.search('cat dog')
+
+    def reparse(*args):
+        raise AssertionError('document parsed again')
+
+    monkeypatch.setattr(local_index, 'read_document', reparse)
+    index = open_index(dirs)
+    assert index.refresh() == {'added': 0, 'removed': 0, 'docs': 4}
+    assert [(r['title'], r['snippet']) for r in index.search('cat dog')] == \
+           [(r['title'], r['snippet']) for r in expected]
+    monkeypatch.undo()
+    # a changed file goes to a new segment, and its old version stops counting
+    write(dirs[0], 'c.md', 'three', 'dog dog and a cat')
+    os.remove(os.path.join(dirs[0], 'd.md'))
+    assert index.refresh() == {'added': 1, 'removed': 1, 'docs': 3}
+    assert index.stats()['segments'] == 2
+    assert titles(index, 'fish') == []
+    assert titles(index, 'cat')[:1] == ['one'] and set(titles(index, 'cat')) == {'one', 'two', 'three'}
+    reopened = open_index(dirs)
+    assert reopened.stats() == index.stats()
+    assert titles(reopened, 'dog cat') == titles(index, 'dog cat')
+
+
+def test_segments_past_the_limit_are_merged_from_stored_text(dirs, monkeypatch):
+    monkeypatch.setattr(local_index, 'MAX_SEGMENTS', 1)
+    index = open_index(dirs)
+    index.refresh()
+    before = titles(index, 'cat dog')
+    write(dirs[0], 'e.md', 'five', 'an owl')
+    assert index.refresh()['docs'] == 5
+    assert index.stats()['segments'] == 1
+    assert segments_on_disk(dirs[1]) == index._state.manifest['segments']
+    assert titles(index, 'cat dog') == before
+    assert titles(open_index(dirs), 'owl') == ['five']
+
+
+def test_interrupted_refresh_leaves_the_previous_index(dirs, monkeypatch):
+    index = open_index(dirs)
+    index.refresh()
+    with open(os.path.join(dirs[1], MANIFEST), encoding='utf-8') as f:
+        manifest = json.load(f)
+    write(dirs[0], 'e.md', 'five', 'an owl and a cat')
+
+    def crash(self, manifest):
+        # the new segment is written, but the manifest naming it is not
+        with open(os.path.join(self.index_dir, MANIFEST + '.tmp'), 'w') as f:
+            f.write('{"segm')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(LocalIndex, '_save_manifest', crash)
+    with pytest.raises(OSError):
+        index.refresh()
+    monkeypatch.undo()
+    assert len(segments_on_disk(dirs[1])) == 2
+    # neither the running index nor a reopened one sees the half-written segment
+    assert titles(index, 'owl') == []
+    reopened = open_index(dirs)
+    with open(os.path.join(dirs[1], MANIFEST), encoding='utf-8') as f:
+        assert json.load(f) == manifest
+    assert reopened.stats()['docs'] == 4 and titles(reopened, 'owl') == []
+    # and the unreferenced segment is gone
+    assert segments_on_disk(dirs[1]) == manifest['segments']
+    # every name in the manifest points at a live doc of a listed segment
+    for seg_name, doc, _, _ in manifest['files'].values():
+        assert seg_name in manifest['segments'] and doc < len(reopened._state.segments[seg_name].docs)
+    assert reopened.refresh()['added'] == 1
+    assert titles(reopened, 'owl') == ['five']
+
+
+def test_damaged_manifest_is_rebuilt(dirs):
+    index = open_index(dirs)
+    index.refresh()
+    with open(os.path.join(dirs[1], MANIFEST), 'w', encoding='utf-8') as f:
+        f.write('{"segments": [')
+    reopened = open_index(dirs)
+    assert reopened.stats()['docs'] == 0 and segments_on_disk(dirs[1]) == []
+    assert reopened.refresh()['added'] == 4
+    assert titles(reopened, 'cat dog') == ['one', 'three', 'two']
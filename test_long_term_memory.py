@@ -0,0 +1,258 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from core.context_manager import ContextManager
+from memory.long_term import LongTermMemory, StoreLockedError
+from memory.shards import ShardedMemory, ShardLimitError
+
+
+@pytest.fixture
+def ctx(tmp_path):
+    shards = ShardedMemory(root=str(tmp_path))
+    yield ContextManager(user_id='u', shards=shards)
+    shards.close()
+
+
+def test_cached_retrieval_follows_df_changes_from_unrelated_memories(ctx):
+    with ctx.memory() as ltm:
+        ltm.add('tea black')
+        ltm.add('tea green')
+    assert [h['text'] for h in ctx.retrieve('tea', top_k=1)] == ['tea black']
+    with ctx.memory() as ltm:
+        # no "tea", but "green" is now common, which lowers "tea green"'s norm
+        for i in range(3):
+            ltm.add(f'green apple number {i}')
+        direct = [h['text'] for h in ltm.retrieve('tea', top_k=1)]
+    assert direct == ['tea green']
+    assert [h['text'] for h in ctx.retrieve('tea', top_k=1)] == direct
+
+
+def test_cached_retrieval_sees_dense_matches(tmp_path):
+    shards = ShardedMemory(root=str(tmp_path), dense=True)
+    ctx = ContextManager(user_id='u', shards=shards)
+    with ctx.memory() as ltm:
+        ltm.add('the weather was nice today')
+    assert ctx.retrieve('what is my favorite color') == []
+    with ctx.memory() as ltm:
+        # misspelt, so it shares no word with the query; only the dense scorer matches it
+        ltm.add('favrite colr purple')
+        direct = [h['text'] for h in ltm.retrieve('what is my favorite color')]
+    assert direct == ['favrite colr purple']
+    assert [h['text'] for h in ctx.retrieve('what is my favorite color')] == direct
+    shards.close()
+
+
+def test_merged_duplicate_keeps_its_tags_and_extra_fields(tmp_path):
+    shards = ShardedMemory(root=str(tmp_path))
+    with shards.lease('u') as ltm:
+        first = ltm.add('buy milk and eggs', tags=['shopping'])
+        second = ltm.add('Buy milk and eggs!', tags=['urgent'], extra={'due': 'friday'})
+        assert second == first
+        assert [h['id'] for h in ltm.retrieve('milk', tags=['urgent'])] == [first]
+        assert [h['id'] for h in ltm.retrieve('milk', tags=['shopping'])] == [first]
+        assert ltm.get(first)['tags'] == ['shopping', 'urgent']
+        assert ltm.get(first)['due'] == 'friday'
+        # duplicates within one batch are merged the same way
+        ids = ltm.add_many([{'text': 'water the plants', 'tags': ['home']},
+                            {'text': 'Water the plants.', 'tags': ['daily']}])
+        assert ids[0] == ids[1]
+        assert ltm.get(ids[0])['tags'] == ['home', 'daily']
+    shards.close()
+    # the merged fields survive a reload
+    shards = ShardedMemory(root=str(tmp_path))
+    with shards.lease('u') as ltm:
+        assert [h['id'] for h in ltm.retrieve('milk', tags=['urgent'])] == [first]
+    shards.close()
+
+
+def test_preference_update_rescores_only_its_row(tmp_path):
+    shards = ShardedMemory(root=str(tmp_path))
+    with shards.lease('u') as ltm:
+        ltm.add_many([f'note number {i} about colours' for i in range(50)])
+        ltm.add_or_update_preference('color', 'green')
+        assert ltm.retrieve('green', top_k=1)[0]['text'] == 'preference:color=green'
+        ltm.add_or_update_preference('color', 'purple')
+        assert ltm.retrieve('purple', top_k=1)[0]['text'] == 'preference:color=purple'
+        assert all(h['text'] != 'preference:color=green' for h in ltm.retrieve('green'))
+        before = [h['id'] for h in ltm.retrieve('colours purple', top_k=10)]
+    shards.close()
+    shards = ShardedMemory(root=str(tmp_path))
+    with shards.lease('u') as ltm:
+        assert [h['id'] for h in ltm.retrieve('colours purple', top_k=10)] == before
+    shards.close()
+
+
+def test_reacquire_waits_for_an_evicted_shard_to_close(tmp_path, monkeypatch):
+    # no room for more than the leased shards: loading bob evicts alice
+    shards = ShardedMemory(root=str(tmp_path), memory_mb=0)
+    with shards.lease('alice') as ltm:
+        ltm.add('alice likes tea')
+    closing, release = threading.Event(), threading.Event()
+    real_close = LongTermMemory.close
+
+    def slow_close(self):
+        closing.set()
+        release.wait(10)
+        real_close(self)
+
+    monkeypatch.setattr(LongTermMemory, 'close', slow_close)
+    errors, hits = [], []
+
+    def run(user_id, query=None):
+        try:
+            with shards.lease(user_id) as ltm:
+                if query:
+                    hits.extend(h['text'] for h in ltm.retrieve(query))
+        except Exception as e:
+            errors.append(e)
+
+    evictor = threading.Thread(target=run, args=('bob',))
+    evictor.start()
+    assert closing.wait(10)
+    # alice's directory is still locked by the store being closed
+    reader = threading.Thread(target=run, args=('alice', 'tea'))
+    reader.start()
+    reader.join(0.2)
+    assert reader.is_alive()
+    release.set()
+    evictor.join(10)
+    reader.join(10)
+    assert errors == []
+    assert hits == ['alice likes tea']
+    assert shards.evictions >= 1
+    shards.close()
+
+
+def test_new_shards_stop_at_the_cap(tmp_path):
+    shards = ShardedMemory(root=str(tmp_path), max_shards=2)
+    for uid in ('alice', 'bob'):
+        with shards.lease(uid) as ltm:
+            ltm.add(f'{uid} was here')
+    with pytest.raises(ShardLimitError):
+        with shards.lease('carol'):
+            pass
+    shards.close()
+    # existing shards still open, including after a restart
+    shards = ShardedMemory(root=str(tmp_path), max_shards=2)
+    with shards.lease('bob') as ltm:
+        assert [h['text'] for h in ltm.retrieve('bob')] == ['bob was here']
+    with pytest.raises(ShardLimitError):
+        with shards.lease('carol'):
+            pass
+    shards.close()
+
+
+@pytest.mark.parametrize('dense', [False, True])
+def test_tag_filter_without_scipy(tmp_path, monkeypatch, dense):
+    # numpy alone: dense mode still decodes tag bitmaps, tf-idf falls back to the dict scorer
+    from memory import long_term
+    monkeypatch.setattr(long_term, 'sparse', None)
+    shards = ShardedMemory(root=str(tmp_path), dense=dense)
+    with shards.lease('u') as ltm:
+        ltm.add('pay the gas bill', tags=['bills'])
+        ltm.add('pay the gas station a visit', tags=['errands'])
+        assert [h['text'] for h in ltm.retrieve('pay the gas bill', tags=['bills'])] == ['pay the gas bill']
+        assert ltm.retrieve('pay the gas bill', tags=['nothing']) == []
+    shards.close()
+
+
+def test_one_shared_store_per_directory(tmp_path):
+    first = LongTermMemory.shared(root=str(tmp_path))
+    second = LongTermMemory.shared(root=str(tmp_path / '.'))
+    assert second is first
+    first.add('opened twice, stored once')
+    first.close()
+    # still open for the other holder
+    assert [h['text'] for h in second.retrieve('stored')] == ['opened twice, stored once']
+    second.close()
+    # released after the last close, so it can be opened again
+    third = LongTermMemory.shared(root=str(tmp_path))
+    assert third is not first and len(third) == 1
+    third.close()
+
+
+def test_store_open_in_another_process_is_refused(tmp_path):
+    script = ("import sys, time; from memory.long_term import LongTermMemory; "
+              "ltm = LongTermMemory(root=sys.argv[1]); print('open', flush=True); time.sleep(30)")
+    holder = subprocess.Popen([sys.executable, '-c', script, str(tmp_path)], stdout=subprocess.PIPE,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), text=True)
+    try:
+        assert holder.stdout.readline().strip() == 'open'
+        with pytest.raises(StoreLockedError):
+            LongTermMemory.shared(root=str(tmp_path))
+    finally:
+        holder.kill()
+        holder.wait()
+    LongTermMemory.shared(root=str(tmp_path)).close()
+
+
+def test_reopen_loads_the_saved_index(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    ltm = LongTermMemory(root=root)
+    ltm.add_many([f'note {i} about the garden' for i in range(30)])
+    kept = ltm.add('water the roses on sunday', tags=['garden'])
+    ltm.add_or_update_preference('color', 'green')
+    ltm.add_or_update_preference('color', 'purple')
+    queries = [('roses sunday', None), ('garden', ['garden']), ('purple', None)]
+    expected = [[h['id'] for h in ltm.retrieve(q, tags=t)] for q, t in queries]
+    ltm.close()
+
+    def rebuild(*args):
+        raise AssertionError('index rebuilt')
+
+    with monkeypatch.context() as m:
+        m.setattr(LongTermMemory, '_build_index', rebuild)
+        ltm = LongTermMemory(root=root)
+        assert [[h['id'] for h in ltm.retrieve(q, tags=t)] for q, t in queries] == expected
+        ltm.add('plant tulips in autumn')
+        ltm.close()
+        ltm = LongTermMemory(root=root)
+        assert [h['text'] for h in ltm.retrieve('tulips', top_k=1)] == ['plant tulips in autumn']
+        ltm.close()
+    # an update the saved index does not cover (written by a process that then crashed)
+    with open(os.path.join(root, 'long_term.updates.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'id': kept, 'set': {'deleted': True}}) + '\n')
+    ltm = LongTermMemory(root=root)
+    assert ltm.get(kept) is None
+    assert all(h['id'] != kept for h in ltm.retrieve('roses sunday'))
+    ltm.close()
+
+
+def test_compaction_copies_cold_vectors_from_the_log(tmp_path, monkeypatch):
+    from memory import long_term
+    monkeypatch.setattr(long_term, 'SEGMENT_MAX_RECORDS', 10)
+    monkeypatch.setattr(long_term, 'COMPACT_AFTER_SEGMENTS', 3)
+    ltm = LongTermMemory(root=str(tmp_path), hot_budget=20)
+    rederived = []
+    real_cold_vec = LongTermMemory._cold_vec
+    monkeypatch.setattr(LongTermMemory, '_cold_vec', lambda self, row: rederived.append(row) or real_cold_vec(self, row))
+    for i in range(12):
+        ltm.add_many([f'batch {i} item {j} {"xyz"[j % 3]}' for j in range(10)])
+        ltm.add_or_update_preference('color', f'shade{i}')
+    rederived.clear()
+    ltm.compact_embeddings()
+    assert rederived == []
+    log = {eid: vec for eid, vec, _ in ltm._emb_log.scan()}
+    for entry in ltm.iter_all():
+        assert ltm.vocab.unpack(log[entry['id']]) == ltm.vocab.unpack(ltm._pack(long_term._tok(entry['text'])))
+    ltm.close()
+
+
+def test_retrieve_many_matches_one_query_at_a_time(tmp_path):
+    shards = ShardedMemory(root=str(tmp_path))
+    with shards.lease('u') as ltm:
+        ltm.add_many([{'text': f'{fruit} number {i} in the {place}', 'tags': [place]}
+                      for i, (fruit, place) in enumerate((f, p) for f in ('apple', 'pear', 'plum')
+                                                          for p in ('kitchen', 'garden') for _ in range(5))])
+        ltm.add_or_update_preference('fruit', 'plum')
+        queries = ['apple kitchen', 'pear', 'plum garden number 3', 'nothing like it', 'apple apple pear']
+        for tags in (None, ['garden'], ['nothing']):
+            assert ltm.retrieve_many(queries, tags=tags, top_k=4) == [ltm.retrieve(q, tags=tags, top_k=4) for q in queries]
+    shards.close()
@@ -0,0 +1,53 @@
+from core.matcher import PhraseMatcher
+
+
+def names(matcher, text):
+    return [phrase for _, _, phrase, _ in matcher.finditer(text)]
+
+
+def test_overlapping_phrases_all_match_and_the_longest_wins():
+    m = PhraseMatcher((p, p) for p in ['visual studio', 'visual studio code', 'studio code', 'code'])
+    text = 'open visual studio code now'
+    # in order of their end; longest first among those ending together
+    assert names(m, text) == ['visual studio', 'visual studio code', 'studio code', 'code']
+    assert [(s, e) for s, e, _, _ in m.finditer(text)] == [(5, 18), (5, 23), (12, 23), (19, 23)]
+    assert m.longest(text) == ('visual studio code', 'visual studio code')
+    # equally long: the leftmost
+    m = PhraseMatcher((p, p) for p in ['chrome', 'safari'])
+    assert m.longest('safari or chrome') == ('safari', 'safari')
+
+
+def test_a_prefix_only_matches_as_a_whole_word():
+    m = PhraseMatcher([('calc', 'calc'), ('calculator', 'calculator')])
+    assert names(m, 'open calculator') == ['calculator']
+    assert names(m, 'open calc') == ['calc']
+    assert names(m, 'calcs and calc_tool') == []
+    assert m.longest('calculators') is None
+    # a phrase that starts inside another word does not count either
+    assert names(PhraseMatcher([('tube', 'yt')]), 'youtube') == []
+
+
+def test_punctuation_and_text_edges_bound_words():
+    m = PhraseMatcher([('notepad', 1), ('vs code', 2)])
+    assert names(m, 'notepad') == ['notepad']
+    assert names(m, '"notepad", please!') == ['notepad']
+    assert names(m, 'open (vs code).') == ['vs code']
+    assert names(m, 'notepad-plus') == ['notepad']
+    # underscores and digits are word characters
+    assert names(m, 'notepad_2 notepad2 2notepad') == []
+
+
+def test_case_is_folded_on_both_sides():
+    m = PhraseMatcher([('YouTube', 'video'), ('google chrome', 'browser')])
+    assert len(m) == 2
+    assert list(m.finditer('Open YOUTUBE')) == [(5, 12, 'youtube', 'video')]
+    assert m.longest('launch Google Chrome') == ('google chrome', 'browser')
+    # a repeated name differing only in case keeps the latest value
+    m = PhraseMatcher([('Spotify', 1), ('spotify', 2)])
+    assert len(m) == 1 and m.longest('SPOTIFY') == ('spotify', 2)
+
+
+def test_empty_matcher_and_empty_phrases_match_nothing():
+    assert names(PhraseMatcher(), 'anything') == []
+    m = PhraseMatcher([('', 'x')])
+    assert len(m) == 0 and m.longest('') is None
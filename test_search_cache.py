@@ -0,0 +1,26 @@
+from core.search_cache import SearchCache, make_key
+
+
+def test_key_folds_case_spacing_and_trailing_punctuation():
+    assert make_key('What is  the Capital of France?') == make_key('what is the capital of france')
+    assert make_key('what is the capital of france ?!') == make_key('what is the capital of france')
+
+
+def test_key_keeps_meaningful_punctuation():
+    for a, b in [('what is 2+2', 'what is 2-2'), ('what is 2+2', 'what is 2*2'),
+                 ('learn c++', 'learn c'), ('C# tutorial', 'c tutorial')]:
+        assert make_key(a) != make_key(b)
+
+
+def test_colliding_queries_are_fetched_separately():
+    cache = SearchCache(path=None)
+    fetched = []
+
+    def fetch(query, max_results):
+        fetched.append(query)
+        return [{'title': query, 'snippet': '', 'source': '', 'retrieved_at': ''}]
+
+    assert cache.get_or_fetch('what is 2+2', 5, fetch)[0]['title'] == 'what is 2+2'
+    assert cache.get_or_fetch('what is 2*2', 5, fetch)[0]['title'] == 'what is 2*2'
+    assert cache.get_or_fetch('What is 2+2?', 5, fetch)[0]['title'] == 'what is 2+2'
+    assert fetched == ['what is 2+2', 'what is 2*2']
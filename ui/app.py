@@ -3,7 +3,7 @@ from tkinter import scrolledtext
 import os
 from datetime import datetime
 
-from ml.predict import predict_intent
+from ml.cascade import classify_intent
 from core.router import route
 from voice.listen import listen
 from voice.speak import speak
@@ -11,7 +11,7 @@ from llm.chat import chat_with_llm
 
 from core.context_manager import ContextManager
 from core.question_normalizer import normalize_question
-from core.search_engine import search_web
+from core.search_engine import search_offline
 from core.verifier import verify_prime_minister
 from core.answer_generator import generate_final_answer
 from memory.state import get_last_open_app
@@ -20,7 +20,7 @@ from memory.state import get_last_open_app
 def offline_answer(user_input: str) -> str:
     try:
         q = normalize_question(user_input)
-        results = search_web(q, max_results=5)
+        results = search_offline(q, max_results=5)
         if not results:
             return "I couldn't retrieve any information right now."
         ql = q.lower()
@@ -118,11 +118,9 @@ class JarvisUI:
         self.append('user', user_input)
         self.ctx.push_user(user_input)
 
-        # Predict intent + confidence
-        intent, confidence = predict_intent(user_input)
-
-        # Low-confidence => online or offline fallback
-        low_conf = confidence < 0.35 and intent not in ["open_app", "open_website"]
+        # Naive Bayes, then nearest example; unresolved => online or offline fallback
+        intent, confidence, stage = classify_intent(user_input)
+        low_conf = stage == 'llm'
         response = None
         if low_conf:
             api_key_present = bool(os.getenv("OPENROUTER_API_KEY") or os.getenv("OPENAI_API_KEY"))
@@ -1,24 +1,97 @@
 from flask import Flask, request, jsonify, send_from_directory
 import os
 import threading
+from collections import OrderedDict
 
-from ml.predict import predict_intent
+from ml.predict import predict_intents
+from ml.cascade import classify_intent, get_cascade
 from core.router import route
 from llm.chat import chat_with_llm
 from core.context_manager import ContextManager
 from core.question_normalizer import normalize_question
-from core.search_engine import search_web
+from core.search_engine import search_offline, search_cache_stats
 from core.verifier import verify_prime_minister
 from core.answer_generator import generate_final_answer
+from memory.auth import user_for_token
+from memory.long_term import StoreLockedError
+from memory.shards import default_shards, ShardLimitError
 
 app = Flask(__name__, static_folder=None)
-ctx = ContextManager(short_window=8)
+# Requests without an API token share the default store, opened on the first such request so a
+# server only serving token holders leaves it to other processes (ui/app.py, memory.ingest)
+_default_ctx = None
+# One context (conversation window, retrieval cache) per authenticated user id, each over that
+# user's memory shard; the least recently active are dropped past MAX_USER_CONTEXTS
+MAX_USER_CONTEXTS = 256
+_user_contexts: 'OrderedDict[str, ContextManager]' = OrderedDict()
+_contexts_lock = threading.Lock()
+# Upper bound on texts per /api/intents request
+MAX_INTENT_BATCH = 1000
+
+
+class Unauthorized(Exception):
+    pass
+
+
+def _request_user():
+    # The caller's {user_id, admin} from an "Authorization: Bearer <token>" header (tokens are
+    # issued with python -m memory.auth token); None without one. User ids are never taken from
+    # the request itself, so a caller only reaches the shard its token names.
+    header = request.headers.get('Authorization', '')
+    if not header:
+        return None
+    scheme, _, token = header.partition(' ')
+    user = user_for_token(token.strip()) if scheme.lower() == 'bearer' else None
+    if user is None:
+        raise Unauthorized()
+    return user
+
+
+def _request_user_id():
+    user = _request_user()
+    return user['user_id'] if user else None
+
+
+@app.errorhandler(Unauthorized)
+def unauthorized(_):
+    return jsonify({"error": "Invalid or unknown API token."}), 401
+
+
+@app.errorhandler(StoreLockedError)
+def store_locked(e):
+    # another process (ui/app.py, an import) has the store open
+    return jsonify({"error": str(e)}), 503
+
+
+@app.errorhandler(ShardLimitError)
+def shard_limit(_):
+    return jsonify({"error": "No room for another user's memory right now."}), 503
+
+
+def context_for(user_id):
+    global _default_ctx
+    if not user_id:
+        with _contexts_lock:
+            if _default_ctx is None:
+                _default_ctx = ContextManager(short_window=8)
+            return _default_ctx
+    with _contexts_lock:
+        c = _user_contexts.get(user_id)
+        if c is None:
+            c = _user_contexts[user_id] = ContextManager(short_window=8, user_id=user_id)
+        _user_contexts.move_to_end(user_id)
+        dropped = []
+        while len(_user_contexts) > MAX_USER_CONTEXTS:
+            dropped.append(_user_contexts.popitem(last=False)[1])
+    for old in dropped:
+        old.close()
+    return c
 
 
 def offline_answer(user_input: str) -> str:
     try:
         q = normalize_question(user_input)
-        results = search_web(q, max_results=5)
+        results = search_offline(q, max_results=5)
         if not results:
             return "I couldn't retrieve any information right now."
         ql = q.lower()
@@ -41,7 +114,7 @@ def offline_answer(user_input: str) -> str:
 def add_cors(resp):
     resp.headers['Access-Control-Allow-Origin'] = request.headers.get('Origin', '*')
     resp.headers['Access-Control-Allow-Methods'] = 'GET,POST,OPTIONS'
-    resp.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
     return resp
 
 
@@ -52,10 +125,12 @@ def api_chat():
     if not text:
         return jsonify({"reply": "Please provide some text."})
 
+    ctx = context_for(_request_user_id())
     ctx.push_user(text)
 
-    intent, confidence = predict_intent(text)
-    low_conf = confidence < 0.35 and intent not in ["open_app", "open_website"]
+    # Naive Bayes, then nearest example; only unresolved utterances reach the LLM
+    intent, confidence, stage = classify_intent(text)
+    low_conf = stage == 'llm'
 
     reply = None
     if low_conf:
@@ -79,6 +154,67 @@ def api_chat():
     return jsonify({"reply": reply})
 
 
+@app.route('/api/intents', methods=['POST'])
+def api_intents():
+    # Intent + confidence for a batch of texts (log replay, offline evaluation) in one pass
+    data = request.get_json(silent=True) or {}
+    texts = data.get('texts')
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return jsonify({"error": "Provide 'texts' as a list of strings."}), 400
+    if len(texts) > MAX_INTENT_BATCH:
+        return jsonify({"error": f"At most {MAX_INTENT_BATCH} texts per request."}), 400
+    intents, confidences = predict_intents(texts)
+    return jsonify({"intents": intents.tolist(), "confidences": confidences.tolist()})
+
+
+@app.route('/api/intents/learn', methods=['POST'])
+def api_intents_learn():
+    # Corrected utterances: {"text", "intent"} or {"examples": [{"text", "intent"}, ...]}.
+    # The updated model replaces the current one for the next request; in-flight ones finish
+    # on the model they started with. It serves every user, so only admin tokens may change it.
+    user = _request_user()
+    if user is None:
+        return jsonify({"error": "An admin API token is required."}), 401
+    if not user['admin']:
+        return jsonify({"error": "Only admin tokens may correct the intent model."}), 403
+    data = request.get_json(silent=True) or {}
+    examples = data.get('examples')
+    if examples is None:
+        examples = [data]
+    if not isinstance(examples, list) or not all(
+            isinstance(e, dict) and isinstance(e.get('text'), str) and isinstance(e.get('intent'), str)
+            for e in examples):
+        return jsonify({"error": "Provide 'text' and 'intent', or 'examples' as a list of them."}), 400
+    from ml.online import get_learner
+    texts = [e['text'] for e in examples]
+    try:
+        learner = get_learner()
+        model = learner.learn(texts, [e['intent'] for e in examples])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (FileNotFoundError, ImportError):
+        # no model.npz, and no model.pkl (or no sklearn to read it)
+        return jsonify({"error": "Train the intent model first (python -m ml.train)."}), 503
+    get_cascade().add_examples(texts, [e['intent'] for e in examples])
+    intents, confidences = model.predict_many(texts)
+    # All examples are recorded for the next full retrain (python -m ml.train), which adds the
+    # words the model has no column for yet; only those with a known word changed it now
+    coverage = [learner.word_coverage(t) for t in texts]
+    return jsonify({"learned": sum(1 for known, _ in coverage if known), "recorded": len(texts),
+                    "unknown_words": [unknown for _, unknown in coverage],
+                    "intents": intents.tolist(), "confidences": confidences.tolist()})
+
+
+@app.route('/api/stats', methods=['GET'])
+def api_stats():
+    return jsonify({
+        "retrieval_cache": context_for(_request_user_id()).retrieval_stats(),
+        "shards": default_shards().stats(),
+        "intent_cascade": get_cascade().stats(),
+        "search_cache": search_cache_stats(),
+    })
+
+
 @app.route('/')
 def index():
     return send_from_directory(os.path.join(os.path.dirname(__file__), '..', 'web'), 'index.html')
@@ -91,4 +227,5 @@ def static_files(path):
 
 
 if __name__ == '__main__':
-    app.run(host='127.0.0.1', port=5000, debug=False)
+    # Requests are served on their own threads; LongTermMemory serializes writes itself
+    app.run(host='127.0.0.1', port=5000, debug=False, threaded=True)